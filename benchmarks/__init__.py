@@ -0,0 +1,6 @@
+"""Benchmarks for NatuStem (not part of the application).
+
+``overhead`` runs without a model, ``separation`` needs audio-separator.
+Results are written as JSON to ``benchmarks/results/``; ``compare`` flags
+cases that got slower between two result files.
+"""
@@ -0,0 +1,99 @@
+"""Helpers shared by the benchmarks: synthetic audio, timing, JSON results."""
+import array
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import wave
+from datetime import datetime, timezone
+from pathlib import Path
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+# A case counts as a regression when it got this much slower than the baseline
+DEFAULT_REGRESSION_THRESHOLD = 0.2
+
+
+def write_synthetic_wav(path, seconds, sample_rate=44100, channels=2, seed=0):
+    # A music-like test signal: a few harmonic "instruments", a kick-like pulse and some noise
+    rng = random.Random(seed)
+    voices = [(rng.uniform(80, 900), rng.uniform(0.05, 0.2)) for _ in range(4)]
+    frames = int(seconds * sample_rate)
+    block = sample_rate  # one second at a time, so memory stays small for long files
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        for block_start in range(0, frames, block):
+            samples = array.array("h")
+            for n in range(block_start, min(block_start + block, frames)):
+                t = n / sample_rate
+                value = sum(amp * math.sin(2 * math.pi * freq * t) for freq, amp in voices)
+                value += 0.3 * math.exp(-30 * (t % 0.5)) * math.sin(2 * math.pi * 55 * t)
+                value += rng.uniform(-0.02, 0.02)
+                sample = int(max(-1.0, min(1.0, value * 0.5)) * 32767)
+                samples.extend([sample] * channels)
+            if sys.byteorder == "big":
+                samples.byteswap()
+            f.writeframes(samples.tobytes())
+    return Path(path)
+
+
+def measure(func, repeat=5, number=1):
+    # Best and median wall time per call over `repeat` rounds of `number` calls
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - start) / number)
+    rounds.sort()
+    return {"best": rounds[0], "median": rounds[len(rounds) // 2], "repeat": repeat, "number": number}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "revision": git_revision(),
+    }
+
+
+def save_results(name, results, output=None):
+    # Writes {"benchmark", "created", "environment", "results"} and returns the path
+    document = {
+        "benchmark": name,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": environment(),
+        "results": results,
+    }
+    if output is None:
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        output = RESULTS_DIR / f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    output = Path(output)
+    output.write_text(json.dumps(document, indent=2), encoding="utf-8")
+    return output
+
+
+def compare_results(baseline, current, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    # Cases (matched by "name") whose "seconds" grew by more than `threshold`, as (name, old, new)
+    old = {case["name"]: case["seconds"] for case in baseline["results"] if case.get("seconds")}
+    regressions = []
+    for case in current["results"]:
+        before = old.get(case["name"])
+        if before and case.get("seconds") and case["seconds"] > before * (1 + threshold):
+            regressions.append((case["name"], before, case["seconds"]))
+    return regressions
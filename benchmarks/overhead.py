@@ -0,0 +1,215 @@
+"""Python-side overhead of a separation, without a model.
+
+    python -m benchmarks.overhead [--scale 1.0] [--output results.json]
+
+Measures the pieces of a job that run around the model at realistic volumes:
+the GUI log handler, the tqdm stderr parser, ``append_log``, the
+rename/move of the separator's outputs (with and without name collisions),
+and a small batch with a simulated model run, separated file by file and
+through the prefetch/model/publish pipeline.
+"""
+import argparse
+import io
+import logging
+import shutil
+import sys
+import tempfile
+import time
+from collections import deque
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import measure, save_results, write_synthetic_wav
+from natustem.cache import ResultCache
+from natustem.engine import SeparationEngine, SeparationSettings
+from natustem.logging_setup import GuiLogHandler
+from natustem.pipeline import run_pipeline
+from natustem.progress import StderrTqdmHandler
+
+# A job logs a few hundred lines; a long batch several thousand
+LOG_RECORDS = 5000
+# htdemucs_ft with shifts=2: 4 bag models x 2 shifts, ~300 tqdm updates each
+TQDM_PASSES = 8
+TQDM_UPDATES_PER_PASS = 300
+STEM_NAMES = ["Vocals", "Drums", "Bass", "Other"]
+# Existing vocal_1.wav ... files in the output folder for the collision case
+COLLISIONS = 50
+# Batch case: files per batch and the simulated inference time per file (the model is idle otherwise)
+BATCH_FILES = 6
+MODEL_SECONDS = 0.2
+
+
+def case(name, timing, operations):
+    return {
+        "name": name,
+        "seconds": timing["median"],
+        "best_seconds": timing["best"],
+        "operations": operations,
+        "per_operation_us": round(timing["median"] / operations * 1e6, 3),
+    }
+
+
+def bench_gui_log_handler(records, repeat):
+    lines = deque(maxlen=1000)
+    handler = GuiLogHandler(lines.append)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%H:%M:%S'))
+    logger = logging.getLogger("benchmarks.overhead.gui")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+
+    def run():
+        for i in range(records):
+            logger.info("Saved vocal_%d.wav", i)
+    try:
+        return case("gui_log_handler", measure(run, repeat), records)
+    finally:
+        logger.removeHandler(handler)
+
+
+def tqdm_lines(passes, updates, total=300.3):
+    for _ in range(passes):
+        for i in range(updates + 1):
+            done = total * i / updates
+            filled = int(10 * i / updates)
+            yield (f"\r{100 * i // updates:3d}%|{'█' * filled}{' ' * (10 - filled)}| {done:.2f}/{total} "
+                   f"[00:{i // 25:02d}<00:{(updates - i) // 25:02d},  9.17seconds/s]")
+        yield "\n"
+
+
+def bench_stderr_tqdm_handler(passes, updates, repeat):
+    lines = list(tqdm_lines(passes, updates))
+    updates_seen = []
+
+    def run():
+        handler = StderrTqdmHandler(updates_seen.append)
+        handler.original_stderr = io.StringIO()
+        for line in lines:
+            handler.write(line)
+    return case("stderr_tqdm_handler", measure(run, repeat), len(lines))
+
+
+def bench_append_log(records, repeat):
+    # The GUI's producer side; skipped where the GUI dependencies are not installed
+    try:
+        from main import AudioSeparatorApp
+    except ImportError as e:
+        return {"name": "append_log", "skipped": f"GUI not importable: {e}"}
+    app = AudioSeparatorApp()
+    app.page = object()
+
+    def run():
+        for i in range(records):
+            app.append_log(f"12:00:00 - INFO - Saved vocal_{i}.wav")
+        app.ui_batcher.pending_lines.clear()
+    return case("append_log", measure(run, repeat), records)
+
+
+def bench_move_outputs(name, root, source_wav, collisions, repeat):
+    engine = SeparationEngine(output_root=root / "output")
+    timings = []
+    for i in range(repeat):
+        output_dir = root / "output" / f"{name}-{i}"
+        output_dir.mkdir(parents=True)
+        for stem in STEM_NAMES:
+            target = stem.lower() if stem != "Vocals" else "vocal"
+            for n in range(collisions):
+                (output_dir / (f"{target}.wav" if n == 0 else f"{target}_{n}.wav")).touch()
+        files = []
+        for stem in STEM_NAMES:
+            file = f"song_({stem})_htdemucs_ft.wav"
+            shutil.copyfile(source_wav, output_dir / file)
+            files.append(file)
+        start = time.perf_counter()
+        engine.move_outputs(files, output_dir, log=lambda message: None)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return case(name, {"median": timings[len(timings) // 2], "best": timings[0]}, len(STEM_NAMES))
+
+
+class SimulatedSeparator:
+    # Sleeps for the "inference" and writes copies of a WAV as the stems, like the real Separator
+    def __init__(self, source_wav, model_seconds):
+        self.source_wav = source_wav
+        self.model_seconds = model_seconds
+        self.output_dir = None
+        self.demucs_params = {}
+
+    def load_model(self, model_filename):
+        pass
+
+    def separate(self, path):
+        time.sleep(self.model_seconds)
+        files = []
+        for stem in STEM_NAMES:
+            file = f"{Path(path).stem}_({stem})_htdemucs.wav"
+            shutil.copyfile(self.source_wav, Path(self.output_dir) / file)
+            files.append(file)
+        return files
+
+
+def bench_batch(name, root, source_wav, inputs, model_seconds, pipelined, repeat):
+    # Vocals + instrumental: deriving the instrumental is post-model work the pipeline overlaps with the next file
+    settings = SeparationSettings("htdemucs.yaml", stems=["vocals", "instrumental"])
+    timings = []
+    for i in range(repeat):
+        output_root = root / f"{name}-{i}"
+        separator = SimulatedSeparator(source_wav, model_seconds)
+        engine = SeparationEngine(output_root=output_root, separator_factory=lambda **kwargs: separator,
+                                  cache=ResultCache(output_root / ".cache"))
+        start = time.perf_counter()
+        if pipelined:
+            run_pipeline(engine, ((path, path, settings) for path in inputs), lambda key, result, error: None)
+        else:
+            for path in inputs:
+                engine.separate(path, settings, log=lambda message: None)
+        timings.append(time.perf_counter() - start)
+        shutil.rmtree(output_root, ignore_errors=True)
+    timings.sort()
+    return case(name, {"median": timings[len(timings) // 2], "best": timings[0]}, len(inputs))
+
+
+def run(scale=1.0, repeat=5):
+    records = max(1, int(LOG_RECORDS * scale))
+    updates = max(1, int(TQDM_UPDATES_PER_PASS * scale))
+    results = [
+        bench_gui_log_handler(records, repeat),
+        bench_stderr_tqdm_handler(TQDM_PASSES, updates, repeat),
+        bench_append_log(records, repeat),
+    ]
+    root = Path(tempfile.mkdtemp(prefix="natustem-bench-"))
+    try:
+        source_wav = write_synthetic_wav(root / "stem.wav", seconds=max(0.1, 2 * scale))
+        results.append(bench_move_outputs("move_outputs", root, source_wav, 0, repeat))
+        results.append(bench_move_outputs("move_outputs_collisions", root, source_wav, COLLISIONS, repeat))
+        inputs = []
+        for n in range(max(2, int(BATCH_FILES * min(scale, 1.0)))):
+            # Different content per file, so none of them is a result cache hit
+            inputs.append(write_synthetic_wav(root / f"input-{n}.wav", seconds=max(0.1, 2 * scale), seed=n + 1))
+        for name, pipelined in (("batch_sequential", False), ("batch_pipelined", True)):
+            results.append(bench_batch(name, root, source_wav, inputs, MODEL_SECONDS * scale, pipelined, repeat))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmarks.overhead", description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier for the workload sizes (default: 1)")
+    parser.add_argument("--repeat", type=int, default=5, help="rounds per case; the median is reported (default: 5)")
+    parser.add_argument("--output", help="JSON file to write (default: benchmarks/results/overhead-<time>.json)")
+    args = parser.parse_args(argv)
+
+    results = run(args.scale, args.repeat)
+    for result in results:
+        if "skipped" in result:
+            print(f"{result['name']:28} skipped ({result['skipped']})")
+        else:
+            print(f"{result['name']:28} {result['seconds'] * 1000:10.3f} ms  {result['per_operation_us']:10.3f} us/op")
+    print(f"Saved {save_results('overhead', results, args.output)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""Real-time factor of real separations on CPU.
+
+    python -m benchmarks.separation [--models htdemucs.yaml ...] [--shifts 0 1 2]
+                                    [--overlaps 0.1 0.25] [--duration 30]
+
+Separates a synthetic clip with every model in ``MODELS`` over a grid of
+shifts and overlap values and reports the real-time factor (processing time
+divided by audio duration; below 1 is faster than real time). Models are
+loaded once per model, outside the timed region. Needs audio-separator and
+downloads any missing model on first use.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import save_results, write_synthetic_wav
+from natustem.constants import MODELS
+from natustem.engine import SeparationEngine, SeparationSettings
+
+DEFAULT_SHIFTS = [0, 1, 2]
+DEFAULT_OVERLAPS = [0.1, 0.25, 0.5]
+
+
+def run(models, shifts_grid, overlap_grid, duration, log=print):
+    root = Path(tempfile.mkdtemp(prefix="natustem-bench-"))
+    # CPU only, so results compare across hosts with and without a GPU
+    os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+    results = []
+    try:
+        clip = write_synthetic_wav(root / "clip.wav", seconds=duration)
+        engine = SeparationEngine(output_root=root / "output")
+        for model in models:
+            for shifts in shifts_grid:
+                for overlap in overlap_grid:
+                    settings = SeparationSettings(model, shifts, overlap)
+                    name = f"separate/{model}/shifts={shifts}/overlap={overlap}"
+                    try:
+                        result = engine.separate(clip, settings, log=lambda message: None)
+                    except Exception as e:
+                        results.append({"name": name, "error": str(e)})
+                        log(f"{name:52} failed: {e}")
+                        continue
+                    seconds = result.timings["separate"]
+                    results.append({
+                        "name": name,
+                        "model": model,
+                        "shifts": shifts,
+                        "overlap": overlap,
+                        "audio_seconds": duration,
+                        "seconds": seconds,
+                        "rtf": round(seconds / duration, 4),
+                        "load_model_seconds": result.timings.get("load_model"),
+                    })
+                    log(f"{name:52} RTF {seconds / duration:.3f}")
+                    shutil.rmtree(result.output_dir, ignore_errors=True)
+        engine.stop()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmarks.separation", description=__doc__.splitlines()[0])
+    parser.add_argument("--models", nargs="+", default=list(MODELS), choices=sorted(MODELS))
+    parser.add_argument("--shifts", nargs="+", type=int, default=DEFAULT_SHIFTS)
+    parser.add_argument("--overlaps", nargs="+", type=float, default=DEFAULT_OVERLAPS)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of synthetic audio (default: 30)")
+    parser.add_argument("--output", help="JSON file to write (default: benchmarks/results/separation-<time>.json)")
+    args = parser.parse_args(argv)
+
+    try:
+        import audio_separator  # noqa: F401
+    except ImportError:
+        print("audio-separator is not installed; install requirements.txt to run this benchmark.", file=sys.stderr)
+        return 1
+    results = run(args.models, args.shifts, args.overlaps, args.duration)
+    print(f"Saved {save_results('separation', results, args.output)}")
+    return 0 if all("error" not in r for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""Startup time of the GUI: time to first window and to first ready model.
+
+    python -m benchmarks.startup [--repeat 3] [--gui] [--output results.json]
+
+Every case runs in a fresh interpreter, so nothing is already imported or
+cached in-process (the OS file cache stays warm after the first round):
+
+* ``import_gui``: ``import main``. The window is built right after it, so this
+  is what stands between a double-click and the window. It must not import
+  torch or audio-separator; the case records whether it did.
+* ``import_audio_stack``: ``import audio_separator.separator`` (torch,
+  onnxruntime), which the GUI now does in the background.
+* ``model_ready``: import plus ``Separator`` and ``load_model(DEFAULT_MODEL)``,
+  the work the first job used to pay for.
+* ``gui_window`` / ``gui_model_ready`` (with ``--gui``): the real GUI, started
+  with ``NATUSTEM_STARTUP_BENCHMARK`` set so it reports both times and closes.
+  Needs a display.
+
+Cases whose dependencies are not installed are reported as skipped.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import save_results
+from natustem.constants import DEFAULT_MODEL
+
+ROOT = Path(__file__).resolve().parent.parent
+# Modules that must stay out of the window's critical path
+HEAVY_MODULES = ("torch", "onnxruntime", "audio_separator")
+GUI_TIMEOUT = 600
+
+IMPORT_GUI = f"""
+import json, sys, time
+start = time.perf_counter()
+import main
+print(json.dumps({{"seconds": time.perf_counter() - start,
+                  "heavy_modules": sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules)}}))
+"""
+
+IMPORT_AUDIO_STACK = """
+import json, time
+start = time.perf_counter()
+from audio_separator.separator import Separator
+print(json.dumps({"seconds": time.perf_counter() - start}))
+"""
+
+MODEL_READY = f"""
+import json, logging, tempfile, time
+start = time.perf_counter()
+from audio_separator.separator import Separator
+imported = time.perf_counter()
+separator = Separator(log_level=logging.WARNING, output_dir=tempfile.mkdtemp())
+separator.load_model(model_filename={DEFAULT_MODEL!r})
+print(json.dumps({{"seconds": time.perf_counter() - start, "import_seconds": imported - start}}))
+"""
+
+
+def installed(module):
+    try:
+        return importlib.util.find_spec(module) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def run_snippet(code):
+    # Returns the JSON the snippet printed last, plus the wall time of the whole interpreter
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    report = json.loads(completed.stdout.strip().splitlines()[-1])
+    report["process_seconds"] = time.perf_counter() - start
+    return report
+
+
+def run_gui(output):
+    env = dict(os.environ, NATUSTEM_STARTUP_BENCHMARK=str(output))
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "main.py"], cwd=ROOT, env=env, capture_output=True, timeout=GUI_TIMEOUT, check=True)
+    report = json.loads(Path(output).read_text())
+    report["process_seconds"] = time.perf_counter() - start
+    return report
+
+
+def case(name, reports, key="seconds"):
+    rounds = sorted(report[key] for report in reports)
+    return {
+        "name": name,
+        "seconds": rounds[len(rounds) // 2],
+        "best_seconds": rounds[0],
+        "repeat": len(rounds),
+        "process_seconds": sorted(report["process_seconds"] for report in reports)[len(rounds) // 2],
+    }
+
+
+def bench_snippet(name, code, repeat, requires):
+    missing = [module for module in requires if not installed(module)]
+    if missing:
+        return {"name": name, "skipped": f"{', '.join(missing)} not installed"}
+    try:
+        reports = [run_snippet(code) for _ in range(repeat)]
+    except subprocess.CalledProcessError as e:
+        return {"name": name, "skipped": f"failed: {e.stderr.strip().splitlines()[-1] if e.stderr.strip() else e}"}
+    result = case(name, reports)
+    if "heavy_modules" in reports[0]:
+        result["heavy_modules"] = reports[0]["heavy_modules"]
+    if "import_seconds" in reports[0]:
+        result["import_seconds"] = sorted(report["import_seconds"] for report in reports)[len(reports) // 2]
+    return result
+
+
+def bench_gui(repeat):
+    names = ("gui_window", "gui_model_ready")
+    if not installed("flet"):
+        return [{"name": name, "skipped": "flet not installed"} for name in names]
+    reports = []
+    with tempfile.TemporaryDirectory(prefix="natustem-bench-") as root:
+        try:
+            for n in range(repeat):
+                reports.append(run_gui(Path(root) / f"startup-{n}.json"))
+        except (subprocess.SubprocessError, OSError, ValueError) as e:
+            return [{"name": name, "skipped": f"GUI did not report its startup times: {e}"} for name in names]
+    results = [case("gui_window", reports, "window")]
+    if all("model_ready" in report for report in reports):
+        results.append(case("gui_model_ready", reports, "model_ready"))
+    else:
+        results.append({"name": "gui_model_ready", "skipped": "the default model could not be loaded"})
+    return results
+
+
+def run(repeat, gui=False):
+    results = [
+        bench_snippet("import_gui", IMPORT_GUI, repeat, requires=["flet"]),
+        bench_snippet("import_audio_stack", IMPORT_AUDIO_STACK, repeat, requires=["audio_separator"]),
+        bench_snippet("model_ready", MODEL_READY, repeat, requires=["audio_separator"]),
+    ]
+    if gui:
+        results.extend(bench_gui(repeat))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmarks.startup", description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3, help="fresh processes per case; the median is reported (default: 3)")
+    parser.add_argument("--gui", action="store_true", help="also start the real GUI (needs a display)")
+    parser.add_argument("--output", help="JSON file to write (default: benchmarks/results/startup-<time>.json)")
+    args = parser.parse_args(argv)
+
+    results = run(args.repeat, args.gui)
+    for result in results:
+        if "skipped" in result:
+            print(f"{result['name']:20} skipped ({result['skipped']})")
+        else:
+            extra = f"  heavy imports: {', '.join(result['heavy_modules']) or 'none'}" if "heavy_modules" in result else ""
+            print(f"{result['name']:20} {result['seconds']:8.3f} s  (process {result['process_seconds']:.3f} s){extra}")
+    print(f"Saved {save_results('startup', results, args.output)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,98 +1,237 @@
+import time
+# Startup benchmark reference point: taken before anything else is imported
+STARTED = time.perf_counter()
+
 import flet as ft
-from audio_separator.separator import Separator
+import json
 import logging
+import os
+import sqlite3
 import threading
 import sys
 from pathlib import Path
-import re
+import itertools
 from collections import deque
-
-# Global constants
-LOG_FILE_NAME = "audio_separator.log"
-
-# Model configuration
-MODELS = {
-    "htdemucs_ft.yaml": "Fine-tuned Hybrid Transformer. Best overall quality (4 stems: Vocals, Drums, Bass, Other).",
-    "htdemucs.yaml": "Standard Hybrid Transformer. Good balance of speed and quality (4 stems).",
-    "htdemucs_6s.yaml": "6-Stem Hybrid Transformer. Adds Guitar and Piano separation.",
-    "hdemucs_mmi.yaml": "Hybrid Demucs v3. Older architecture, solid performance."
-}
-DEFAULT_MODEL = "htdemucs_ft.yaml"
-
-# Custom Logging Handler to redirect logs to Flet GUI
-class GuiLogHandler(logging.Handler):
-    def __init__(self, append_log_callback):
-        super().__init__()
-        self.append_log_callback = append_log_callback
-
-    def emit(self, record):
-        try:
-            # Save original exc_info, stack_info and exc_text to restore them later
-            orig_exc_info = record.exc_info
-            orig_stack_info = record.stack_info
-            orig_exc_text = record.exc_text
-
+from concurrent.futures import ThreadPoolExecutor
+
+from natustem.constants import (LOG_FILE_NAME, METRICS_FILE_NAME, RTF_HISTORY_FILE_NAME, MODELS, DEFAULT_MODEL, DEFAULT_CHUNK_SECONDS,
+                                DEFAULT_PREVIEW_SECONDS, WATCH_INPUT_DIR)
+from natustem.cache import ResultCache
+from natustem.cancellation import CANCELLED, PREEMPTED, CancelToken, JobCancelledError
+from natustem.cpu import ExecutionSettings, parse_cpu_list
+from natustem.audio import probe_duration
+from natustem.encoding import BIT_DEPTHS, FORMATS, EncoderPool, OutputFormat
+from natustem.engine import PendingSeparation, SeparationEngine, SeparationSettings
+from natustem.jobstore import PENDING, store_for
+from natustem.logging_setup import GuiLogHandler
+from natustem.metrics import describe as describe_metrics
+from natustem.model_store import ModelStore
+from natustem.models import describe_stats
+from natustem.preview import format_time, parse_time, preview_settings, preview_window, run_preview
+from natustem.progress import ProgressTracker, StderrTqdmHandler, expected_passes
+from natustem.stems import INSTRUMENTAL, SIX_STEMS, model_stems, normalize_stems
+from natustem.streaming import chunk_count
+from natustem.tuning import RtfHistory, tune
+from natustem.watch import FolderWatcher, ledger_for
+from natustem.worker import WorkerProcess, execution_options
+
+# audio_separator.separator pulls in torch and onnxruntime (seconds of imports), so it is imported on
+# first use by load_separator_class(), after the window is shown. Tests patch main.Separator.
+Separator = None
+
+# When set to a file path, the GUI writes its startup times there as JSON and closes once the
+# default model is ready (see benchmarks/startup.py)
+STARTUP_BENCHMARK_ENV = "NATUSTEM_STARTUP_BENCHMARK"
+
+
+def load_separator_class():
+    global Separator
+    if Separator is None:
+        from audio_separator.separator import Separator as separator_class
+        Separator = separator_class
+    return Separator
+
+# Modes of the CPU threads dropdown
+EXECUTION_DEFAULT = "Runtime default"
+EXECUTION_AUTO = "Auto (detect cores)"
+EXECUTION_MANUAL = "Manual"
+
+# Segment size dropdown: label -> SeparationSettings.segment_size (None plans it per job, see natustem.memory)
+SEGMENT_CHOICES = {"Auto (fit free memory)": None, "Model default": "Default", "6 s": 6, "4 s": 4, "2 s": 2}
+
+# Log view limits: number of lines kept on screen and maximum GUI refreshes per second
+LOG_MAX_LINES = 1000
+UI_MAX_FPS = 10
+
+# Collects log lines, status text and refresh requests from any thread and applies them
+# to the GUI in batches, at most max_fps times per second. Producers only append to a
+# deque and set an event, so the separation thread never waits on page.update().
+class UiUpdateBatcher:
+    def __init__(self, flush_callback, max_fps=UI_MAX_FPS, max_pending=LOG_MAX_LINES):
+        self.flush_callback = flush_callback
+        self.interval = 1.0 / max_fps
+        # Bounded: if the GUI falls far behind, the oldest lines are dropped (they would
+        # scroll out of the view anyway)
+        self.pending_lines = deque(maxlen=max_pending)
+        self.pending_status = None
+        self.clear_requested = False
+        self.update_requested = False
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.thread = None
+
+    def push_log(self, message):
+        self.pending_lines.append(message)
+        self.wakeup.set()
+
+    def push_status(self, message):
+        # Only the latest status matters
+        self.pending_status = message
+        self.wakeup.set()
+
+    def request_update(self):
+        self.update_requested = True
+        self.wakeup.set()
+
+    def clear(self):
+        self.pending_lines.clear()
+        self.clear_requested = True
+        self.wakeup.set()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+
+    def run(self):
+        while not self.stopped:
+            self.wakeup.wait()
+            self.wakeup.clear()
             try:
-                # Suppress stack traces for the GUI log handler to prevent information leakage
-                record.exc_info = None
-                record.stack_info = None
-                record.exc_text = None # Clear cached formatted exception
-
-                msg = self.format(record)
-                self.append_log_callback(msg)
-            finally:
-                # Restore original info so other handlers (like file handler) can use it
-                record.exc_info = orig_exc_info
-                record.stack_info = orig_stack_info
-                record.exc_text = orig_exc_text
-        except Exception:
-            self.handleError(record)
-
-# Stderr handler to capture tqdm progress
-class StderrTqdmHandler:
-    def __init__(self, status_callback):
-        self.status_callback = status_callback
-        self.original_stderr = sys.stderr
-        self.buffer = ""
-
-    def write(self, message):
-        # Pass through to original stderr
-        try:
-            self.original_stderr.write(message)
-        except (OSError, ValueError):
-            pass
-
-        self.buffer += message
-        # Process complete lines or carriage returns
-        if '\r' in self.buffer or '\n' in self.buffer:
-            # Split by either \r or \n
-            chunks = re.split(r'[\r\n]+', self.buffer)
-            self.buffer = chunks[-1] # Keep the last incomplete part
-
-            for chunk in chunks[:-1]:
-                clean_chunk = chunk.strip()
-                if not clean_chunk:
-                    continue
-                # Heuristic for tqdm progress bar: looks for percentage or iteration speed
-                if "%|" in clean_chunk or "it/s]" in clean_chunk:
-                    self.status_callback(clean_chunk)
+                self.flush()
+            except Exception:
+                logging.getLogger(__name__).debug("GUI refresh failed", exc_info=True)
+            # Cap the refresh rate; everything arriving meanwhile goes into the next batch
+            time.sleep(self.interval)
 
     def flush(self):
-        try:
-            self.original_stderr.flush()
-        except (OSError, ValueError):
-            pass
+        lines = []
+        while self.pending_lines:
+            try:
+                lines.append(self.pending_lines.popleft())
+            except IndexError:
+                break
+        status, self.pending_status = self.pending_status, None
+        clear, self.clear_requested = self.clear_requested, False
+        update, self.update_requested = self.update_requested, False
+        if lines or status is not None or clear or update:
+            self.flush_callback(lines, status, clear)
+
+# A single queued separation request. Settings are captured when the job is queued,
+# so the user can change the controls and queue more files while the worker runs.
+class SeparationJob:
+    PENDING = "Pending"
+    RUNNING = "Running"
+    # Separated; the stems are being encoded in the background while the next job runs
+    ENCODING = "Encoding"
+    DONE = "Done"
+    FAILED = "Failed"
+    CANCELLED = "Cancelled"
+
+    _ids = itertools.count(1)
+
+    def __init__(self, audio_file_path, settings):
+        self.id = next(self._ids)
+        self.audio_file_path = audio_file_path
+        self.settings = settings
+        self.status = self.PENDING
+        self.output_dir = None
+        # Urgent jobs run before everything else and preempt the running job
+        self.urgent = False
+        self.cancel_token = None
+        # Size and mtime of a file picked up from the watch folder (recorded in its ledger once finished)
+        self.watch_signature = None
+        # Row of this job in the persistent job store (output/.jobs.sqlite3), if it is open
+        self.store_id = None
+        # Preview jobs: (start, seconds) of the excerpt, and the settings of the full render it stands for
+        self.preview = None
+        self.full_settings = None
+
+    @property
+    def model_name(self):
+        return self.settings.model_name
+
+    def describe(self):
+        urgent = " (urgent)" if self.urgent else ""
+        if self.preview is not None:
+            start, seconds = self.preview
+            urgent += f" (preview {format_time(start)}-{format_time(start + seconds)})"
+        return f"#{self.id} {Path(self.audio_file_path).name} [{self.model_name}]{urgent} - {self.status}"
 
 class AudioSeparatorApp:
-    def __init__(self):
+    def __init__(self, metrics_path=METRICS_FILE_NAME):
+        self.page = None
         self.audio_file_path = None
+        self.audio_file_paths = []
         self.output_folder = None
         self.is_separating = False
         self.log_handler = None
         self.stderr_handler = None
-        self.logs = deque(maxlen=1000)
-        self.separator = None
-        self.loaded_model_name = None
+        self.logs = deque(maxlen=LOG_MAX_LINES)
+        self.ui_batcher = UiUpdateBatcher(self.apply_ui_batch)
+        # The engine holds the persistent Separator and the loaded model name.
+        # Resubmitted files are served from the result cache in output/.cache.
+        self.progress_tracker = None
+        # Per-job stage timings and resource usage are appended here (JSON lines); None records nothing
+        self.metrics_path = metrics_path
+        # Measured real-time factors on this host; the engines add to it after every job
+        self.rtf_history = RtfHistory()
+        # Model files live in models/ (see natustem.model_store); verified files are not re-hashed on load
+        self.model_store = ModelStore()
+        self.local_engine = SeparationEngine(separator_factory=self.create_separator, cache=ResultCache(Path("output") / ".cache"),
+                                             metrics_path=metrics_path, rtf_history=self.rtf_history, model_store=self.model_store)
+        # Optional out-of-process engine, created on first use; restarted when the execution settings change
+        self.worker_process = None
+        self.worker_restart_pending = False
+        self.engine = self.local_engine
+        # Job queue: self.jobs keeps every job for display, self.pending_jobs holds
+        # the ones still waiting. Both are guarded by queue_lock.
+        self.jobs = []
+        self.pending_jobs = deque()
+        self.queue_lock = threading.Lock()
+        self.worker_thread = None
+        self.current_job = None
+        # Window length for streaming mode (None = whole file at once), set by the streaming switch
+        self.chunk_seconds = None
+        # Demucs segment size of jobs created from now on, set by the segment dropdown
+        self.segment_size = None
+        # Per-file time budget in seconds when "Fit to target time" is on
+        self.target_seconds = None
+        self.durations = {}
+        self.prediction_text = None
+        # Format of the stems of jobs created from now on, and the pool that encodes them
+        self.output_format = OutputFormat()
+        self.encoder = EncoderPool()
+        # Multi-file pipeline: the next input is read ahead and the last job's stems are published
+        # in the background while the model runs (job id -> Future of its PrefetchedInput)
+        self.prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self.prefetched = {}
+        self.publisher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="publish")
+        self.publishing = None
+        # Stem name -> checkbox; no checkboxes (tests) means every stem
+        self.stem_checkboxes = {}
+        # Watch mode: files dropped into input/ are queued automatically
+        self.watcher = None
+        # Persistent record of every job, opened with the window; unfinished jobs of a crashed session can be resumed
+        self.job_store = None
+        # Background import of the audio stack and load of DEFAULT_MODEL, started once the window is shown.
+        # Cleared while it runs: the first job waits for it rather than load a second model alongside.
+        self.warmup_done = threading.Event()
+        self.warmup_done.set()
+        self.startup_times = {}
 
     def main(self, page: ft.Page):
         self.page = page
@@ -143,6 +282,11 @@ class AudioSeparatorApp:
             on_change=self.on_overlap_change, expand=True
         )
 
+        # Predicted runtime of the current selection; in target mode also the chosen settings
+        self.prediction_text = ft.Text(value="", size=12, italic=True, color=ft.Colors.GREY_500)
+        self.target_switch = ft.Switch(label="Fit to target time", value=False, on_change=self.on_target_change)
+        self.target_field = ft.TextField(label="Minutes per file", value="5", width=140, on_change=self.on_target_change)
+
         self.shifts_description = ft.Text("Higher = better quality but slower", size=12, italic=True, color=ft.Colors.GREY_500)
         self.overlap_description = ft.Text("Higher = smoother transitions but slower", size=12, italic=True, color=ft.Colors.GREY_500)
 
@@ -153,19 +297,106 @@ class AudioSeparatorApp:
             disabled=True
         )
 
-        # Indeterminate progress bar
+        self.isolation_switch = ft.Switch(
+            label="Run separation in a separate worker process",
+            value=False,
+            on_change=self.on_isolation_change
+        )
+
+        self.watch_switch = ft.Switch(
+            label=f"Watch the {WATCH_INPUT_DIR}/ folder and separate new files automatically",
+            value=False,
+            on_change=self.on_watch_change
+        )
+
+        self.streaming_switch = ft.Switch(
+            label=f"Stream long files in {DEFAULT_CHUNK_SECONDS} s chunks (bounded memory, resumable)",
+            value=False,
+            on_change=self.on_streaming_change
+        )
+        self.segment_dropdown = ft.Dropdown(
+            label="Segment size",
+            width=200,
+            options=[ft.dropdown.Option(label) for label in SEGMENT_CHOICES],
+            value=next(iter(SEGMENT_CHOICES)),
+            on_select=self.on_segment_change
+        )
+
+        self.format_dropdown = ft.Dropdown(
+            label="Output format",
+            width=150,
+            options=[ft.dropdown.Option(f) for f in FORMATS],
+            value=self.output_format.format,
+            on_select=self.on_format_change
+        )
+        self.bit_depth_dropdown = ft.Dropdown(
+            label="Bit depth",
+            width=120,
+            options=[ft.dropdown.Option(str(d)) for d in BIT_DEPTHS[self.output_format.format]],
+            value=str(self.output_format.bit_depth),
+            on_select=self.on_format_change
+        )
+
+        # Execution settings: torch thread counts and CPU affinity for the jobs started from now on
+        self.execution_dropdown = ft.Dropdown(
+            label="CPU threads",
+            width=200,
+            options=[ft.dropdown.Option(m) for m in (EXECUTION_DEFAULT, EXECUTION_AUTO, EXECUTION_MANUAL)],
+            value=EXECUTION_DEFAULT,
+            on_select=self.on_execution_change
+        )
+        self.intra_threads_field = ft.TextField(label="Intra-op threads", width=140, disabled=True, on_change=self.on_execution_change)
+        self.inter_threads_field = ft.TextField(label="Inter-op threads", width=140, disabled=True, on_change=self.on_execution_change)
+        self.cpus_field = ft.TextField(label="CPUs (e.g. 0-7)", width=160, disabled=True, on_change=self.on_execution_change)
+        self.execution_text = ft.Text(value="torch and onnxruntime pick their own thread counts", size=12, italic=True,
+                                      color=ft.Colors.GREY_500)
+
+        # Only the checked stems are written; Instrumental is derived as the mix minus the vocals
+        self.stem_checkboxes = {
+            stem: ft.Checkbox(label=stem, value=stem in model_stems(DEFAULT_MODEL), disabled=stem not in model_stems(DEFAULT_MODEL))
+            for stem in SIX_STEMS
+        }
+        self.stem_checkboxes[INSTRUMENTAL] = ft.Checkbox(label=INSTRUMENTAL, value=False)
+
+        self.cancel_btn = ft.Button(
+            "Cancel",
+            icon="stop",
+            on_click=self.cancel_click,
+            disabled=True
+        )
+
+        # Preview: a short excerpt of the selected file with cheaper settings, then the full render in one click
+        self.preview_start_field = ft.TextField(label="Preview from (m:ss)", value="0:30", width=150)
+        self.preview_length_dropdown = ft.Dropdown(
+            label="Seconds",
+            width=100,
+            options=[ft.dropdown.Option(str(s)) for s in (20, 25, 30)],
+            value=str(DEFAULT_PREVIEW_SECONDS)
+        )
+        self.preview_btn = ft.Button("Preview", icon="play_circle", on_click=self.preview_click)
+        self.render_full_btn = ft.Button("Render full track", icon="queue_music", on_click=self.render_full_click, disabled=True)
+        # The last finished preview job; "Render full track" separates its file with its full settings
+        self.last_preview = None
+
+        # Shown when the job store has jobs left over from a previous session
+        self.resume_btn = ft.Button(
+            "Resume unfinished jobs",
+            icon="restore",
+            on_click=self.resume_click,
+            visible=False
+        )
+
+        # Queue view: one line per job with its current status
+        self.queue_view = ft.Column(spacing=2)
+        self.queue_summary_text = ft.Text(value="Queue is empty", size=12, italic=True, color=ft.Colors.GREY_500)
+
+        # Indeterminate until the first tqdm update of a job, then determinate
         self.progress_bar = ft.ProgressBar(width=600, visible=False)
         self.status_text = ft.Text(value="", size=14, font_family="monospace")
+        self.model_status_text = ft.Text(value="", size=12, italic=True, color=ft.Colors.GREY_500)
 
-        self.log_output = ft.TextField(
-            label="Console Output",
-            multiline=True,
-            read_only=True,
-            min_lines=15,
-            max_lines=15,
-            text_size=12,
-            expand=True
-        )
+        # Log lines are appended as individual controls so each refresh only sends the new lines
+        self.log_output = ft.ListView(spacing=0, auto_scroll=True, expand=True)
 
         # Layout
         page.add(
@@ -174,7 +405,8 @@ class AudioSeparatorApp:
                     ft.Text("Audio Stem Separator", size=30, weight=ft.FontWeight.BOLD),
                     ft.Row([self.select_file_btn, self.file_path_text], alignment=ft.MainAxisAlignment.START),
                     ft.Column([
-                        ft.Row([self.model_dropdown], alignment=ft.MainAxisAlignment.START),
+                        ft.Row([self.model_dropdown, self.model_status_text], alignment=ft.MainAxisAlignment.START,
+                               vertical_alignment=ft.CrossAxisAlignment.CENTER),
                         ft.Container(content=self.model_description_text, padding=ft.padding.only(left=10))
                     ], spacing=0),
                     ft.Column([
@@ -185,12 +417,33 @@ class AudioSeparatorApp:
                         ft.Row([ft.Text("Overlap:", size=14, width=70), self.overlap_slider, self.overlap_value_text], vertical_alignment=ft.CrossAxisAlignment.CENTER),
                         ft.Container(content=self.overlap_description, padding=ft.padding.only(left=80)),
                     ], spacing=0),
-                    ft.Row([self.separate_btn], alignment=ft.MainAxisAlignment.START),
+                    ft.Row([self.target_switch, self.target_field, self.prediction_text], vertical_alignment=ft.CrossAxisAlignment.CENTER),
+                    ft.Row([self.separate_btn, self.cancel_btn, self.resume_btn, self.isolation_switch], alignment=ft.MainAxisAlignment.START),
+                    ft.Row([self.preview_start_field, self.preview_length_dropdown, self.preview_btn, self.render_full_btn],
+                           alignment=ft.MainAxisAlignment.START, vertical_alignment=ft.CrossAxisAlignment.CENTER),
+                    ft.Row([self.streaming_switch, self.segment_dropdown], vertical_alignment=ft.CrossAxisAlignment.CENTER),
+                    self.watch_switch,
+                    ft.Row([self.format_dropdown, self.bit_depth_dropdown], alignment=ft.MainAxisAlignment.START),
+                    ft.Column([
+                        ft.Row([self.execution_dropdown, self.intra_threads_field, self.inter_threads_field, self.cpus_field],
+                               alignment=ft.MainAxisAlignment.START),
+                        ft.Container(content=self.execution_text, padding=ft.padding.only(left=10))
+                    ], spacing=0),
+                    ft.Row([ft.Text("Stems:", size=14, width=70), *self.stem_checkboxes.values()], wrap=True),
+                    ft.Text("Queue:"),
+                    self.queue_summary_text,
+                    self.queue_view,
                     self.status_text,
                     self.progress_bar,
                     ft.Divider(),
                     ft.Text("Logs:"),
-                    self.log_output
+                    ft.Container(
+                        content=self.log_output,
+                        height=300,
+                        padding=10,
+                        border=ft.border.all(1, ft.Colors.GREY_700),
+                        border_radius=5
+                    )
                 ],
                 spacing=20,
                 expand=True
@@ -199,19 +452,108 @@ class AudioSeparatorApp:
 
         # Configure Logging
         self.setup_logging()
+        self.open_job_store()
 
         # Configure Stderr redirection
-        self.stderr_handler = StderrTqdmHandler(self.update_status)
+        self.stderr_handler = StderrTqdmHandler(self.on_progress)
         sys.stderr = self.stderr_handler
 
         # Restore stderr on window destroy
         # Note: page.on_close is available in newer flet versions, or window_destroy on desktop
         page.window.on_event = self.on_window_event
 
+        self.ui_batcher.start()
         page.update()
+        self.startup_times["window"] = time.perf_counter() - STARTED
+        logging.info(f"Window shown after {self.startup_times['window']:.2f} s.")
+        self.start_warmup()
+
+    def start_warmup(self):
+        # Imports torch/audio-separator and loads the default model while the user picks a file
+        self.warmup_done.clear()
+        self.set_model_status("Loading audio libraries...")
+        threading.Thread(target=self.warm_up, name="warmup", daemon=True).start()
+
+    def warm_up(self):
+        try:
+            load_separator_class()
+            self.set_model_status(f"Loading {DEFAULT_MODEL}...")
+            start = time.perf_counter()
+            self.local_engine.prepare(SeparationSettings(DEFAULT_MODEL), log=self.append_log)
+            self.startup_times["model_ready"] = time.perf_counter() - STARTED
+            self.set_model_status(f"Model ready ({time.perf_counter() - start:.1f} s)")
+            logging.info(f"{DEFAULT_MODEL} ready after {self.startup_times['model_ready']:.2f} s.")
+        except Exception as e:
+            # Not fatal: the first job loads the model itself and reports the error there
+            self.set_model_status("Model not preloaded")
+            logging.error(f"Could not preload {DEFAULT_MODEL}: {e}", exc_info=True)
+        finally:
+            self.warmup_done.set()
+            self.write_startup_benchmark()
+
+    def set_model_status(self, message):
+        if self.page:
+            self.model_status_text.value = message
+            self.request_ui_update()
+
+    def write_startup_benchmark(self):
+        path = os.environ.get(STARTUP_BENCHMARK_ENV)
+        if not path:
+            return
+        try:
+            Path(path).write_text(json.dumps(self.startup_times))
+        except OSError as e:
+            logging.error(f"Could not write startup times to {path}: {e}")
+        self.page.window.close()
+
+    def open_job_store(self):
+        try:
+            self.job_store = store_for("output")
+            # Jobs left running by a crashed or killed session go back to pending
+            self.job_store.recover()
+            unfinished = self.job_store.counts().get(PENDING, 0)
+        except (sqlite3.Error, OSError) as e:
+            logging.warning(f"Could not open the job store; jobs will not be resumable: {e}")
+            self.job_store = None
+            return
+        if unfinished:
+            self.resume_btn.text = f"Resume {unfinished} unfinished jobs"
+            self.resume_btn.visible = True
+            self.append_log(f"{unfinished} jobs from a previous session did not finish.")
+
+    def resume_click(self, e):
+        self.resume_btn.visible = False
+        jobs = []
+        for stored in self.job_store.jobs(states=(PENDING,)):
+            job = SeparationJob(str(stored.input_path), stored.settings)
+            job.store_id = stored.id
+            jobs.append(job)
+        if jobs and self.enqueue_jobs(jobs):
+            self.status_text.value = f"Resuming {len(jobs)} jobs..."
+            self.start_queue_worker()
+        self.request_ui_update()
+
+    def record_job_state(self, job, action, *args, **kwargs):
+        # Mirrors a job's state change into the job store; a store error never fails the job itself
+        if self.job_store is None or job.store_id is None:
+            return None
+        try:
+            return getattr(self.job_store, action)(job.store_id, *args, **kwargs)
+        except sqlite3.Error as e:
+            logging.warning(f"Could not record job #{job.id} in the job store: {e}")
+            return None
 
     def on_window_event(self, e):
         if e.data == "close":
+            self.ui_batcher.stop()
+            if self.watcher is not None:
+                self.watcher.stop()
+            # Publish and encode the stems of finished jobs rather than leave them half renamed
+            self.prefetcher.shutdown(wait=False, cancel_futures=True)
+            self.publisher.shutdown()
+            self.encoder.shutdown()
+            if self.worker_process is not None:
+                self.worker_process.stop()
             if self.stderr_handler and hasattr(self.stderr_handler, 'original_stderr'):
                 sys.stderr = self.stderr_handler.original_stderr
             self.page.window.destroy()
@@ -246,21 +588,172 @@ class AudioSeparatorApp:
 
     def on_shifts_change(self, e):
         self.shifts_value_text.value = str(int(e.control.value))
+        self.update_prediction()
         self.page.update()
 
     def on_overlap_change(self, e):
         self.overlap_value_text.value = f"{e.control.value:.2f}"
+        self.update_prediction()
         self.page.update()
 
     def on_model_change(self, e):
         selected_model = self.model_dropdown.value
         if selected_model in self.model_descriptions:
             self.model_description_text.value = self.model_descriptions[selected_model]
+            # Guitar and Piano only exist for the 6-stem model
+            available = model_stems(selected_model)
+            for stem in SIX_STEMS:
+                checkbox = self.stem_checkboxes.get(stem)
+                if checkbox is not None:
+                    if checkbox.disabled and stem in available:
+                        checkbox.value = True
+                    checkbox.disabled = stem not in available
+            self.update_prediction()
             self.page.update()
 
+    def on_target_change(self, e):
+        try:
+            minutes = float(self.target_field.value)
+        except (TypeError, ValueError):
+            minutes = 0
+        self.target_seconds = minutes * 60 if self.target_switch.value and minutes > 0 else None
+        # In target mode the sliders show the tuned settings
+        self.shifts_slider.disabled = self.overlap_slider.disabled = self.target_seconds is not None
+        self.update_prediction()
+        self.page.update()
+
+    def duration_of(self, path):
+        if path not in self.durations:
+            self.durations[path] = probe_duration(path)
+        return self.durations[path]
+
+    def tuned_settings(self, path):
+        # (shifts, overlap, prediction, fits) for one file in target mode
+        return tune(self.rtf_history, self.model_dropdown.value, self.duration_of(path), self.target_seconds)
+
+    def update_prediction(self):
+        # Shows the predicted runtime for the selected files before anything is queued
+        if self.prediction_text is None:
+            return
+        paths = self.audio_file_paths or ([self.audio_file_path] if self.audio_file_path else [])
+        if not paths:
+            self.prediction_text.value = ""
+            return
+        model = self.model_dropdown.value
+        if self.target_seconds is not None:
+            shifts, overlap, prediction, fits = self.tuned_settings(paths[0])
+            self.shifts_slider.value = shifts
+            self.shifts_value_text.value = str(shifts)
+            self.overlap_slider.value = overlap
+            self.overlap_value_text.value = f"{overlap:.2f}"
+            note = "" if fits else " - over budget even with the fastest settings"
+            self.prediction_text.value = f"Shifts {shifts}, overlap {overlap:.2f}: {prediction.describe()}{note}"
+            return
+        shifts, overlap = int(self.shifts_slider.value), round(self.overlap_slider.value, 2)
+        durations = [self.duration_of(path) for path in paths]
+        if None in durations:
+            prediction = self.rtf_history.predict(model, shifts, overlap)
+            self.prediction_text.value = f"Predicted: {prediction.describe()} (duration unknown)"
+            return
+        prediction = self.rtf_history.predict(model, shifts, overlap, sum(durations))
+        files_note = f" for {len(paths)} files" if len(paths) > 1 else ""
+        self.prediction_text.value = f"Predicted: {prediction.describe()}{files_note}"
+
+    def on_isolation_change(self, e):
+        # Applies to the next job; a running job finishes on the engine it started on
+        if e.control.value:
+            if self.worker_process is None:
+                self.worker_process = self.create_worker_process()
+            self.engine = self.worker_process
+        else:
+            self.engine = self.local_engine
+
+    def create_worker_process(self):
+        # The worker's thread counts and affinity are fixed on its command line
+        return WorkerProcess(cache_root=Path("output") / ".cache", progress_callback=self.on_progress,
+                             metrics_path=self.metrics_path, rtf_history_path=RTF_HISTORY_FILE_NAME,
+                             model_dir=self.model_store.root, offline=self.model_store.offline,
+                             **execution_options(self.local_engine.execution))
+
+    def on_execution_change(self, e):
+        # Applies from the next job on; every job's log shows the settings it ran with
+        manual = self.execution_dropdown.value == EXECUTION_MANUAL
+        for field in (self.intra_threads_field, self.inter_threads_field, self.cpus_field):
+            field.disabled = not manual
+        try:
+            self.set_execution(self.execution_from_controls())
+        except ValueError as err:
+            self.execution_text.value = f"Invalid setting: {err}"
+        self.page.update()
+
+    def execution_from_controls(self):
+        mode = self.execution_dropdown.value
+        if mode == EXECUTION_AUTO:
+            return ExecutionSettings(auto=True)
+        if mode != EXECUTION_MANUAL:
+            return None
+
+        def number(field):
+            text = (field.value or "").strip()
+            return int(text) if text else None
+        cpus = (self.cpus_field.value or "").strip()
+        return ExecutionSettings(number(self.intra_threads_field), number(self.inter_threads_field), parse_cpu_list(cpus) if cpus else None)
+
+    def set_execution(self, execution):
+        self.local_engine.execution = execution
+        self.execution_text.value = execution.resolve().describe() if execution is not None else "torch and onnxruntime pick their own thread counts"
+        # The worker process gets its settings on the command line: it is restarted before its next job
+        self.worker_restart_pending = self.worker_process is not None
+
+    def on_watch_change(self, e):
+        # Queued files use the settings of the controls at the moment they are picked up
+        if e.control.value:
+            if self.watcher is None:
+                self.watcher = FolderWatcher(WATCH_INPUT_DIR, ledger_for("output"))
+            self.watcher.start(self.enqueue_watched)
+            self.append_log(f"Watching {Path(WATCH_INPUT_DIR).resolve()} for new audio files.")
+        elif self.watcher is not None:
+            self.watcher.stop()
+            self.append_log("Stopped watching the input folder.")
+
+    def enqueue_watched(self, path):
+        # Called on the watcher thread for every file that has finished copying
+        job = self.create_job(str(path))
+        job.watch_signature = self.watcher.signature_of(path)
+        self.append_log(f"New file in {WATCH_INPUT_DIR}/: {path.name}")
+        if self.enqueue_jobs([job]):
+            self.start_queue_worker()
+
+    def record_watched(self, job):
+        if job.watch_signature is None or self.watcher is None:
+            return
+        status = {SeparationJob.DONE: "done", SeparationJob.ENCODING: "done", SeparationJob.FAILED: "failed",
+                  SeparationJob.CANCELLED: "cancelled"}.get(job.status)
+        if status is not None:  # A preempted job is back in the queue
+            self.watcher.ledger.record(job.audio_file_path, status, signature=job.watch_signature, output_dir=job.output_dir)
+
+    def on_streaming_change(self, e):
+        # Applies to jobs created from now on
+        self.chunk_seconds = DEFAULT_CHUNK_SECONDS if e.control.value else None
+
+    def on_segment_change(self, e):
+        # Applies to jobs created from now on; "Auto" lets the engine shrink segments or stream when memory is short
+        self.segment_size = SEGMENT_CHOICES[self.segment_dropdown.value]
+
+    def on_format_change(self, e):
+        # Applies to jobs created from now on; MP3 has no bit depth
+        format = self.format_dropdown.value
+        depths = BIT_DEPTHS[format]
+        self.bit_depth_dropdown.options = [ft.dropdown.Option(str(d)) for d in depths]
+        if self.bit_depth_dropdown.value not in {str(d) for d in depths}:
+            self.bit_depth_dropdown.value = str(depths[0]) if depths else None
+        self.bit_depth_dropdown.disabled = not depths
+        self.output_format = OutputFormat(format, int(self.bit_depth_dropdown.value or 16))
+        self.page.update()
+
     async def pick_files_click(self, e):
         files = await self.pick_files_dialog.pick_files(
-            allow_multiple=False,
+            allow_multiple=True,
             allowed_extensions=["mp3", "wav", "flac"],
             file_type=ft.FilePickerFileType.CUSTOM
         )
@@ -268,11 +761,16 @@ class AudioSeparatorApp:
 
     def pick_files_result(self, files):
         if files:
-            file_path = files[0].path
+            self.audio_file_paths = [f.path for f in files]
+            file_path = self.audio_file_paths[0]
             self.audio_file_path = file_path
-            self.file_path_text.value = file_path
+            if len(self.audio_file_paths) == 1:
+                self.file_path_text.value = file_path
+            else:
+                self.file_path_text.value = f"{len(self.audio_file_paths)} files selected"
             self.file_path_text.color = ft.Colors.WHITE
             self.separate_btn.disabled = False
+            self.update_prediction()
             self.page.update()
         else:
             self.file_path_text.value = "No file selected"
@@ -282,177 +780,404 @@ class AudioSeparatorApp:
 
     def append_log(self, message):
         if self.page:
-            self.logs.append(message)
-            self.log_output.value = "\n".join(self.logs) + "\n"
-            self.page.update()
+            self.ui_batcher.push_log(message)
 
     def update_status(self, message):
         if self.page:
-            self.status_text.value = message
-            self.page.update()
+            self.ui_batcher.push_status(message)
 
-    def start_separation(self, e):
-        if not self.audio_file_path:
+    def on_progress(self, progress):
+        # Called from the separation thread (rate-limited by StderrTqdmHandler)
+        tracker = self.progress_tracker
+        if tracker is None:
+            self.update_status(progress.line)
             return
+        self.progress_bar.value = tracker.update(progress)
+        self.update_status(tracker.describe(progress))
 
-        self.is_separating = True
-        self.separate_btn.disabled = True
-        self.select_file_btn.disabled = True
-        self.model_dropdown.disabled = True
-        self.shifts_slider.disabled = True
-        self.overlap_slider.disabled = True
-        self.progress_bar.visible = True
-        self.status_text.value = "Starting separation..."
-        self.log_output.value = "" # Clear logs
-        self.logs.clear()
+    def request_ui_update(self):
+        if self.page:
+            self.ui_batcher.request_update()
+
+    def apply_ui_batch(self, lines, status, clear):
+        # Runs on the batcher thread: one page.update() per batch
+        if clear:
+            self.logs.clear()
+            self.log_output.controls.clear()
+        if lines:
+            self.logs.extend(lines)
+            controls = self.log_output.controls
+            controls.extend(ft.Text(line, size=12, font_family="monospace", selectable=True) for line in lines)
+            excess = len(controls) - LOG_MAX_LINES
+            if excess > 0:
+                del controls[:excess]
+        if status is not None:
+            self.status_text.value = status
         self.page.update()
 
-        # Start separation in a separate thread
-        thread = threading.Thread(target=self.run_separation)
-        thread.daemon = True
-        thread.start()
-
-    def run_separation(self):
-        try:
-            input_path = Path(self.audio_file_path)
-
-            # Create output directory: output folder / [filename_no_ext]
-            output_dir = Path("output") / input_path.stem
-            output_dir.mkdir(parents=True, exist_ok=True)
-
-            self.append_log(f"Input file: {input_path}")
-            self.append_log(f"Output directory: {output_dir}")
-
-            model_name = self.model_dropdown.value
-            self.append_log(f"Selected model: {model_name}")
-
-            # Initialize Separator if not exists
-            # We use a fixed temporary directory for the persistent instance to avoid issues with
-            # output_dir not updating correctly on cached model instances.
-            temp_output_dir = Path("output") / ".tmp"
-            temp_output_dir.mkdir(parents=True, exist_ok=True)
-
-            if self.separator is None:
-                self.append_log("Initializing Separator instance (persistent)...")
-                self.separator = Separator(
-                    log_level=logging.INFO,
-                    output_format="WAV",
-                    output_dir=str(temp_output_dir),
-                    demucs_params={
-                        "segment_size": "Default",
-                        "segments_enabled": True
-                    }
-                )
-
-            # Ensure the separator is pointing to the temp directory
-            # This handles cases where we might have tried to change it before, or just to be safe.
-            self.separator.output_dir = str(temp_output_dir)
-
-            # Update parameters for this run
-            shifts_val = int(self.shifts_slider.value)
-            overlap_val = round(self.overlap_slider.value, 2)
-            self.append_log(f"Updating parameters -> Output: {output_dir} (via temp), Shifts: {shifts_val}, Overlap: {overlap_val}")
-
-            # Updating demucs_params. Note: The Separator class might use these during load_model or separate.
-            if hasattr(self.separator, 'demucs_params'):
-                self.separator.demucs_params["shifts"] = shifts_val
-                self.separator.demucs_params["overlap"] = overlap_val
-
-            # Load Model only if different
-            if self.loaded_model_name != model_name:
-                self.append_log(f"Loading model {model_name}...")
-                self.separator.load_model(model_filename=model_name)
-                self.loaded_model_name = model_name
-                self.append_log("Model loaded.")
+    def selected_stems(self):
+        # None (every stem) unless some stems are unchecked or Instrumental is checked
+        model = self.model_dropdown.value
+        checked = [stem for stem, checkbox in self.stem_checkboxes.items()
+                   if checkbox.value and not checkbox.disabled and (stem == INSTRUMENTAL or stem in model_stems(model))]
+        return normalize_stems(checked, model) if checked else None
+
+    def create_job(self, audio_file_path):
+        shifts, overlap = int(self.shifts_slider.value), round(self.overlap_slider.value, 2)
+        if self.target_seconds is not None:
+            # Tuned per file: the budget applies to each file's own duration
+            shifts, overlap, prediction, fits = self.tuned_settings(audio_file_path)
+            self.append_log(f"{Path(audio_file_path).name}: shifts {shifts}, overlap {overlap:.2f}, predicted {prediction.describe()}")
+        settings = SeparationSettings(
+            model_name=self.model_dropdown.value,
+            shifts=shifts,
+            overlap=overlap,
+            chunk_seconds=self.chunk_seconds,
+            output_format=self.output_format,
+            stems=self.selected_stems(),
+            segment_size=self.segment_size
+        )
+        return SeparationJob(audio_file_path, settings)
+
+    def enqueue_jobs(self, jobs):
+        # Returns True if the caller has to start a worker to drain the queue
+        if self.job_store is not None:
+            for job in jobs:
+                # Previews are throwaway: not recorded, never resumed
+                if job.store_id is None and job.preview is None:
+                    try:
+                        # Every submission is a new job, even for a file separated before
+                        job.store_id = self.job_store.add(job.audio_file_path, job.settings, reuse=False)[0].id
+                    except sqlite3.Error as e:
+                        logging.warning(f"Could not record job #{job.id} in the job store: {e}")
+        with self.queue_lock:
+            self.jobs.extend(jobs)
+            self.pending_jobs.extend(jobs)
+            start_worker = not self.is_separating
+            self.is_separating = True
+        self.refresh_queue_view()
+        return start_worker
+
+    def next_job(self):
+        # Drain in submission order, but prefer jobs for the model that is already
+        # loaded (then for any model still resident in the model cache) so
+        # load_model runs once per model rather than once per file.
+        with self.queue_lock:
+            if not self.pending_jobs:
+                # Cleared under the lock so enqueue_jobs never strands a job without a worker
+                self.is_separating = False
+                return None
+            job = self.peek_next_job()
+            self.pending_jobs.remove(job)
+            job.status = SeparationJob.RUNNING
+            return job
+
+    def peek_next_job(self):
+        # Caller holds queue_lock; None when nothing is pending
+        if not self.pending_jobs:
+            return None
+        job = next((j for j in self.pending_jobs if j.urgent), None)
+        if job is None:
+            # Someone is waiting to audition a preview; it only takes seconds
+            job = next((j for j in self.pending_jobs if j.preview is not None), None)
+        if job is None:
+            job = next((j for j in self.pending_jobs if j.model_name == self.engine.loaded_model_name), None)
+        if job is None:
+            resident = self.engine.resident_models()
+            job = next((j for j in self.pending_jobs if j.model_name in resident), self.pending_jobs[0])
+        return job
+
+    def prefetch_next_job(self):
+        # Reads (and hashes) the input that is likely to run next while the current job is in the model
+        if not isinstance(self.engine, SeparationEngine):
+            return
+        with self.queue_lock:
+            job = self.peek_next_job()
+            if job is None or job.preview is not None or job.id in self.prefetched:
+                return
+            # Only one input is read ahead
+            self.prefetched = {job.id: self.prefetcher.submit(self.engine.prefetch, job.audio_file_path, job.settings)}
+
+    def take_prefetched(self, job):
+        with self.queue_lock:
+            future = self.prefetched.pop(job.id, None)
+        return future.result() if future is not None else None
+
+    def wait_for_publish(self):
+        # At most one separated job waits for its stems to be renamed and cached
+        if self.publishing is not None:
+            self.publishing.result()
+            self.publishing = None
+
+    def refresh_queue_view(self):
+        if not self.page:
+            return
+        with self.queue_lock:
+            jobs = list(self.jobs)
+            pending = len(self.pending_jobs)
+        self.queue_view.controls = [self.job_row(job) for job in jobs]
+        done = sum(1 for job in jobs if job.status in (SeparationJob.DONE, SeparationJob.FAILED, SeparationJob.CANCELLED))
+        self.queue_summary_text.value = f"{done}/{len(jobs)} finished, {pending} pending" if jobs else "Queue is empty"
+        self.request_ui_update()
+
+    def job_row(self, job):
+        controls = [ft.Text(job.describe(), size=12, font_family="monospace", expand=True)]
+        if job.status == SeparationJob.PENDING:
+            controls.append(ft.IconButton(icon="bolt", tooltip="Run next (preempts the running job)", on_click=lambda e, job=job: self.preempt_job(job)))
+        if job.status in (SeparationJob.PENDING, SeparationJob.RUNNING):
+            controls.append(ft.IconButton(icon="close", tooltip="Cancel", on_click=lambda e, job=job: self.cancel_job(job)))
+        return ft.Row(controls, spacing=0)
+
+    def cancel_click(self, e):
+        job = self.current_job
+        if job is not None:
+            self.cancel_job(job)
+
+    def cancel_job(self, job):
+        with self.queue_lock:
+            if job in self.pending_jobs:
+                self.pending_jobs.remove(job)
+                job.status = SeparationJob.CANCELLED
+                self.record_job_state(job, "cancel")
+                running = False
             else:
-                self.append_log(f"Model {model_name} already loaded.")
-
-            # Separate
-            self.append_log(f"Separating {input_path.name}...")
-            # Files will be generated in temp_output_dir
-            output_files = self.separator.separate(str(input_path))
-
-            self.append_log(f"Separation complete! Moving and renaming files...")
-
-            # Post-processing rename logic
-            # Expected outputs from htdemucs usually follow pattern:
-            # {input_filename}_(Vocals)_{model_name}.wav
-            # We want: vocal.wav, bass.wav, drums.wav, other.wav
-
-            renamed_files = []
-
-            # Mapping of keyword in filename -> desired filename
-            # Note: htdemucs output names can vary, but usually contain the stem name in parens or appended
-            rename_map = {
-                "Vocals": "vocal.wav",
-                "Drums": "drums.wav",
-                "Bass": "bass.wav",
-                "Other": "other.wav",
-                "Guitar": "guitar.wav",
-                "Piano": "piano.wav"
-            }
-
-            for file in output_files:
-                # The file is currently in the temp directory
-                original_temp_path = temp_output_dir / file
-
-                if not original_temp_path.exists():
-                    self.append_log(f"Warning: Expected file {file} not found in temp dir.")
-                    continue
+                running = job.status == SeparationJob.RUNNING and job.cancel_token is not None
+        if running:
+            # A second cancel on the same job is forced: a worker process is killed instead
+            # of waiting for the next demucs chunk (the in-process engine always waits)
+            force = job.cancel_token.cancelled
+            job.cancel_token.cancel(CANCELLED, force=force)
+            self.update_status("Stopping worker process..." if force else "Cancelling...")
+        self.refresh_queue_view()
+
+    def preempt_job(self, job):
+        # Moves a pending job to the front and interrupts the running job, which is re-queued
+        with self.queue_lock:
+            if job not in self.pending_jobs:
+                return
+            self.pending_jobs.remove(job)
+            job.urgent = True
+            self.insert_after_urgent(job)
+            running = self.current_job
+        if running is not None and not running.urgent and running.cancel_token is not None:
+            running.cancel_token.cancel(PREEMPTED)
+        self.refresh_queue_view()
+
+    def insert_after_urgent(self, job):
+        # Caller holds queue_lock
+        position = 0
+        while position < len(self.pending_jobs) and self.pending_jobs[position].urgent:
+            position += 1
+        self.pending_jobs.insert(position, job)
 
-                target_filename = file # Default to original name
-                for keyword, target in rename_map.items():
-                    # Check if keyword is in filename (case-insensitive check might be safer but usually it's Capitalized)
-                    if f"({keyword})" in file or f"_{keyword}_" in file or keyword in file:
-                         target_filename = target
-                         break
+    def start_separation(self, e):
+        paths = self.audio_file_paths or ([self.audio_file_path] if self.audio_file_path else [])
+        if not paths:
+            return
 
-                if target_filename == file:
-                    self.append_log(f"Could not match stem for {file}, keeping original name.")
+        # Settings are captured per job, so the controls stay usable to queue more files
+        if not self.enqueue_jobs([self.create_job(path) for path in paths]):
+            return
 
-                # Determine final path
-                final_path = output_dir / target_filename
+        self.status_text.value = "Starting separation..."
+        self.ui_batcher.clear() # Clear logs
+        self.start_queue_worker()
 
-                # Handle collisions by appending a counter (e.g., vocal_1.wav)
-                counter = 1
-                stem = final_path.stem
-                suffix = final_path.suffix
-                while final_path.exists():
-                    final_path = output_dir / f"{stem}_{counter}{suffix}"
-                    counter += 1
+    def preview_click(self, e):
+        if not self.audio_file_path:
+            self.update_status("Select a file to preview.")
+            return
+        try:
+            start, seconds = preview_window(parse_time(self.preview_start_field.value or "0"), float(self.preview_length_dropdown.value))
+        except ValueError as err:
+            self.update_status(f"Invalid preview window: {err}")
+            return
+        full = self.create_job(self.audio_file_path)
+        job = SeparationJob(self.audio_file_path, preview_settings(full.settings))
+        job.preview = (start, seconds)
+        job.full_settings = full.settings
+        # Ahead of the waiting jobs, without interrupting the running one
+        with self.queue_lock:
+            self.jobs.append(job)
+            self.insert_after_urgent(job)
+            start_worker = not self.is_separating
+            self.is_separating = True
+        self.refresh_queue_view()
+        if start_worker:
+            self.start_queue_worker()
+
+    def render_full_click(self, e):
+        # The full render of the last preview, with the settings it was previewed with (not the current controls)
+        preview = self.last_preview
+        if preview is None:
+            return
+        if self.enqueue_jobs([SeparationJob(preview.audio_file_path, preview.full_settings)]):
+            self.start_queue_worker()
 
-                target_filename = final_path.name
-                final_path = output_dir / target_filename # Ensure final path matches target_filename
+    def start_queue_worker(self):
+        self.progress_bar.visible = True
+        self.cancel_btn.disabled = False
+        self.request_ui_update()
 
-                try:
-                    # Move from temp to final destination
-                    original_temp_path.replace(final_path)
-                    renamed_files.append(target_filename)
-                    self.append_log(f"Saved {target_filename}")
-                except (OSError, ValueError) as e:
-                    self.append_log(f"Error moving {file}: {e}")
+        # Start the queue worker in a separate thread
+        self.worker_thread = threading.Thread(target=self.run_queue)
+        self.worker_thread.daemon = True
+        self.worker_thread.start()
 
-            self.append_log(f"Generated files: {renamed_files}")
+    def run_queue(self):
+        try:
+            while True:
+                job = self.next_job()
+                if job is None:
+                    break
+                if self.record_job_state(job, "start") is False:
+                    # A resumed job another NatuStem process has claimed meanwhile
+                    job.status = SeparationJob.CANCELLED
+                    self.append_log(f"Job #{job.id} is already being processed by another instance; skipped.")
+                    self.refresh_queue_view()
+                    continue
+                self.refresh_queue_view()
+                self.prefetch_next_job()
+                # The stems are published on the publish thread while the next job runs
+                self.run_separation(job, background_publish=True)
+                self.refresh_queue_view()
+            self.wait_for_publish()
+        finally:
+            if not self.is_separating:
+                self.progress_bar.visible = False
+                self.cancel_btn.disabled = True
+                self.request_ui_update()
 
-            # Final status update needs to happen on main thread via update_status or setting value
-            self.update_status(f"Success! Output saved to {output_dir.resolve()}")
+    def create_separator(self, **kwargs):
+        return load_separator_class()(**kwargs)
+
+    def wait_for_warmup(self, job):
+        # The local engine's model cache is not shared between threads: let the preload finish first
+        if self.warmup_done.is_set():
+            return
+        self.update_status("Waiting for the model to finish loading...")
+        while not self.warmup_done.wait(0.1):
+            job.cancel_token.raise_if_cancelled()
+
+    def run_separation(self, job=None, background_publish=False):
+        # Without an explicit job, separate the current selection with the current settings.
+        # With background_publish, the stems are selected, renamed and cached on the publish thread
+        # while the queue moves on to the next job's model run (see natustem.pipeline).
+        if job is None:
+            job = self.create_job(self.audio_file_path)
+            job.status = SeparationJob.RUNNING
+
+        job.cancel_token = CancelToken()
+        self.current_job = job
+        outcome = None
+        try:
+            duration = job.preview[1] if job.preview is not None else probe_duration(job.audio_file_path)
+            self.progress_tracker = ProgressTracker(
+                # In streaming mode every chunk runs all passes again
+                passes=expected_passes(job.model_name, job.settings.shifts) * chunk_count(duration, job.settings.chunk_seconds),
+                audio_duration=duration
+            )
+            self.progress_bar.value = None
+            if isinstance(self.engine, SeparationEngine):
+                self.wait_for_warmup(job)
+            elif self.worker_restart_pending:
+                self.worker_restart_pending = False
+                self.worker_process.stop()
+                self.engine = self.worker_process = self.create_worker_process()
+            if job.preview is not None:
+                # On whichever engine has the model loaded; the stems go to preview/, not output/
+                outcome = run_preview(self.engine, job.audio_file_path, job.settings, *job.preview, log=self.append_log,
+                                      cancel_token=job.cancel_token)
+            elif isinstance(self.engine, SeparationEngine):
+                outcome = self.engine.begin(job.audio_file_path, job.settings, log=self.append_log, cancel_token=job.cancel_token,
+                                            prefetched=self.take_prefetched(job))
+            else:
+                # The worker process runs the whole job
+                outcome = self.engine.separate(job.audio_file_path, job.settings, log=self.append_log, cancel_token=job.cancel_token)
+
+        except JobCancelledError as e:
+            if e.reason == PREEMPTED:
+                # Back to the queue, right after the urgent job(s) that interrupted it
+                with self.queue_lock:
+                    job.status = SeparationJob.PENDING
+                    self.insert_after_urgent(job)
+                self.record_job_state(job, "requeue", "preempted")
+                self.append_log(f"Job #{job.id} was preempted by an urgent job and re-queued.")
+            else:
+                job.status = SeparationJob.CANCELLED
+                self.record_job_state(job, "cancel")
+                self.update_status("Separation cancelled.")
 
         except Exception as e:
-            # Generic error message for the GUI
-            self.append_log("Error: An unexpected error occurred during separation.")
-            self.append_log(f"Check {LOG_FILE_NAME} for detailed error information.")
-            self.update_status("Error during separation.")
-            # Detailed error logged to file (suppressed in GUI via GuiLogHandler)
-            logging.error(f"Separation failed: {e}", exc_info=True)
+            self.separation_failed(job, e)
         finally:
-            self.is_separating = False
-            self.separate_btn.disabled = False
-            self.select_file_btn.disabled = False
-            self.model_dropdown.disabled = False
-            self.shifts_slider.disabled = False
-            self.overlap_slider.disabled = False
-            self.progress_bar.visible = False
-            self.page.update()
+            self.progress_tracker = None
+            self.current_job = None
+
+        if outcome is None:
+            self.record_watched(job)
+        elif background_publish and isinstance(outcome, PendingSeparation):
+            self.wait_for_publish()
+            self.publishing = self.publisher.submit(self.publish_job, job, outcome, True)
+        else:
+            self.publish_job(job, outcome)
+        return job
+
+    def publish_job(self, job, outcome, refresh=False):
+        # outcome: a PendingSeparation of the local engine, or the worker process's finished SeparationResult
+        try:
+            result = outcome.finish() if isinstance(outcome, PendingSeparation) else outcome
+        except Exception as e:
+            self.separation_failed(job, e)
+        else:
+            self.separation_succeeded(job, result)
+        self.record_watched(job)
+        if refresh:
+            self.refresh_queue_view()
+
+    def separation_succeeded(self, job, result):
+        job.output_dir = result.output_dir
+        self.record_job_state(job, "separated", result)
+
+        # Final status update needs to happen on main thread via update_status or setting value
+        cached_note = " (from cache)" if result.cached else ""
+        if job.preview is not None:
+            self.update_status(f"Preview ready in {Path(result.output_dir).resolve()}{cached_note}. Render the full track when it sounds right.")
+            self.last_preview = job
+            self.render_full_btn.disabled = False
+            self.request_ui_update()
+        else:
+            self.update_status(f"Success! Output saved to {result.output_dir.resolve()}{cached_note}")
+        if result.encodes:
+            job.status = SeparationJob.ENCODING
+            batch = self.encoder.submit(result, job.settings.output_format, log=self.append_log)
+            batch.add_done_callback(lambda batch, job=job: self.encoding_finished(job, batch))
+        else:
+            job.status = SeparationJob.DONE
+        self.append_log(describe_metrics(result.timings, result.resources))
+        model_cache = self.engine.model_state().get("model_cache")
+        if model_cache:
+            self.append_log(describe_stats(model_cache))
+
+    def separation_failed(self, job, e):
+        # Generic error message for the GUI
+        self.append_log("Error: An unexpected error occurred during separation.")
+        self.append_log(f"Check {LOG_FILE_NAME} for detailed error information.")
+        self.update_status("Error during separation.")
+        job.status = SeparationJob.FAILED
+        self.record_job_state(job, "fail", e)
+        # Detailed error logged to file (suppressed in GUI via GuiLogHandler)
+        logging.error(f"Separation failed: {e}", exc_info=True)
+
+    def encoding_finished(self, job, batch):
+        # Runs on an encoder thread once all stems of the job are written
+        if batch.errors:
+            self.append_log(f"Job #{job.id}: {len(batch.errors)} stems could not be encoded and were kept as WAV.")
+            job.status = SeparationJob.FAILED
+        else:
+            job.status = SeparationJob.DONE
+        self.record_job_state(job, "finish", batch.errors)
+        self.refresh_queue_view()
 
 if __name__ == "__main__":
     app = AudioSeparatorApp()
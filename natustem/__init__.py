@@ -0,0 +1,6 @@
+"""NatuStem separation engine.
+
+Everything in this package is usable without the Flet GUI: the GUI in
+``main.py`` and the headless CLI (``python -m natustem``) share the same
+pipeline. Modules here must never import ``flet``.
+"""
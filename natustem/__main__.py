@@ -0,0 +1,5 @@
+import sys
+
+from natustem.cli import main
+
+sys.exit(main())
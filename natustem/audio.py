@@ -0,0 +1,79 @@
+"""Small audio helpers that do not need the model stack."""
+import json
+import logging
+import os
+import shutil
+import subprocess
+import wave
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+def read_through(path):
+    # Reads the whole file and drops the data: it stays in the OS page cache for the next reader
+    with open(path, "rb") as f:
+        while f.read(READ_BLOCK_SIZE):
+            pass
+
+
+def probe_duration(path):
+    # Duration in seconds, or None if it cannot be determined cheaply
+    path = Path(path)
+    if path.suffix.lower() == ".wav":
+        try:
+            with wave.open(str(path), "rb") as f:
+                return f.getnframes() / f.getframerate()
+        except (OSError, EOFError, wave.Error):
+            pass
+
+    try:
+        import soundfile
+        return soundfile.info(str(path)).duration
+    except Exception:
+        pass
+
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe is None:
+        return None
+    try:
+        result = subprocess.run(
+            [ffprobe, "-v", "error", "-show_entries", "format=duration", "-of", "json", str(path)],
+            capture_output=True, text=True, timeout=30, check=True
+        )
+        return float(json.loads(result.stdout)["format"]["duration"])
+    except (OSError, ValueError, KeyError, subprocess.SubprocessError) as e:
+        logger.debug(f"ffprobe could not read {path}: {e}")
+        return None
+
+
+def cut_excerpt(path, start_seconds, seconds, destination):
+    # Writes `seconds` of audio from `start_seconds` on to the PCM WAV file `destination`.
+    # WAV is cut in place; anything else is decoded by ffmpeg, which seeks without decoding the start.
+    path, destination = Path(path), Path(destination)
+    if path.suffix.lower() == ".wav":
+        try:
+            with wave.open(str(path), "rb") as src:
+                start = min(int(start_seconds * src.getframerate()), src.getnframes())
+                src.setpos(start)
+                frames = src.readframes(int(seconds * src.getframerate()))
+                with wave.open(str(destination), "wb") as dst:
+                    dst.setparams(src.getparams())
+                    dst.writeframes(frames)
+            return destination
+        except (EOFError, wave.Error):
+            pass  # Not PCM (e.g. float WAV): let ffmpeg read it
+
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise RuntimeError(f"Cutting an excerpt of {path.name} needs ffmpeg; convert it to WAV or install ffmpeg.")
+    partial = destination.with_name(destination.stem + ".part.wav")
+    subprocess.run(
+        [ffmpeg, "-nostdin", "-v", "error", "-y", "-ss", f"{start_seconds:.3f}", "-t", f"{seconds:.3f}", "-i", str(path),
+         "-vn", "-acodec", "pcm_s16le", str(partial)],
+        check=True, capture_output=True
+    )
+    os.replace(partial, destination)
+    return destination
@@ -0,0 +1,160 @@
+"""Content-addressed cache of separation results.
+
+Results are keyed on a SHA-256 of the input file's bytes plus the separation
+settings, so resubmitting the same audio (under any name) with the same model
+and parameters restores the stems instantly instead of running the model.
+Stems are stored under ``output/.cache/<key>/`` with a JSON index; the cache
+is bounded in size and evicts the least recently used results first. Entries
+are copies of the published stems (see ``outputs.clone_or_copy``), not links,
+so a stem edited in place in ``output/`` never changes a cached result; the
+index also records each file's size and modification time, and an entry whose
+files changed anyway is dropped instead of served.
+
+Worker processes (``--workers``) share one cache, so every read-modify-write
+of the index holds an ``OutputDirLock`` on ``.cache/.locks/index.lock``.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+from natustem.outputs import OutputDirLock, clone_or_copy
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of cached results changes so stale entries are never reused
+# (2: entries are copies; version 1 entries were hard links to the published stems)
+CACHE_VERSION = 2
+DEFAULT_CACHE_MAX_BYTES = 10 * 1024 ** 3
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class ResultCache:
+    def __init__(self, root, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.index_path = self.root / "index.json"
+        self.max_bytes = max_bytes
+
+    def index_lock(self):
+        # Held across load_index() ... save_index(), against other threads and other processes
+        return OutputDirLock(self.root, "index")
+
+    def key_for(self, input_path, settings):
+        params = json.dumps({"version": CACHE_VERSION, "settings": settings.to_dict()}, sort_keys=True)
+        return hashlib.sha256(f"{hash_file(input_path)}:{params}".encode()).hexdigest()
+
+    def entry_dir(self, key):
+        return self.root / key[:2] / key
+
+    def load_index(self):
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable cache index {self.index_path}: {e}")
+            return {}
+
+    def save_index(self, index):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_name(f"index.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        tmp_path.replace(self.index_path)
+
+    def lookup(self, key):
+        # Returns the cached file paths for key, or None on a miss
+        with self.index_lock():
+            index = self.load_index()
+            entry = index.get(key)
+            if entry is None:
+                return None
+
+            entry_dir = self.entry_dir(key)
+            paths = [entry_dir / name for name in entry["files"]]
+            if not all(self.unchanged(p, entry.get("stamps", {}).get(p.name)) for p in paths):
+                # Someone removed or modified files behind our back: drop the entry
+                del index[key]
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                self.save_index(index)
+                return None
+
+            entry["last_used"] = time.time()
+            self.save_index(index)
+            return paths
+
+    def store(self, key, files, description=""):
+        # files are the published stems; they are linked into the cache under their own names
+        files = [Path(f) for f in files]
+        size = sum(f.stat().st_size for f in files)
+        if not files or size > self.max_bytes:
+            return False
+
+        entry_dir = self.entry_dir(key)
+        staging_dir = self.root / f".incoming-{uuid.uuid4().hex}"
+        staging_dir.mkdir(parents=True)
+        try:
+            for f in files:
+                clone_or_copy(f, staging_dir / f.name)
+            stamps = {f.name: file_stamp(staging_dir / f.name) for f in files}
+
+            with self.index_lock():
+                index = self.load_index()
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                entry_dir.parent.mkdir(parents=True, exist_ok=True)
+                staging_dir.replace(entry_dir)
+                now = time.time()
+                index[key] = {
+                    "files": [f.name for f in files],
+                    "stamps": stamps,
+                    "size": size,
+                    "created": now,
+                    "last_used": now,
+                    "description": description,
+                }
+                self.evict(index)
+                self.save_index(index)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        return True
+
+    @staticmethod
+    def unchanged(path, stamp):
+        # Still the file that was stored: same size and modification time
+        try:
+            return stamp is not None and file_stamp(path) == stamp
+        except OSError:
+            return False
+
+    def evict(self, index):
+        # Drop least recently used entries until the cache fits in max_bytes. Caller holds the index lock.
+        total = sum(entry["size"] for entry in index.values())
+        for key, entry in sorted(index.items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+            del index[key]
+            total -= entry["size"]
+            logger.info(f"Evicted cached result {key[:12]} ({entry['description']})")
+
+    def total_size(self):
+        with self.index_lock():
+            return sum(entry["size"] for entry in self.load_index().values())
@@ -0,0 +1,61 @@
+"""Cooperative cancellation of running separations.
+
+audio-separator has no cancel API, but demucs reports progress through tqdm
+on ``sys.stderr`` after every chunk. While a job runs, its ``CancelToken`` is
+registered for the separating thread, and ``StderrTqdmHandler`` calls
+``checkpoint()`` on every progress write: once the token is cancelled the
+next chunk raises ``JobCancelledError`` out of ``separate()``. The model
+stays loaded and the Separator stays usable for the next job.
+"""
+import threading
+from contextlib import contextmanager
+
+CANCELLED = "cancelled"
+PREEMPTED = "preempted"
+
+_active = threading.local()
+
+
+class JobCancelledError(Exception):
+    def __init__(self, reason=CANCELLED):
+        super().__init__(f"Job {reason}")
+        self.reason = reason
+
+
+class CancelToken:
+    def __init__(self):
+        self.event = threading.Event()
+        self.reason = None
+        # A forced cancel may kill a worker process instead of waiting for a checkpoint
+        self.force = False
+
+    def cancel(self, reason=CANCELLED, force=False):
+        if self.reason is None:
+            self.reason = reason
+        self.force = self.force or force
+        self.event.set()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def raise_if_cancelled(self):
+        if self.event.is_set():
+            raise JobCancelledError(self.reason)
+
+
+@contextmanager
+def activate(token):
+    # Registers token for checkpoints raised on the current thread
+    previous = getattr(_active, "token", None)
+    _active.token = token
+    try:
+        yield token
+    finally:
+        _active.token = previous
+
+
+def checkpoint():
+    token = getattr(_active, "token", None)
+    if token is not None:
+        token.raise_if_cancelled()
@@ -0,0 +1,652 @@
+"""Headless command line entry point.
+
+    python -m natustem separate input/ --model htdemucs_ft.yaml --shifts 2 --workers 2
+    python -m natustem separate input/ --workers 4 --parallel
+    python -m natustem separate input/ --format flac --bit-depth 24
+    python -m natustem separate input/ --stems vocals instrumental
+    python -m natustem separate input/ --resume
+    python -m natustem separate input/ --threads auto
+    python -m natustem preview song.mp3 --start 1:30 --seconds 30
+    python -m natustem jobs --state failed
+    python -m natustem models fetch
+    python -m natustem models import /media/usb/natustem-models.tar --offline
+    python -m natustem scale input/ --workers 1 2 4 8
+    python -m natustem watch input/ --stems vocals instrumental
+    python -m natustem serve --port 8765 --batch-size 4
+
+Writes stems to ``output/<stem>/`` exactly like the GUI and prints one JSON
+object per input file on stdout with its timings. Logs go to stderr and to
+``audio_separator.log``. This module must not import ``flet``.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from natustem.audio import probe_duration
+from natustem.cache import DEFAULT_CACHE_MAX_BYTES, ResultCache
+from natustem.constants import (DEFAULT_CHUNK_SECONDS, DEFAULT_MODEL, DEFAULT_OVERLAP, DEFAULT_PREVIEW_SECONDS, DEFAULT_SHIFTS,
+                                LOG_FILE_NAME, METRICS_FILE_NAME, MODELS, PREVIEW_OUTPUT_DIR, WATCH_INPUT_DIR)
+from natustem.cpu import ExecutionSettings, available_cores, parse_cpu_list
+from natustem.encoding import BIT_DEPTHS, FORMATS, EncoderPool, OutputFormat
+from natustem.engine import SeparationEngine, SeparationSettings, find_audio_files
+from natustem.jobstore import DONE, ENCODING, FAILED, store_for
+from natustem.memory import parse_segment_size
+from natustem.model_store import ModelStore, ModelStoreError, default_model_dir
+from natustem.models import DEFAULT_MODEL_MEMORY_BUDGET, describe_stats
+from natustem.parallel import best_worker_count, measure_throughput, schedule_order, worker_factory
+from natustem.pipeline import run_pipeline
+from natustem.preview import parse_time, preview_settings, preview_window, run_preview
+from natustem.progress import StderrTqdmHandler
+from natustem.service import (DEFAULT_BATCH_SIZE, DEFAULT_HOST, DEFAULT_KEEP_FINISHED, DEFAULT_MAX_QUEUE, DEFAULT_PORT, JobService,
+                              serve)
+from natustem.stems import INSTRUMENTAL, SIX_STEMS
+from natustem.tuning import RtfHistory, tune
+from natustem.watch import DEFAULT_POLL_SECONDS, DEFAULT_SETTLE_SECONDS, FolderWatcher, ledger_for
+from natustem.worker import WorkerProcess, execution_options
+
+logger = logging.getLogger("natustem")
+
+
+def setup_logging(verbose=False):
+    logger = logging.getLogger()
+    logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%H:%M:%S'))
+    logger.addHandler(console_handler)
+
+    try:
+        file_handler = logging.FileHandler(LOG_FILE_NAME, encoding='utf-8')
+        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        logger.addHandler(file_handler)
+    except OSError as e:
+        print(f"Could not initialize file logging: {e}", file=sys.stderr)
+
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+
+
+@contextmanager
+def tqdm_checkpoints():
+    # demucs progress bars of in-process jobs split their metrics into decode/inference/write stages and
+    # are their cancellation checkpoints, as in the GUI; the bars still reach the terminal
+    sys.stderr = StderrTqdmHandler(lambda progress: None)
+    try:
+        yield
+    finally:
+        sys.stderr = sys.stderr.original_stderr
+
+
+def emit_record(record, lock=threading.Lock()):
+    # One JSON object per line; the lock keeps lines from interleaving across workers
+    with lock:
+        sys.stdout.write(json.dumps(record) + "\n")
+        sys.stdout.flush()
+
+
+def file_record(path, settings):
+    return {"input": str(path), "model": settings.model_name, "shifts": settings.shifts, "overlap": settings.overlap}
+
+
+def finish_record(record, settings, started, result, error, encoder, on_done):
+    # Fills in a job's outcome and returns its EncodeBatch (None after a failure). on_done(record) runs
+    # once the stems are encoded in the background (right away for WAV output or a failure).
+    def finish(batch=None):
+        # Encoding failures keep the WAV stems (see EncoderPool), but the file is reported as failed
+        record.pop("pending_encodes", None)
+        if batch is not None and batch.errors:
+            record["status"] = "error"
+            record["error"] = "; ".join(batch.errors)
+        record["seconds"] = round(time.perf_counter() - started, 3)
+        on_done(record)
+
+    if error is not None:
+        logger.error(f"Separation failed for {record['input']}: {error}", exc_info=error)
+        record["status"] = "error"
+        record["error"] = str(error)
+        finish()
+        return None
+    record.update(result.to_dict())
+    record["status"] = "ok"
+    batch = encoder.submit(result, settings.output_format, log=logger.info)
+    batch.add_done_callback(finish)
+    return batch
+
+
+def process_file(engine, path, settings, encoder, on_done=emit_record):
+    # Separates one file and returns (record, EncodeBatch or None); see finish_record()
+    started = time.perf_counter()
+    record = file_record(path, settings)
+    try:
+        result = engine.separate(path, settings)
+    except Exception as e:
+        return record, finish_record(record, settings, started, None, e, encoder, on_done)
+    return record, finish_record(record, settings, started, result, None, encoder, on_done)
+
+
+def separate_files(engine, jobs, encoder, on_separated=None):
+    # jobs: iterable of (record, path, settings, on_done) with record = file_record(path, settings).
+    # on_separated(record, batch) runs once a file's stems are published (they may still be encoding).
+    # An in-process engine runs the files through the prefetch/model/publish pipeline (natustem.pipeline);
+    # worker processes run whole jobs in the child, one at a time.
+    on_separated = on_separated or (lambda record, batch: None)
+    if not isinstance(engine, SeparationEngine):
+        for record, path, settings, on_done in jobs:
+            started = time.perf_counter()
+            try:
+                result, error = engine.separate(path, settings), None
+            except Exception as e:
+                result, error = None, e
+            on_separated(record, finish_record(record, settings, started, result, error, encoder, on_done))
+        return
+
+    started = {}
+
+    def keyed_jobs():
+        for record, path, settings, on_done in jobs:
+            yield (id(record), record, settings, on_done), path, settings
+
+    def on_started(key):
+        started[key[0]] = time.perf_counter()
+
+    def on_finished(key, result, error):
+        record_id, record, settings, on_done = key
+        on_separated(record, finish_record(record, settings, started.pop(record_id), result, error, encoder, on_done))
+
+    run_pipeline(engine, keyed_jobs(), on_finished, on_started=on_started)
+
+
+def run_batch(files, settings, output_root="output", workers=1, engine_factory=SeparationEngine, settings_for=None):
+    # Each worker thread owns its own engine (and therefore its own Separator) and takes the next file
+    # from a shared queue. settings_for(path), if given, chooses the settings per file (e.g. to fit a
+    # time budget). Stems in other formats than 16-bit WAV are encoded in the background while the next
+    # file separates; a file's record is emitted once its encodes are done.
+    engines = []
+    encoder = EncoderPool()
+    batches = []
+    pending = queue.Queue()
+    for index, path in enumerate(files):
+        pending.put((index, path))
+    records = [None] * len(files)
+
+    def next_jobs():
+        while True:
+            try:
+                index, path = pending.get_nowait()
+            except queue.Empty:
+                return
+            file_settings = settings_for(path) if settings_for else settings
+            records[index] = file_record(path, file_settings)
+            yield records[index], path, file_settings, emit_record
+
+    def on_separated(record, batch):
+        if batch is not None:
+            batches.append(batch)
+
+    def drain():
+        engine = engine_factory(output_root=output_root)
+        engines.append(engine)
+        separate_files(engine, next_jobs(), encoder, on_separated)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for future in [pool.submit(drain) for _ in range(workers)]:
+                future.result()
+        for batch in batches:
+            batch.wait()
+        return records
+    finally:
+        encoder.shutdown()
+        for engine in engines:
+            model_cache = engine.model_state().get("model_cache")
+            if model_cache:
+                logger.info(describe_stats(model_cache))
+            engine.stop()
+
+
+def run_store(store, files, settings, output_root="output", workers=1, engine_factory=SeparationEngine, settings_for=None):
+    # Like run_batch, but the files go through the persistent job store: files already separated with the
+    # same settings are skipped, jobs interrupted by a crash are resumed, and other processes draining the
+    # same store share the work. settings_for is applied when a job is claimed, so tuned runs resume too.
+    store.recover()
+    skipped = 0
+    for path in files:
+        job, _ = store.add(path, settings)
+        skipped += job.state == DONE
+    if skipped:
+        logger.info(f"Skipping {skipped} files already separated (see {store.path}).")
+    encoder = EncoderPool()
+    batches = []
+    records = []
+    engines = []
+    # Encodes finish on encoder threads; a job must not go back to "encoding" after it is done
+    state_lock = threading.Lock()
+    finished_ids = set()
+
+    def finished(record):
+        with state_lock:
+            finished_ids.add(record["job"])
+            if record["status"] == "ok":
+                store.update(record["job"], DONE, output_dir=record["output_dir"], files=record["files"], timings=record["timings"])
+            else:
+                store.update(record["job"], FAILED, error=record["error"])
+        records.append(record)
+        emit_record(record)
+
+    def on_separated(record, batch):
+        if batch is None:
+            return
+        batches.append(batch)
+        with state_lock:
+            if record["job"] not in finished_ids:
+                store.update(record["job"], ENCODING, output_dir=record["output_dir"], files=record["files"],
+                             encodes=batch.result.encodes)
+
+    def claimed_jobs(engine):
+        while True:
+            job = store.claim(prefer_models=[m for m in [engine.loaded_model_name, *engine.resident_models()] if m])
+            if job is None:
+                return
+            job_settings = settings_for(job.input_path) if settings_for else job.settings
+            record = file_record(job.input_path, job_settings)
+            record["job"] = job.id
+            yield record, job.input_path, job_settings, finished
+
+    def drain():
+        engine = engine_factory(output_root=output_root)
+        engines.append(engine)
+        separate_files(engine, claimed_jobs(engine), encoder, on_separated)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for future in [pool.submit(drain) for _ in range(workers)]:
+                future.result()
+        for batch in batches:
+            batch.wait()
+        return records
+    finally:
+        encoder.shutdown()
+        for engine in engines:
+            engine.stop()
+
+
+def watch_folder(folder, settings, engine, output_root="output", interval=DEFAULT_POLL_SECONDS,
+                 settle_seconds=DEFAULT_SETTLE_SECONDS, watcher=None):
+    # Separates files as they finish copying into `folder`, one at a time on the same warm engine,
+    # until watcher.stop() (or Ctrl+C). Finished files go into the ledger so a restart skips them.
+    watcher = watcher or FolderWatcher(folder, ledger_for(output_root), settle_seconds=settle_seconds)
+    encoder = EncoderPool()
+
+    def finished(path, signature, record):
+        status = "done" if record["status"] == "ok" else "failed"
+        watcher.ledger.record(path, status, signature=signature, output_dir=record.get("output_dir"))
+        emit_record(record)
+
+    def on_ready(path):
+        process_file(engine, path, settings, encoder, on_done=functools.partial(finished, path, watcher.signature_of(path)))
+
+    try:
+        watcher.run(on_ready, interval)
+    except KeyboardInterrupt:
+        logger.info("Stopped watching.")
+    finally:
+        encoder.shutdown()
+        model_cache = engine.model_state().get("model_cache")
+        if model_cache:
+            logger.info(describe_stats(model_cache))
+        engine.stop()
+
+
+def tuned_settings(history, settings, budget_seconds, path):
+    # The highest-quality shifts/overlap predicted to finish `path` within the budget
+    shifts, overlap, prediction, fits = tune(history, settings.model_name, probe_duration(path), budget_seconds)
+    note = "" if fits else " (over budget even with the fastest settings)"
+    logger.info(f"{path}: shifts {shifts}, overlap {overlap}, predicted {prediction.describe()}{note}")
+    return SeparationSettings(settings.model_name, shifts, overlap, chunk_seconds=settings.chunk_seconds,
+                              output_format=settings.output_format, stems=settings.stems, segment_size=settings.segment_size)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="natustem", description="Separate audio files into stems without the GUI.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="enable debug logging")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    separate = commands.add_parser("separate", help="separate files or directories of audio files")
+    add_settings_arguments(separate)
+    add_output_arguments(separate)
+    add_execution_arguments(separate)
+    add_model_store_arguments(separate)
+    separate.add_argument("-j", "--workers", type=int, default=1, help="number of files separated concurrently (default: 1)")
+    separate.add_argument("--isolated", action="store_true",
+                          help="run each worker's model in its own child process (a crash only fails the current file)")
+    separate.add_argument("--parallel", action="store_true",
+                          help="run the workers as child processes, each pinned to its own share of the CPU cores "
+                               "with a matching torch thread count (implies --isolated)")
+    separate.add_argument("--stream", type=int, nargs="?", const=DEFAULT_CHUNK_SECONDS, metavar="SECONDS",
+                          help=f"separate in overlapping chunks of SECONDS (default: {DEFAULT_CHUNK_SECONDS}) with bounded memory; "
+                               "an interrupted run resumes from the last finished chunk")
+    separate.add_argument("--resume", action="store_true",
+                          help="record the jobs in the job store (<output>/.jobs.sqlite3): files already separated with the same "
+                               "settings are skipped, jobs of an interrupted run are resumed, and several processes can share the queue")
+    separate.add_argument("--target-minutes", type=float, metavar="MINUTES",
+                          help="per file, pick the highest shifts/overlap predicted to finish within MINUTES "
+                               "(from this host's measured speed; overrides --shifts and --overlap)")
+
+    scale = commands.add_parser("scale", help="measure total throughput for several parallel worker counts")
+    add_settings_arguments(scale)
+    scale.add_argument("-j", "--workers", type=int, nargs="+", default=None,
+                       help="worker counts to try (default: 1, 2, 4, ... up to the number of cores)")
+
+    watch = commands.add_parser("watch", help="keep a model loaded and separate audio files as they are dropped into a folder")
+    watch.add_argument("folder", nargs="?", default=WATCH_INPUT_DIR, help=f"folder to watch (default: {WATCH_INPUT_DIR}/)")
+    add_settings_arguments(watch, inputs=False)
+    add_output_arguments(watch)
+    add_execution_arguments(watch)
+    add_model_store_arguments(watch)
+    watch.add_argument("--interval", type=float, default=DEFAULT_POLL_SECONDS, help="seconds between folder scans (default: %(default)g)")
+    watch.add_argument("--settle", type=float, default=DEFAULT_SETTLE_SECONDS,
+                       help="seconds a file's size must stay unchanged before it is picked up (default: %(default)g)")
+
+    preview = commands.add_parser("preview", help="separate a short excerpt with cheap settings into preview/ to audition a model")
+    preview.add_argument("input", help="audio file")
+    add_settings_arguments(preview, inputs=False)
+    preview.add_argument("--start", default="0", metavar="TIME", help="start of the excerpt, in seconds or m:ss (default: 0)")
+    preview.add_argument("--seconds", type=float, default=DEFAULT_PREVIEW_SECONDS,
+                         help="length of the excerpt (default: %(default)g)")
+    preview.add_argument("--stems", nargs="+", metavar="STEM", help="only write these stems (default: all stems of the model)")
+    preview.add_argument("-o", "--output", default=PREVIEW_OUTPUT_DIR,
+                         help="folder for the preview stems, one subfolder per file (default: %(default)s/)")
+    add_model_store_arguments(preview)
+
+    jobs = commands.add_parser("jobs", help="list the jobs in the job store as JSON lines")
+    jobs.add_argument("-o", "--output", default="output", help="output root folder holding the job store (default: output/)")
+    jobs.add_argument("--state", nargs="+", choices=("pending", "running", "encoding", "done", "failed", "cancelled"),
+                      help="only list jobs in these states")
+    jobs.add_argument("--retry", action="store_true", help="put the failed and cancelled jobs back in the queue")
+
+    models = commands.add_parser("models", help="manage the local model store: status, fetch, import, export, verify")
+    models.add_argument("action", choices=("status", "fetch", "import", "export", "verify"),
+                        help="status: what is stored and verified; fetch: download missing files; import: copy them from "
+                             "PATH (folder, zip or tar); export: write them to the archive PATH; verify: re-hash every file")
+    models.add_argument("path", nargs="?", help="folder or archive to import from, or archive to export to")
+    models.add_argument("--models", nargs="+", choices=sorted(MODELS), metavar="MODEL",
+                        help=f"only these models (default: all of {', '.join(sorted(MODELS))})")
+    add_model_store_arguments(models)
+
+    serve_parser = commands.add_parser("serve", help="run a local HTTP job API that keeps the model loaded for many clients")
+    add_settings_arguments(serve_parser, inputs=False)
+    add_output_arguments(serve_parser)
+    add_execution_arguments(serve_parser)
+    add_model_store_arguments(serve_parser)
+    serve_parser.add_argument("--host", default=DEFAULT_HOST, help="address to listen on (default: %(default)s, this machine only)")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to listen on (default: %(default)s)")
+    serve_parser.add_argument("-j", "--workers", type=int, default=1,
+                              help="jobs separated concurrently, each worker with its own loaded model (default: 1)")
+    serve_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                              help="consecutive jobs a worker takes for its loaded model before others' turn (default: %(default)s)")
+    serve_parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE,
+                              help="queued jobs accepted before new ones are refused with 503 (default: %(default)s)")
+    serve_parser.add_argument("--keep-finished", type=int, default=DEFAULT_KEEP_FINISHED,
+                              help="finished jobs still listed by the API; older ones are forgotten, their stems stay "
+                                   "on disk (default: %(default)s)")
+    return parser
+
+
+def add_settings_arguments(parser, inputs=True):
+    if inputs:
+        parser.add_argument("inputs", nargs="*", default=["input"], help="audio files or directories (default: input/)")
+    parser.add_argument("-m", "--model", default=DEFAULT_MODEL, choices=sorted(MODELS), help=f"model to use (default: {DEFAULT_MODEL})")
+    parser.add_argument("--shifts", type=int, default=DEFAULT_SHIFTS, help=f"random shifts, 0-20 (default: {DEFAULT_SHIFTS})")
+    parser.add_argument("--overlap", type=float, default=DEFAULT_OVERLAP, help=f"segment overlap, 0-0.99 (default: {DEFAULT_OVERLAP})")
+    parser.add_argument("--segment-size", type=parse_segment_size, metavar="SECONDS|default|auto",
+                        help="demucs segment length; auto plans it per file from the free memory, shrinking segments "
+                             "or switching to streaming windows when RAM runs low (default: auto)")
+
+
+def add_output_arguments(parser):
+    parser.add_argument("-o", "--output", default="output", help="output root folder (default: output/)")
+    parser.add_argument("--no-cache", action="store_true", help="always run the model, even for previously separated inputs")
+    parser.add_argument("--cache-size", type=float, default=DEFAULT_CACHE_MAX_BYTES / 1024 ** 3,
+                        help="result cache size limit in GB (default: %(default)g)")
+    parser.add_argument("--stems", nargs="+", metavar="STEM",
+                        help=f"only write these stems ({', '.join(s.lower() for s in SIX_STEMS + (INSTRUMENTAL,))}); "
+                             "instrumental is the mix minus the vocals (default: all stems of the model)")
+    parser.add_argument("-f", "--format", default="WAV", type=str.upper, choices=FORMATS,
+                        help="output format of the stems (default: WAV); other formats are encoded with ffmpeg in the background")
+    parser.add_argument("--bit-depth", type=int, choices=sorted({d for depths in BIT_DEPTHS.values() for d in depths}),
+                        help="bits per sample for WAV (16, 24, 32 float) or FLAC (16, 24) (default: 16)")
+    parser.add_argument("--metrics", default=METRICS_FILE_NAME, metavar="PATH",
+                        help=f"append per-job stage timings and resource usage as JSON lines (default: {METRICS_FILE_NAME})")
+    parser.add_argument("--model-memory", type=float, default=DEFAULT_MODEL_MEMORY_BUDGET / 1024 ** 3,
+                        help="RAM budget in GB for loaded models kept resident per worker (default: %(default)g)")
+
+
+def add_model_store_arguments(parser):
+    parser.add_argument("--model-dir", default=default_model_dir(),
+                        help="local model store with the model files and their manifest (default: %(default)s/)")
+    parser.add_argument("--offline", action="store_true", default=None,
+                        help="never download models: a model missing from the store fails before the job starts "
+                             "(default: off, unless NATUSTEM_OFFLINE=1)")
+
+
+def add_execution_arguments(parser):
+    parser.add_argument("--threads", metavar="N|auto",
+                        help="intra-op threads for torch and the BLAS/OpenMP runtimes; auto uses one per physical core, "
+                             "capped by the container's CPU quota (default: the runtime's own choice)")
+    parser.add_argument("--interop-threads", type=int, metavar="N",
+                        help="torch inter-op threads (default: the runtime's own choice, 1 with --threads auto)")
+    parser.add_argument("--cpus", metavar="LIST", help="only run on these CPUs, e.g. 0-7 or 0,2,4,6 (Linux)")
+
+
+def execution_settings(parser, args):
+    # cpu.ExecutionSettings from the execution arguments, or None to leave the runtime defaults
+    if args.threads is None and args.interop_threads is None and args.cpus is None:
+        return None
+    auto = args.threads == "auto"
+    try:
+        threads = None if auto or args.threads is None else int(args.threads)
+        return ExecutionSettings(threads, args.interop_threads, parse_cpu_list(args.cpus) if args.cpus else None, auto=auto)
+    except ValueError as e:
+        parser.error(f"invalid execution settings: {e}")
+
+
+def output_settings(parser, args, chunk_seconds=None):
+    # SeparationSettings from the settings and output arguments; exits with a usage error if they do not fit
+    if args.bit_depth is not None and args.bit_depth not in BIT_DEPTHS[args.format]:
+        parser.error(f"--bit-depth {args.bit_depth} is not available for {args.format}")
+    try:
+        return SeparationSettings(args.model, args.shifts, args.overlap, chunk_seconds=chunk_seconds,
+                                  output_format=OutputFormat(args.format, args.bit_depth or 16), stems=args.stems,
+                                  segment_size=args.segment_size)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+def model_store(args):
+    # One store per process: its engines share the manifest
+    return ModelStore(args.model_dir, offline=args.offline)
+
+
+def manage_models(parser, args):
+    store = model_store(args)
+    if args.action in ("import", "export") and not args.path:
+        parser.error(f"models {args.action} needs a PATH")
+    try:
+        if args.action == "fetch":
+            emit_record({"fetched": store.fetch(args.models)})
+        elif args.action == "import":
+            emit_record({"imported": store.import_from(args.path, args.models)})
+        elif args.action == "export":
+            emit_record({"exported": store.export(args.path, args.models), "archive": args.path})
+        elif args.action == "verify":
+            results = store.verify(args.models)
+            emit_record({"verified": sorted(name for name, error in results.items() if error is None),
+                         "removed": {name: error for name, error in results.items() if error is not None}})
+            if any(results.values()):
+                return 1
+    except (ModelStoreError, OSError) as e:
+        logger.error(str(e))
+        return 1
+    status = store.status(args.models)
+    for model_name, files in status.items():
+        emit_record({"model": model_name, "ready": all(state == "ok" for state in files.values()), "files": files})
+    return 0 if args.action != "status" or all(state == "ok" for files in status.values() for state in files.values()) else 1
+
+
+def local_cache(args):
+    if args.no_cache:
+        return None
+    return ResultCache(f"{args.output}/.cache", max_bytes=int(args.cache_size * 1024 ** 3))
+
+
+def default_worker_counts(cores):
+    counts = [1]
+    while counts[-1] * 2 <= cores:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cores:
+        counts.append(cores)
+    return counts
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    setup_logging(args.verbose)
+
+    if args.command == "jobs":
+        store = store_for(args.output)
+        if args.retry:
+            for job in store.jobs(states=("failed", "cancelled")):
+                store.requeue(job.id, "retry")
+        for job in store.jobs(states=args.state):
+            emit_record(job.to_dict())
+        emit_record({"counts": store.counts()})
+        return 0
+
+    if args.command == "models":
+        return manage_models(parser, args)
+
+    if not 0 <= args.shifts <= 20:
+        parser.error("--shifts must be between 0 and 20")
+    if not 0.0 <= args.overlap <= 0.99:
+        parser.error("--overlap must be between 0 and 0.99")
+
+    if args.command == "preview":
+        try:
+            start, seconds = preview_window(parse_time(args.start), args.seconds)
+            settings = SeparationSettings(args.model, args.shifts, args.overlap, stems=args.stems, segment_size=args.segment_size)
+        except ValueError as e:
+            parser.error(str(e))
+        started = time.perf_counter()
+        # Reports the cheaper settings the excerpt actually ran with; "separate" with the same arguments renders the full file
+        record = file_record(args.input, preview_settings(settings))
+        try:
+            with tqdm_checkpoints():
+                result = run_preview(SeparationEngine(model_store=model_store(args)), args.input, settings, start, seconds,
+                                     preview_root=args.output)
+        except Exception as e:
+            logger.error(f"Preview failed for {args.input}: {e}", exc_info=True)
+            emit_record(dict(record, status="error", error=str(e)))
+            return 1
+        # The excerpt was a temporary file: the record names the input
+        emit_record(dict(result.to_dict(), **record, status="ok", seconds=round(time.perf_counter() - started, 3)))
+        return 0
+
+    if args.command == "scale":
+        if args.workers and min(args.workers) < 1:
+            parser.error("--workers must be at least 1")
+        files = find_audio_files(args.inputs)
+        if not files:
+            logger.warning("No audio files found.")
+            return 1
+        cores = available_cores()
+        records = measure_throughput(files, SeparationSettings(args.model, args.shifts, args.overlap, segment_size=args.segment_size),
+                                     args.workers or default_worker_counts(len(cores)), run_batch=run_batch, cores=cores)
+        for record in records:
+            emit_record(record)
+        emit_record({"cores": len(cores), "best_workers": best_worker_count(records)})
+        return 0
+
+    if args.command == "separate":
+        if args.workers < 1:
+            parser.error("--workers must be at least 1")
+        if args.target_minutes is not None and args.target_minutes <= 0:
+            parser.error("--target-minutes must be positive")
+        if args.stream is not None and args.stream < 10:
+            parser.error("--stream chunks must be at least 10 seconds")
+        settings = output_settings(parser, args, chunk_seconds=args.stream)
+        execution = execution_settings(parser, args)
+        if args.parallel and execution is not None and (execution.auto or execution.intra_op_threads or execution.inter_op_threads):
+            parser.error("--parallel sets the threads of each worker; use --cpus to choose the cores it splits")
+
+        files = find_audio_files(args.inputs)
+        if not files:
+            logger.warning("No audio files found.")
+            return 1
+
+        settings_for = None
+        history = RtfHistory()
+        if args.target_minutes:
+            settings_for = functools.partial(tuned_settings, history, settings, args.target_minutes * 60)
+        # One cache shared by all workers
+        cache_max_bytes = int(args.cache_size * 1024 ** 3)
+        engine_options = {"model_memory_bytes": int(args.model_memory * 1024 ** 3), "metrics_path": args.metrics}
+        store = model_store(args)
+        if args.parallel or args.isolated:
+            engine_options.update(cache_root=None if args.no_cache else f"{args.output}/.cache", cache_max_bytes=cache_max_bytes,
+                                  rtf_history_path=history.path, model_dir=store.root, offline=store.offline)
+        else:
+            engine_options.update(cache=local_cache(args), rtf_history=history, model_store=store)
+        workers = min(args.workers, len(files))
+        if args.parallel:
+            engine_factory = worker_factory(workers, cores=execution.cpus if execution else None, **engine_options)
+            files = schedule_order(files)
+        elif args.isolated:
+            engine_factory = functools.partial(WorkerProcess, **engine_options, **execution_options(execution))
+        else:
+            engine_factory = functools.partial(SeparationEngine, execution=execution, **engine_options)
+        with tqdm_checkpoints():
+            if args.resume:
+                records = run_store(store_for(args.output), files, settings, output_root=args.output, workers=workers,
+                                    engine_factory=engine_factory, settings_for=settings_for)
+            else:
+                records = run_batch(files, settings, output_root=args.output, workers=workers, engine_factory=engine_factory,
+                                    settings_for=settings_for)
+        return 0 if all(r["status"] == "ok" for r in records) else 1
+
+    if args.command == "watch":
+        settings = output_settings(parser, args)
+        engine = SeparationEngine(output_root=args.output, cache=local_cache(args), model_memory_bytes=int(args.model_memory * 1024 ** 3),
+                                  metrics_path=args.metrics, rtf_history=RtfHistory(), execution=execution_settings(parser, args),
+                                  model_store=model_store(args))
+        with tqdm_checkpoints():
+            # Load the model up front so the first dropped file does not wait for it
+            engine.prepare(settings)
+            watch_folder(args.folder, settings, engine, output_root=args.output, interval=args.interval, settle_seconds=args.settle)
+        return 0
+
+    if args.command == "serve":
+        if args.workers < 1 or args.batch_size < 1 or args.max_queue < 1 or args.keep_finished < 1:
+            parser.error("--workers, --batch-size, --max-queue and --keep-finished must be at least 1")
+        settings = output_settings(parser, args)
+        # One cache shared by all workers
+        engine_factory = functools.partial(SeparationEngine, cache=local_cache(args), model_memory_bytes=int(args.model_memory * 1024 ** 3),
+                                           metrics_path=args.metrics, rtf_history=RtfHistory(), execution=execution_settings(parser, args),
+                                           model_store=model_store(args))
+        service = JobService(engine_factory, workers=args.workers, batch_size=args.batch_size, max_queue=args.max_queue,
+                             output_root=args.output, keep_finished=args.keep_finished)
+        try:
+            # The given model is loaded before the port opens; requests may still ask for any model
+            asyncio.run(serve(service, args.host, args.port, warm_settings=settings))
+        except KeyboardInterrupt:
+            logger.info("Stopped.")
+        return 0
+
+    return 0
@@ -0,0 +1,100 @@
+# Global constants
+LOG_FILE_NAME = "audio_separator.log"
+# Per-job stage timings and resource usage, one JSON object per line
+METRICS_FILE_NAME = "audio_separator.metrics.jsonl"
+# Measured real-time factors per host, model, shifts and overlap (for runtime predictions)
+RTF_HISTORY_FILE_NAME = "audio_separator.rtf.json"
+
+# Model configuration
+MODELS = {
+    "htdemucs_ft.yaml": "Fine-tuned Hybrid Transformer. Best overall quality (4 stems: Vocals, Drums, Bass, Other).",
+    "htdemucs.yaml": "Standard Hybrid Transformer. Good balance of speed and quality (4 stems).",
+    "htdemucs_6s.yaml": "6-Stem Hybrid Transformer. Adds Guitar and Piano separation.",
+    "hdemucs_mmi.yaml": "Hybrid Demucs v3. Older architecture, solid performance."
+}
+DEFAULT_MODEL = "htdemucs_ft.yaml"
+
+# Local model store (see natustem.model_store): where the model files live, and the files audio-separator
+# needs there for each model. Demucs checkpoints are named <signature>-<first 8 hex digits of their SHA-256>.
+MODEL_STORE_DIR = "models"
+MODEL_INDEX_URL = "https://raw.githubusercontent.com/TRvlvr/application_data/main/filelists/download_checks.json"
+DEMUCS_CHECKPOINT_URL = "https://dl.fbaipublicfiles.com/demucs/hybrid_transformer"
+UVR_MODEL_URL = "https://github.com/TRvlvr/model_repo/releases/download/all_public_uvr_models"
+MODEL_FILES = {
+    "htdemucs_ft.yaml": (
+        f"{DEMUCS_CHECKPOINT_URL}/f7e0c4bc-ba3fe64a.th",
+        f"{DEMUCS_CHECKPOINT_URL}/d12395a8-e57c48e6.th",
+        f"{DEMUCS_CHECKPOINT_URL}/92cfc3b6-ef3bcb9c.th",
+        f"{DEMUCS_CHECKPOINT_URL}/04573f0d-f3cf25b2.th",
+        f"{UVR_MODEL_URL}/htdemucs_ft.yaml",
+    ),
+    "htdemucs.yaml": (f"{DEMUCS_CHECKPOINT_URL}/955717e8-8726e21a.th", f"{UVR_MODEL_URL}/htdemucs.yaml"),
+    "htdemucs_6s.yaml": (f"{DEMUCS_CHECKPOINT_URL}/5c90dfd2-34c22ccb.th", f"{UVR_MODEL_URL}/htdemucs_6s.yaml"),
+    "hdemucs_mmi.yaml": (f"{DEMUCS_CHECKPOINT_URL}/75fc33f5-1941ce65.th", f"{UVR_MODEL_URL}/hdemucs_mmi.yaml"),
+}
+
+# Number of networks in each model's bag; demucs runs (and reports progress for) each one in turn
+MODEL_BAG_SIZES = {
+    "htdemucs_ft.yaml": 4,
+}
+
+# Approximate resident memory of each loaded model in bytes, used by the model cache
+# when the actual growth of the process cannot be measured
+MODEL_MEMORY_ESTIMATES = {
+    "htdemucs_ft.yaml": 1200 * 1024 ** 2,
+    "htdemucs.yaml": 350 * 1024 ** 2,
+    "htdemucs_6s.yaml": 350 * 1024 ** 2,
+    "hdemucs_mmi.yaml": 450 * 1024 ** 2,
+}
+
+# Memory planning (see natustem.memory): each model's own demucs segment length in seconds ("Default"),
+# and the approximate memory its activations need per second of segment
+MODEL_SEGMENT_SECONDS = {
+    "htdemucs_ft.yaml": 7.8,
+    "htdemucs.yaml": 7.8,
+    "htdemucs_6s.yaml": 7.8,
+    "hdemucs_mmi.yaml": 44,
+}
+MODEL_ACTIVATION_BYTES_PER_SECOND = {
+    "htdemucs_ft.yaml": 96 * 1024 ** 2,
+    "htdemucs.yaml": 96 * 1024 ** 2,
+    "htdemucs_6s.yaml": 128 * 1024 ** 2,
+    "hdemucs_mmi.yaml": 24 * 1024 ** 2,
+}
+
+# Default separation parameters (match the GUI slider defaults)
+DEFAULT_SHIFTS = 2
+DEFAULT_OVERLAP = 0.25
+
+# Streaming mode: window length and the overlap crossfaded between consecutive windows (seconds)
+DEFAULT_CHUNK_SECONDS = 120
+STREAM_CROSSFADE_SECONDS = 2.0
+
+# Preview mode: a short excerpt separated with at most these shifts/overlap, into its own folder (see natustem.preview)
+PREVIEW_OUTPUT_DIR = "preview"
+DEFAULT_PREVIEW_SECONDS = 30
+PREVIEW_SHIFTS = 0
+PREVIEW_OVERLAP = 0.1
+
+# Extensions accepted as input
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".flac")
+
+# Watch mode: the drop folder and the record of the files already separated (inside the output root)
+WATCH_INPUT_DIR = "input"
+WATCH_LEDGER_FILE_NAME = ".watch-ledger.json"
+
+# Persistent job queue (SQLite, inside the output root); see natustem.jobstore
+JOB_STORE_FILE_NAME = ".jobs.sqlite3"
+
+# Mapping of keyword in filename -> desired filename
+# Note: htdemucs output names can vary, but usually contain the stem name in parens or appended
+RENAME_MAP = {
+    "Vocals": "vocal.wav",
+    "Drums": "drums.wav",
+    "Bass": "bass.wav",
+    "Other": "other.wav",
+    "Guitar": "guitar.wav",
+    "Piano": "piano.wav",
+    # Derived as mix minus vocals (see natustem.stems)
+    "Instrumental": "instrumental.wav"
+}
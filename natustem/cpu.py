@@ -0,0 +1,197 @@
+"""CPU core detection, execution settings and per-worker thread shares.
+
+torch's intra-op parallelism stops scaling well before every core of a large
+machine is busy, so parallel mode runs several worker processes instead, each
+pinned to its own slice of the cores with a matching torch thread count.
+
+``ExecutionSettings`` sets the thread counts and CPU affinity of one engine.
+In auto mode they come from the host: one thread per physical core this
+process may use (SMT siblings add little to dense inference), capped by the
+cgroup CPU quota of a container, so a shared host is neither oversubscribed
+nor left idle.
+"""
+import logging
+import math
+import os
+import sys
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Environment variables read by the OpenMP/MKL/BLAS runtimes when torch is imported
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+SYSFS_CPU_DIR = "/sys/devices/system/cpu"
+CGROUP_ROOT = "/sys/fs/cgroup"
+# Auto mode runs independent operators one at a time: separation graphs are mostly sequential,
+# and every extra inter-op thread brings its own intra-op pool
+AUTO_INTER_OP_THREADS = 1
+
+
+def available_cores():
+    # Core ids this process may run on (respects taskset/affinity), in order
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def parse_cpu_list(text):
+    # "0-3,8" -> [0, 1, 2, 3, 8] (the format of taskset and /sys)
+    cpus = set()
+    for part in text.replace(" ", "").split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        first, last = int(first), int(last or first)
+        if first < 0 or last < first:
+            raise ValueError(f"invalid CPU range: {part}")
+        cpus.update(range(first, last + 1))
+    if not cpus:
+        raise ValueError("no CPUs given")
+    return sorted(cpus)
+
+
+def format_cpu_list(cpus):
+    # [0, 1, 2, 3, 8] -> "0-3,8"
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(first) if first == last else f"{first}-{last}" for first, last in ranges)
+
+
+def physical_cores(cores=None, sysfs=SYSFS_CPU_DIR):
+    # One logical CPU per physical core among `cores` (the first of its SMT siblings)
+    cores = list(cores) if cores is not None else available_cores()
+    chosen, seen = [], set()
+    for cpu in cores:
+        try:
+            siblings = Path(sysfs, f"cpu{cpu}", "topology", "thread_siblings_list").read_text().strip()
+        except OSError:
+            break
+        if siblings not in seen:
+            seen.add(siblings)
+            chosen.append(cpu)
+    else:
+        return chosen
+    # No topology in /sys (not Linux): only the count is known
+    try:
+        import psutil
+        count = psutil.cpu_count(logical=False)
+    except ImportError:
+        count = None
+    return cores[:min(count, len(cores))] if count else cores
+
+
+def cgroup_cpu_limit(root=CGROUP_ROOT):
+    # CPUs' worth of time allowed by a cgroup quota (docker --cpus, Kubernetes limits); None when unlimited
+    try:
+        quota, period = Path(root, "cpu.max").read_text().split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    # cgroup v1
+    for controller in ("cpu", "cpu,cpuacct"):
+        try:
+            quota = int(Path(root, controller, "cpu.cfs_quota_us").read_text())
+            period = int(Path(root, controller, "cpu.cfs_period_us").read_text())
+        except (OSError, ValueError):
+            continue
+        return quota / period if quota > 0 and period > 0 else None
+    return None
+
+
+class ExecutionSettings:
+    # Thread counts and affinity for torch (and the OpenMP/BLAS runtimes). None leaves a value to the
+    # runtime; with auto, resolve() fills the unset values from the host.
+    def __init__(self, intra_op_threads=None, inter_op_threads=None, cpus=None, auto=False):
+        for name, value in (("intra-op threads", intra_op_threads), ("inter-op threads", inter_op_threads)):
+            if value is not None and value < 1:
+                raise ValueError(f"{name} must be at least 1")
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.cpus = sorted(cpus) if cpus else None
+        self.auto = auto
+        # What auto mode found, for the job log
+        self.detected = None
+
+    def resolve(self, cores=None, quota=None, sysfs=SYSFS_CPU_DIR, cgroup_root=CGROUP_ROOT):
+        if not self.auto:
+            return self
+        allowed = self.cpus or cores or available_cores()
+        physical = physical_cores(allowed, sysfs=sysfs)
+        quota = quota if quota is not None else cgroup_cpu_limit(cgroup_root)
+        threads = len(physical)
+        if quota:
+            threads = max(1, min(threads, math.floor(quota)))
+        cpus = self.cpus
+        if cpus is None and not quota and len(physical) < len(allowed) and hasattr(os, "sched_setaffinity"):
+            # Keep the threads off the SMT siblings. Under a quota the scheduler spreads the allowed
+            # time better than a fixed pin, and another process may pin the same cores.
+            cpus = physical
+        resolved = ExecutionSettings(self.intra_op_threads or threads, self.inter_op_threads or AUTO_INTER_OP_THREADS, cpus)
+        resolved.auto = True
+        resolved.detected = (f"{len(physical)} physical cores of {len(allowed)} CPUs, "
+                             + (f"cgroup quota {quota:g} CPUs" if quota else "no cgroup quota"))
+        return resolved
+
+    def to_dict(self):
+        return {
+            "auto": self.auto,
+            "intra_op_threads": self.intra_op_threads,
+            "inter_op_threads": self.inter_op_threads,
+            "cpus": format_cpu_list(self.cpus) if self.cpus else None,
+        }
+
+    def describe(self):
+        parts = [f"intra-op threads {self.intra_op_threads or 'default'}", f"inter-op threads {self.inter_op_threads or 'default'}",
+                 f"CPUs {format_cpu_list(self.cpus) if self.cpus else 'all'}"]
+        text = ", ".join(parts)
+        if self.auto:
+            text = f"auto: {text}" + (f" ({self.detected})" if self.detected else "")
+        return text
+
+
+def split_cores(cores, workers):
+    # Contiguous, near-equal slices of `cores`, one per worker; never more workers than cores
+    workers = max(1, min(workers, len(cores)))
+    size, extra = divmod(len(cores), workers)
+    shares = []
+    start = 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        shares.append(cores[start:end])
+        start = end
+    return shares
+
+
+def apply_thread_limits(threads=None, cpus=None):
+    # Call before torch is imported; limits an already imported torch as well
+    if threads:
+        for name in THREAD_ENV_VARS:
+            os.environ[name] = str(threads)
+        torch = sys.modules.get("torch")
+        if torch is not None:
+            torch.set_num_threads(threads)
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except (AttributeError, OSError) as e:
+            logger.warning(f"Could not pin worker to CPUs {cpus}: {e}")
+
+
+def apply_execution_settings(settings):
+    # Thread counts are process-wide; the affinity applies to the calling thread and the threads it
+    # starts, so it is applied on the thread that runs the job. The environment variables only reach
+    # torch if it is not imported yet: this runs before the Separator is built and again once it is.
+    apply_thread_limits(settings.intra_op_threads, settings.cpus)
+    torch = sys.modules.get("torch")
+    if torch is None or not settings.inter_op_threads or torch.get_num_interop_threads() == settings.inter_op_threads:
+        return
+    try:
+        torch.set_num_interop_threads(settings.inter_op_threads)
+    except RuntimeError as e:
+        # Only possible before torch's first parallel work
+        logger.warning(f"Could not set {settings.inter_op_threads} inter-op threads: {e}")
@@ -0,0 +1,173 @@
+"""Output formats and background encoding of the stems.
+
+The Separator always writes 16-bit WAV into the temp dir, which is the
+cheapest thing to produce next to the model. For any other format or bit
+depth the engine publishes those WAVs into a hidden staging folder inside
+the output folder and reports the final names (``vocal.flac`` ...) in
+``SeparationResult.encodes``. ``EncoderPool`` then converts them with ffmpeg
+on background threads, while the next job is already running inference.
+The engine reserves each final name with an empty placeholder; the encoder
+writes ``<name>.part`` and renames it over the placeholder when complete, so
+a half-encoded file never appears under its final name.
+"""
+import logging
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from natustem.outputs import existing_names, publish_file
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("WAV", "FLAC", "MP3")
+# Bit depths offered per format (MP3 has a bitrate instead)
+BIT_DEPTHS = {"WAV": (16, 24, 32), "FLAC": (16, 24), "MP3": ()}
+DEFAULT_MP3_BITRATE = "320k"
+# Prefix of the per-job folder holding WAV stems until they are encoded
+STAGING_PREFIX = ".encoding-"
+# ffmpeg encoders are mostly single-threaded; a few run next to inference
+DEFAULT_ENCODER_WORKERS = 2
+
+
+class OutputFormat:
+    def __init__(self, format="WAV", bit_depth=16, mp3_bitrate=DEFAULT_MP3_BITRATE):
+        self.format = format.upper()
+        if self.format not in FORMATS:
+            raise ValueError(f"Unsupported output format {format!r}; choose one of {', '.join(FORMATS)}")
+        depths = BIT_DEPTHS[self.format]
+        if depths and int(bit_depth) not in depths:
+            raise ValueError(f"{self.format} supports bit depths {', '.join(map(str, depths))}, not {bit_depth}")
+        self.bit_depth = int(bit_depth) if depths else None
+        self.mp3_bitrate = mp3_bitrate if self.format == "MP3" else None
+
+    @property
+    def extension(self):
+        return "." + self.format.lower()
+
+    @property
+    def needs_encoding(self):
+        # The Separator's own output is 16-bit WAV
+        return not (self.format == "WAV" and self.bit_depth == 16)
+
+    def ffmpeg_args(self):
+        if self.format == "WAV":
+            codec = {16: "pcm_s16le", 24: "pcm_s24le", 32: "pcm_f32le"}[self.bit_depth]
+            return ["-c:a", codec, "-f", "wav"]
+        if self.format == "FLAC":
+            if self.bit_depth == 24:
+                return ["-c:a", "flac", "-sample_fmt", "s32", "-bits_per_raw_sample", "24", "-f", "flac"]
+            return ["-c:a", "flac", "-sample_fmt", "s16", "-f", "flac"]
+        return ["-c:a", "libmp3lame", "-b:a", self.mp3_bitrate, "-f", "mp3"]
+
+    def to_dict(self):
+        return {"format": self.format, "bit_depth": self.bit_depth, "mp3_bitrate": self.mp3_bitrate}
+
+    def describe(self):
+        if self.format == "MP3":
+            return f"MP3 {self.mp3_bitrate}"
+        return f"{self.format} {self.bit_depth}-bit"
+
+    def __eq__(self, other):
+        return isinstance(other, OutputFormat) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"OutputFormat({self.describe()!r})"
+
+
+def encode_file(source, target, output_format):
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg is required to write FLAC, MP3 or non-16-bit WAV output.")
+    partial = target.with_name(target.name + ".part")
+    try:
+        subprocess.run(
+            [ffmpeg, "-nostdin", "-v", "error", "-y", "-i", str(source), *output_format.ffmpeg_args(), str(partial)],
+            check=True, capture_output=True, text=True
+        )
+        os.replace(partial, target)
+    except subprocess.CalledProcessError as e:
+        partial.unlink(missing_ok=True)
+        raise RuntimeError(f"ffmpeg failed for {target.name}: {e.stderr.strip()}") from e
+    source.unlink()
+
+
+class EncodeBatch:
+    # The encodes of one job; callbacks run once every stem is finished
+    def __init__(self, result, futures):
+        self.result = result
+        self.futures = futures
+        self.lock = threading.Lock()
+        self.remaining = len(futures)
+        self.callbacks = []
+        self.errors = []
+
+    def task_done(self, error=None):
+        with self.lock:
+            if error is not None:
+                self.errors.append(error)
+            self.remaining -= 1
+            finished = self.remaining == 0
+            callbacks = list(self.callbacks) if finished else []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        with self.lock:
+            if self.remaining > 0:
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+    def done(self):
+        return self.remaining == 0
+
+    def wait(self):
+        for future in self.futures:
+            future.result()
+        return self.errors
+
+
+class EncoderPool:
+    def __init__(self, workers=DEFAULT_ENCODER_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encoder")
+
+    def submit(self, result, output_format, log=logger.info):
+        # Encodes result.encodes ({final name: staged WAV path}) in the background
+        encodes = dict(getattr(result, "encodes", None) or {})
+        batch = EncodeBatch(result, [])
+        batch.remaining = len(encodes)
+        if not encodes:
+            return batch
+        log(f"Encoding {len(encodes)} stems to {output_format.describe()} in the background...")
+        for final_name, staged in encodes.items():
+            batch.futures.append(self.executor.submit(self.encode_stem, batch, Path(staged), Path(result.output_dir) / final_name,
+                                                      output_format, log))
+        return batch
+
+    def encode_stem(self, batch, source, target, output_format, log):
+        error = None
+        try:
+            encode_file(source, target, output_format)
+            log(f"Saved {target.name}")
+        except Exception as e:
+            error = str(e)
+            # Keep the stem rather than lose it: drop the empty placeholder and publish the WAV instead
+            if target.exists() and target.stat().st_size == 0:
+                target.unlink()
+            try:
+                fallback = publish_file(source, target.parent, target.with_suffix(".wav").name, existing_names(target.parent))
+                log(f"Could not encode {target.name} ({e}); kept {fallback.name} instead.")
+            except OSError:
+                log(f"Could not encode {target.name} ({e}); the WAV stem is in {source.parent}.")
+        finally:
+            try:
+                source.parent.rmdir()  # The staging folder, once its last stem is gone
+            except OSError:
+                pass
+            batch.task_done(error)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,573 @@
+"""Separation pipeline shared by the GUI and the headless CLI.
+
+The engine keeps its loaded models (one persistent ``Separator`` per model,
+see ``natustem.models``) and reports progress through a
+plain ``log`` callback, so it can be driven from a Flet worker thread or from
+a terminal without any GUI widgets.
+"""
+import functools
+import gc
+import logging
+import time
+import uuid
+from pathlib import Path
+
+from natustem import cancellation, memory, metrics, streaming
+from natustem.audio import probe_duration, read_through
+from natustem.cpu import apply_execution_settings
+from natustem.constants import (AUDIO_EXTENSIONS, DEFAULT_MODEL, DEFAULT_OVERLAP, DEFAULT_SHIFTS, RENAME_MAP,
+                                STREAM_CROSSFADE_SECONDS)
+from natustem.encoding import STAGING_PREFIX, OutputFormat
+from natustem.model_store import skip_verified_checksums
+from natustem.models import DEFAULT_MODEL_MEMORY_BUDGET, ModelCache
+from natustem.outputs import OutputDirLock, discard_new_files, existing_names, publish_file, reserve_name
+from natustem.resources import ResourceSampler, available_memory
+from natustem.stems import INSTRUMENTAL, derive_instrumental, instrumental_name, normalize_stems, single_stem, stem_of
+
+logger = logging.getLogger(__name__)
+
+
+def create_separator(**kwargs):
+    # Imported lazily: audio_separator pulls in torch and onnxruntime
+    from audio_separator.separator import Separator
+    return Separator(**kwargs)
+
+
+def find_audio_files(paths):
+    # Expand directories (e.g. input/) into the audio files they contain
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.extend(sorted(p for p in path.iterdir() if p.is_file() and p.suffix.lower() in AUDIO_EXTENSIONS))
+        elif path.is_file():
+            files.append(path)
+        else:
+            logger.warning(f"Skipping {path}: not a file or directory.")
+    return files
+
+
+def match_stem_filename(file):
+    # Returns the readable name for a separator output file, or None if no stem matches
+    stem = stem_of(file)
+    return RENAME_MAP[stem] if stem is not None else None
+
+
+def staging_dir_for(output_dir, encodes):
+    # The job's hidden folder for WAV stems awaiting the encoder; one per job, named once
+    for staged in encodes.values():
+        return Path(staged).parent
+    return output_dir / f"{STAGING_PREFIX}{uuid.uuid4().hex[:12]}"
+
+
+class SeparationSettings:
+    def __init__(self, model_name=DEFAULT_MODEL, shifts=DEFAULT_SHIFTS, overlap=DEFAULT_OVERLAP, chunk_seconds=None,
+                 output_format=None, stems=None, segment_size=None):
+        self.model_name = model_name
+        self.shifts = int(shifts)
+        self.overlap = round(float(overlap), 2)
+        # Streaming mode (see natustem.streaming) when set: window length in seconds
+        self.chunk_seconds = int(chunk_seconds) if chunk_seconds else None
+        # Format of the published stems. Not part of to_dict(): the cache keeps WAV stems for every format.
+        self.output_format = output_format or OutputFormat()
+        # Wanted stems, e.g. ("Vocals", "Instrumental"); None for every stem of the model
+        self.stems = normalize_stems(stems, model_name)
+        # Demucs segment: None to plan it per job from the free memory (see natustem.memory),
+        # "Default" for the model's own length, or seconds
+        self.segment_size = memory.parse_segment_size(segment_size)
+
+    def to_dict(self):
+        settings = {"model_name": self.model_name, "shifts": self.shifts, "overlap": self.overlap}
+        if self.chunk_seconds:
+            # Only present in streaming mode, so existing result cache keys stay valid
+            settings["chunk_seconds"] = self.chunk_seconds
+        if self.stems:
+            settings["stems"] = list(self.stems)
+        if self.segment_size is not None:
+            settings["segment_size"] = self.segment_size
+        return settings
+
+    def __repr__(self):
+        streaming_note = f", chunk_seconds={self.chunk_seconds}" if self.chunk_seconds else ""
+        format_note = f", output_format={self.output_format!r}" if self.output_format.needs_encoding else ""
+        stems_note = f", stems={self.stems!r}" if self.stems else ""
+        segment_note = f", segment_size={self.segment_size!r}" if self.segment_size is not None else ""
+        return (f"SeparationSettings(model_name={self.model_name!r}, shifts={self.shifts}, overlap={self.overlap}"
+                f"{streaming_note}{format_note}{stems_note}{segment_note})")
+
+
+class SeparationResult:
+    def __init__(self, input_path, output_dir, files, timings, cached=False, resources=None, encodes=None):
+        self.input_path = input_path
+        self.output_dir = output_dir
+        self.files = files
+        self.timings = timings
+        self.cached = cached
+        # Peak RSS and CPU utilization while the job ran (see ResourceSampler)
+        self.resources = resources or {}
+        # Final file name -> staged WAV still to be encoded (see natustem.encoding.EncoderPool)
+        self.encodes = encodes or {}
+
+    def to_dict(self):
+        return {
+            "input": str(self.input_path),
+            "output_dir": str(self.output_dir),
+            "files": self.files,
+            "timings": self.timings,
+            "cached": self.cached,
+            "resources": self.resources,
+            "pending_encodes": len(self.encodes),
+        }
+
+
+class PrefetchedInput:
+    def __init__(self, input_path, cache_key, seconds):
+        self.input_path = Path(input_path)
+        # Result cache key computed while reading, or None without a cache
+        self.cache_key = cache_key
+        self.seconds = seconds
+
+
+class PendingSeparation:
+    # A job whose model has run but whose stems are not published yet; see SeparationEngine.begin()
+    def __init__(self, engine, input_path, output_dir, settings, log, lock):
+        self.engine = engine
+        self.input_path = input_path
+        self.output_dir = output_dir
+        self.settings = settings
+        self.log = log
+        self.lock = lock
+        self.created_output_dir = not output_dir.exists()
+        self.existing = existing_names(output_dir)
+        self.sampler = ResourceSampler().start()
+        self.timings = {}
+        self.cache_key = None
+        self.model_seconds = 0.0
+        # The natustem.memory.MemoryPlan the model ran with (the last one tried, after fallbacks)
+        self.memory_plan = None
+        # The separator's output files; on a cache hit the finished result is set instead
+        self.output_files = None
+        self.result = None
+
+    def finish(self):
+        try:
+            if self.result is None:
+                self.result = self.engine.publish_outputs(self)
+        except Exception as e:
+            self.abandon("error", error=str(e))
+            raise
+        self.lock.__exit__(None, None, None)
+        result = self.result
+        result.resources = self.sampler.stop()
+        engine, settings = self.engine, self.settings
+        engine.record_metrics(self.input_path, settings, "ok", result.timings, result.resources, cached=result.cached,
+                              memory_plan=self.memory_plan)
+        if engine.rtf_history is not None and not result.cached:
+            rtf = engine.rtf_history.record(settings, result.timings["separate"], probe_duration(self.input_path))
+            if rtf is not None:
+                self.log(f"Real-time factor: {rtf:.2f}")
+        return result
+
+    def abandon(self, status, error=None):
+        # Removes what the job wrote so far and releases its output folder
+        try:
+            self.engine.discard_partial_outputs(self.output_dir, self.existing, self.created_output_dir, log=self.log)
+            self.engine.record_metrics(self.input_path, self.settings, status, self.timings, self.sampler.stop(), error=error,
+                                       memory_plan=self.memory_plan)
+        finally:
+            self.lock.__exit__(None, None, None)
+
+
+class SeparationEngine:
+    def __init__(self, output_root="output", separator_factory=create_separator, cache=None,
+                 model_memory_bytes=DEFAULT_MODEL_MEMORY_BUDGET, metrics_path=None, rtf_history=None, execution=None,
+                 memory_probe=available_memory, model_store=None):
+        self.output_root = Path(output_root)
+        # The Separator writes straight into the current job's output folder (see natustem.outputs)
+        self.job_output_dir = None
+        self.separator_factory = separator_factory
+        # Optional ResultCache; identical inputs with identical settings skip the model entirely
+        self.cache = cache
+        # Loaded models stay resident (up to the memory budget) so switching models does not reload them
+        self.models = ModelCache(self.build_separator, budget_bytes=model_memory_bytes)
+        # Optional JSON lines file that receives one metrics record per job
+        self.metrics_path = metrics_path
+        # Optional tuning.RtfHistory that learns this host's speed from every separation
+        self.rtf_history = rtf_history
+        # Optional cpu.ExecutionSettings (thread counts, affinity), applied before the Separator is built
+        # and before every job; None leaves torch's defaults. Resolved per job, so auto mode follows the host.
+        self.execution = execution
+        self.applied_execution = None
+        # Returns the bytes the process can still allocate (None if unknown); every job's segment size and
+        # streaming window are planned against it (see natustem.memory)
+        self.memory_probe = memory_probe
+        # Optional model_store.ModelStore: the Separator's model_file_dir. Its files are checked before a
+        # model is loaded (offline: missing files fail the job up front) and verified ones are not re-hashed.
+        self.model_store = model_store
+        # The Separator (and model) used by the current or last job
+        self.separator = None
+        self.loaded_model_name = None
+
+    def stop(self):
+        # Drop every Separator (and the models they hold)
+        self.separator = None
+        self.loaded_model_name = None
+        self.models.clear()
+
+    def resident_models(self):
+        return self.models.resident_models()
+
+    def model_state(self):
+        # Snapshot for schedulers that group jobs by model (also sent back by worker processes)
+        return {"loaded_model_name": self.loaded_model_name, "resident_models": self.resident_models(), "model_cache": self.models.stats()}
+
+    def output_dir_for(self, input_path):
+        # Create output directory: output folder / [filename_no_ext]
+        return self.output_root / Path(input_path).stem
+
+    def build_separator(self):
+        options = {"model_file_dir": str(self.model_store.root)} if self.model_store is not None else {}
+        separator = self.separator_factory(
+            log_level=logging.INFO,
+            output_format="WAV",
+            output_dir=str(self.job_output_dir or self.output_root),
+            demucs_params={
+                "segment_size": "Default",
+                "segments_enabled": True
+            },
+            **options
+        )
+        if self.model_store is not None:
+            skip_verified_checksums(self.model_store)
+        # torch is imported now: its inter-op pool can only be sized before the model first runs
+        if self.applied_execution is not None:
+            apply_execution_settings(self.applied_execution)
+        return separator
+
+    def apply_execution(self):
+        # Returns the resolved settings now in effect, or None for the runtime defaults
+        if self.execution is None:
+            self.applied_execution = None
+            return None
+        self.applied_execution = self.execution.resolve()
+        apply_execution_settings(self.applied_execution)
+        return self.applied_execution
+
+    def configure_separator(self, separator, settings):
+        # Point the (possibly long-lived) separator at this job's output folder
+        separator.output_dir = str(self.job_output_dir or self.output_root)
+        # A loaded model keeps its own copy of output_dir
+        model_instance = getattr(separator, "model_instance", None)
+        # Only one model stem needed: the Separator does not write the others at all
+        separator.output_single_stem = single_stem(settings.stems)
+        if model_instance is not None and hasattr(model_instance, "output_dir"):
+            model_instance.output_dir = separator.output_dir
+            model_instance.output_single_stem = separator.output_single_stem
+
+        # Updating demucs_params. Note: The Separator class might use these during load_model or separate.
+        if hasattr(separator, 'demucs_params'):
+            separator.demucs_params["shifts"] = settings.shifts
+            separator.demucs_params["overlap"] = settings.overlap
+
+    def plan_memory(self, input_path, settings):
+        # Chooses the job's segment size and streaming window from the memory left once its model is loaded
+        return memory.plan_memory(settings.model_name, probe_duration(input_path), self.memory_probe(),
+                                  segment_size=settings.segment_size, chunk_seconds=settings.chunk_seconds,
+                                  can_stream=streaming.can_stream(input_path))
+
+    def apply_memory_plan(self, plan):
+        # The segment size is read from demucs_params on each separate(); a loaded model keeps its own copy
+        if hasattr(self.separator, "demucs_params"):
+            self.separator.demucs_params["segment_size"] = plan.segment_size
+        model_instance = getattr(self.separator, "model_instance", None)
+        if model_instance is not None and hasattr(model_instance, "segment_size"):
+            model_instance.segment_size = plan.segment_size
+
+    def prepare(self, settings, log=logger.info):
+        # Selects (loading if needed) the Separator for the model. Returns stage timings.
+        self.apply_execution()
+        timings = {}
+        missing = None
+        if self.model_store is not None and settings.model_name not in self.models.resident_models():
+            start = time.perf_counter()
+            missing = self.model_store.ensure(settings.model_name, log=log)
+            timings["model_check"] = time.perf_counter() - start
+        configure = functools.partial(self.configure_separator, settings=settings)
+        self.separator, load_timings = self.models.acquire(settings.model_name, log=log, configure=configure)
+        timings.update(load_timings)
+        if missing:
+            # Record what load_model() just downloaded, so the next load trusts it
+            self.model_store.adopt(settings.model_name, log=log)
+        self.loaded_model_name = settings.model_name
+        configure(self.separator)
+        return timings
+
+    def separate(self, input_path, settings, log=logger.info, cancel_token=None, output_dir=None):
+        # cancel_token (a CancelToken) stops the job at the next stage boundary or demucs chunk
+        return self.begin(input_path, settings, log=log, cancel_token=cancel_token, output_dir=output_dir).finish()
+
+    def prefetch(self, input_path, settings):
+        # Reads the next input ahead of begin() while the model is busy (see natustem.pipeline):
+        # hashing it for the result cache, or just reading it so the separator's decode hits the OS cache
+        start = time.perf_counter()
+        cache_key = None
+        try:
+            if self.cache is not None:
+                cache_key = self.cache.key_for(input_path, settings)
+            else:
+                read_through(input_path)
+        except OSError as e:
+            logger.debug(f"Could not prefetch {input_path}: {e}")
+        return PrefetchedInput(input_path, cache_key, time.perf_counter() - start)
+
+    def begin(self, input_path, settings, log=logger.info, cancel_token=None, prefetched=None, output_dir=None):
+        # Runs the model and returns a PendingSeparation whose finish() selects, renames, caches and
+        # publishes the stems. The output folder stays locked until then, so finish() may run on
+        # another thread while this engine already separates the next file.
+        # output_dir overrides output_root/<input stem> (previews are published outside the output root).
+        token = cancel_token or cancellation.CancelToken()
+        input_path = Path(input_path)
+        output_dir = Path(output_dir) if output_dir is not None else self.output_dir_for(input_path)
+        # One job at a time per output folder (e.g. two different song.mp3 files), in any process
+        lock = OutputDirLock(output_dir.parent, output_dir.name)
+        lock.__enter__()
+        try:
+            job = PendingSeparation(self, input_path, output_dir, settings, log, lock)
+        except BaseException:
+            # From here on the job owns the lock and releases it in finish() or abandon()
+            lock.__exit__(None, None, None)
+            raise
+        try:
+            self.run_model(job, token, prefetched)
+        except cancellation.JobCancelledError:
+            log(f"Separation {token.reason}.")
+            job.abandon(token.reason)
+            raise
+        except Exception as e:
+            job.abandon("error", error=str(e))
+            raise
+        finally:
+            self.job_output_dir = None
+        return job
+
+    def record_metrics(self, input_path, settings, status, timings, resources, cached=False, error=None, memory_plan=None):
+        if self.metrics_path is not None:
+            record = metrics.build_record(input_path, settings, status, timings, resources, cached=cached, error=error,
+                                          execution=self.applied_execution.to_dict() if self.applied_execution is not None else None,
+                                          memory_plan=memory_plan.to_dict() if memory_plan is not None else None)
+            metrics.append_record(self.metrics_path, record)
+
+    def separate_streaming(self, input_path, output_dir, settings, log, token, chunk_seconds=None):
+        # Window by window; the work dir survives failures and cancels so a re-run resumes.
+        # chunk_seconds overrides the settings' window (the memory plan may choose or shrink it).
+        chunk_seconds = chunk_seconds or settings.chunk_seconds
+        work_dir = streaming.work_dir_for(self.output_root / ".streaming", input_path, settings)
+        log(f"Streaming mode: {chunk_seconds}s chunks, {STREAM_CROSSFADE_SECONDS:g}s crossfade.")
+        return streaming.StreamingSeparation(
+            self.separator, input_path, work_dir, output_dir, chunk_seconds, STREAM_CROSSFADE_SECONDS,
+            log=log, cancel_token=token
+        ).run()
+
+    def discard_partial_outputs(self, output_dir, existing, remove_dir=False, log=logger.info):
+        # Remove what the interrupted job wrote into its output folder (the folder lock keeps other jobs out)
+        discard_new_files(output_dir, existing, remove_dir, log=log)
+
+    def run_model(self, job, token, prefetched=None):
+        # Up to the separator's raw output files (job.output_files), or the finished result on a cache hit.
+        # Stage timings go into job.timings as they complete, so a failed job still reports them.
+        input_path, output_dir, settings, log, timings = job.input_path, job.output_dir, job.settings, job.log, job.timings
+        started = time.perf_counter()
+        token.raise_if_cancelled()
+        output_dir.mkdir(parents=True, exist_ok=True)
+        self.job_output_dir = output_dir
+
+        log(f"Input file: {input_path}")
+        log(f"Output directory: {output_dir}")
+        log(f"Selected model: {settings.model_name}")
+        log(f"Updating parameters -> Output: {output_dir}, Shifts: {settings.shifts}, Overlap: {settings.overlap}")
+        execution = self.apply_execution()
+        log(f"Execution: {execution.describe() if execution is not None else 'runtime defaults'}")
+
+        if self.cache is not None:
+            start = time.perf_counter()
+            try:
+                if prefetched is not None and prefetched.cache_key is not None:
+                    job.cache_key = prefetched.cache_key
+                else:
+                    job.cache_key = self.cache.key_for(input_path, settings)
+                cached_files = self.cache.lookup(job.cache_key)
+            except OSError as e:
+                # The cache must never stop a separation
+                log(f"Result cache unavailable: {e}")
+                job.cache_key = cached_files = None
+            timings["hash"] = time.perf_counter() - start + (prefetched.seconds if prefetched is not None else 0.0)
+            if cached_files:
+                log("Found identical input with identical settings in the result cache.")
+                job.result = self.restore_cached(input_path, output_dir, cached_files, log=log, output_format=settings.output_format)
+                timings.update(job.result.timings)
+                timings["total"] = time.perf_counter() - started
+                job.result.timings = timings
+                return
+
+        token.raise_if_cancelled()
+        timings.update(self.prepare(settings, log=log))
+        token.raise_if_cancelled()
+        plan = job.memory_plan = self.plan_memory(input_path, settings)
+        log(plan.describe())
+
+        # Separate
+        log(f"Separating {input_path.name}...")
+        start = time.perf_counter()
+        # Files are generated in the output folder. The token is only active around
+        # separate(): interrupting load_model mid-download could leave a truncated model file.
+        marks = metrics.ProgressMarks()
+        try:
+            while True:
+                self.apply_memory_plan(plan)
+                try:
+                    with cancellation.activate(token), metrics.activate(marks):
+                        if plan.chunk_seconds:
+                            job.output_files = self.separate_streaming(input_path, output_dir, settings, log, token,
+                                                                       chunk_seconds=plan.chunk_seconds)
+                        else:
+                            job.output_files = self.separator.separate(str(input_path))
+                    break
+                except Exception as e:
+                    smaller = plan.fallback() if memory.is_out_of_memory(e) else None
+                    if smaller is None:
+                        raise
+                    log(f"Ran out of memory ({e}); retrying with a smaller plan.")
+                    self.discard_partial_outputs(output_dir, job.existing, log=log)
+                    gc.collect()
+                    plan = job.memory_plan = smaller
+                    log(plan.describe())
+        finally:
+            finished = time.perf_counter()
+            timings["separate"] = finished - start
+            # decode / inference / write, split at the first and last progress bar updates
+            timings.update(marks.split(start, finished))
+        peak = job.sampler.peak_rss
+        log(f"Memory: estimated {memory.format_bytes(plan.estimated_bytes)}"
+            f"{', measured peak RSS ' + memory.format_bytes(peak) if peak else ''}.")
+        token.raise_if_cancelled()
+        job.model_seconds = time.perf_counter() - started
+
+    def publish_outputs(self, job):
+        # Second half of a job: everything after the model, on whichever thread calls job.finish()
+        input_path, output_dir, settings, log, timings = job.input_path, job.output_dir, job.settings, job.log, job.timings
+        started = time.perf_counter()
+        output_files = job.output_files
+        if settings.stems:
+            output_files = self.select_stems(input_path, output_dir, output_files, settings.stems, log, timings)
+
+        log("Separation complete! Moving and renaming files...")
+        start = time.perf_counter()
+        encodes = {}
+        renamed_files = self.move_outputs(output_files, output_dir, log=log, output_format=settings.output_format, encodes=encodes)
+        timings["move"] = time.perf_counter() - start
+
+        if job.cache_key is not None and renamed_files:
+            start = time.perf_counter()
+            try:
+                # Stems waiting for the encoder are still WAV in the staging folder; the cache keeps those
+                stored = [Path(encodes[f]) if f in encodes else output_dir / f for f in renamed_files]
+                self.cache.store(job.cache_key, stored, description=input_path.name)
+            except OSError as e:
+                log(f"Could not store result in cache: {e}")
+            timings["cache_store"] = time.perf_counter() - start
+        # Time spent waiting between the two halves (in a pipeline) is not part of the job
+        timings["total"] = job.model_seconds + time.perf_counter() - started
+
+        log(f"Generated files: {renamed_files}")
+        return SeparationResult(input_path, output_dir, renamed_files, timings, encodes=encodes)
+
+    def select_stems(self, input_path, output_dir, output_files, stems, log, timings):
+        # Drops the stems nobody asked for and derives the instrumental (see natustem.stems)
+        selected = []
+        vocals = None
+        for file in output_files:
+            stem = stem_of(file)
+            if stem == "Vocals":
+                vocals = file
+            if stem is None or stem in stems:
+                selected.append(file)
+            elif not (stem == "Vocals" and INSTRUMENTAL in stems):
+                (output_dir / file).unlink(missing_ok=True)
+                log(f"Skipped unwanted stem {file}")
+        if INSTRUMENTAL in stems:
+            if vocals is None:
+                raise RuntimeError("The model returned no vocal stem to derive the instrumental from.")
+            start = time.perf_counter()
+            name = instrumental_name(vocals)
+            derive_instrumental(input_path, output_dir / vocals, output_dir / name)
+            timings["instrumental"] = time.perf_counter() - start
+            selected.append(name)
+            if "Vocals" not in stems:
+                (output_dir / vocals).unlink()
+        return selected
+
+    def restore_cached(self, input_path, output_dir, cached_files, log=logger.info, output_format=None):
+        start = time.perf_counter()
+        restored_files = []
+        encodes = {}
+        taken = existing_names(output_dir)
+        for cached_path in cached_files:
+            final_path = self.publish(cached_path, cached_path.name, output_dir, taken, output_format, encodes, keep_source=True)
+            restored_files.append(final_path.name)
+            if final_path.name not in encodes:
+                log(f"Saved {final_path.name} (cached)")
+        log(f"Generated files: {restored_files}")
+        return SeparationResult(input_path, output_dir, restored_files, {"cache_restore": time.perf_counter() - start}, cached=True,
+                                encodes=encodes)
+
+    def publish(self, source, target_filename, output_dir, taken, output_format=None, encodes=None, keep_source=False):
+        # Puts one stem under its final name, or stages its WAV for the encoder and reserves that name
+        if output_format is None or not output_format.needs_encoding or encodes is None:
+            return publish_file(source, output_dir, target_filename, taken, keep_source=keep_source)
+        # An empty placeholder keeps later jobs from picking the same name before the encoder finishes
+        final_path = reserve_name(output_dir, Path(target_filename).with_suffix(output_format.extension).name, taken)
+        staging_dir = staging_dir_for(output_dir, encodes)
+        staging_dir.mkdir(exist_ok=True)
+        try:
+            staged_path = publish_file(source, staging_dir, Path(final_path.name).with_suffix(".wav").name, set(),
+                                       keep_source=keep_source)
+        except (OSError, ValueError):
+            final_path.unlink(missing_ok=True)
+            raise
+        encodes[final_path.name] = str(staged_path)
+        return final_path
+
+    def move_outputs(self, output_files, output_dir, log=logger.info, output_format=None, encodes=None):
+        # Post-processing rename logic
+        # Expected outputs from htdemucs usually follow pattern:
+        # {input_filename}_(Vocals)_{model_name}.wav
+        # We want: vocal.wav, bass.wav, drums.wav, other.wav
+        renamed_files = []
+        # One directory scan for all stems; publish_file keeps it up to date
+        taken = existing_names(output_dir)
+
+        for file in output_files:
+            # The separator wrote the file into the output folder under its own name
+            original_path = output_dir / file
+
+            if not original_path.exists():
+                log(f"Warning: Expected file {file} not found in {output_dir}.")
+                continue
+
+            target_filename = match_stem_filename(file)
+            if target_filename is None:
+                log(f"Could not match stem for {file}, keeping original name.")
+                target_filename = file # Default to original name
+
+            try:
+                # Rename to the final name (or move to the encoder's staging folder)
+                final_path = self.publish(original_path, target_filename, output_dir, taken, output_format, encodes)
+                target_filename = final_path.name
+                renamed_files.append(target_filename)
+                if encodes and target_filename in encodes:
+                    log(f"Staged {target_filename} for encoding")
+                else:
+                    log(f"Saved {target_filename}")
+            except (OSError, ValueError) as e:
+                log(f"Error moving {file}: {e}")
+
+        return renamed_files
@@ -0,0 +1,339 @@
+"""Persistent job queue in SQLite: survives crashes and is shared between processes.
+
+Every job (input, settings, state, timings, output files) is a row in
+``output/.jobs.sqlite3``; each state change is also appended to
+``job_events``. The database runs in WAL mode, and jobs are claimed inside
+``BEGIN IMMEDIATE`` transactions, so several worker processes on the same host
+can drain one store without taking the same job twice.
+
+A job still "running" or "encoding" whose owning process is gone was
+interrupted (crash, reboot, Ctrl+C). ``recover()`` puts such jobs back to
+"pending". An interrupted "encoding" job is separated again from scratch, so
+its stems (encoded or still empty placeholders) and its staging folder of
+WAVs are removed first; the rerun then gets the same file names. Adding an input that already has a job
+with the same settings reuses that job, so restarting a batch skips the files
+that are done and resumes the rest.
+"""
+import json
+import logging
+import os
+import platform
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from natustem.constants import JOB_STORE_FILE_NAME
+from natustem.encoding import DEFAULT_MP3_BITRATE, STAGING_PREFIX, OutputFormat
+from natustem.engine import SeparationSettings
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+ENCODING = "encoding"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE = (RUNNING, ENCODING)
+# Jobs in these states are not reused when the same input is added again
+RETRYABLE = (FAILED, CANCELLED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    input_path TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    model_name TEXT NOT NULL,
+    state TEXT NOT NULL,
+    owner TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    output_dir TEXT,
+    files TEXT,
+    encodes TEXT,
+    timings TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+CREATE INDEX IF NOT EXISTS jobs_input ON jobs (input_path, settings);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    time REAL NOT NULL,
+    owner TEXT,
+    detail TEXT
+);
+"""
+# Columns added after the first release: (name, type), added to older databases on open
+ADDED_COLUMNS = (("encodes", "TEXT"),)
+
+
+def settings_to_json(settings):
+    settings_dict = settings.to_dict()
+    settings_dict["output_format"] = settings.output_format.to_dict()
+    return json.dumps(settings_dict, sort_keys=True)
+
+
+def settings_from_json(text):
+    settings_dict = json.loads(text)
+    fmt = settings_dict.pop("output_format", None) or {}
+    output_format = OutputFormat(fmt.get("format", "WAV"), fmt.get("bit_depth") or 16, fmt.get("mp3_bitrate") or DEFAULT_MP3_BITRATE)
+    return SeparationSettings(output_format=output_format, **settings_dict)
+
+
+def process_owner(pid=None):
+    return f"{platform.node() or 'unknown'}:{pid or os.getpid()}"
+
+
+def pid_alive(pid):
+    try:
+        import psutil
+        return psutil.pid_exists(pid)
+    except ImportError:
+        pass
+    if os.name == "nt":
+        import ctypes
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def owner_alive(owner):
+    # Processes on other hosts cannot be checked and count as alive
+    host, _, pid = (owner or "").rpartition(":")
+    if host != (platform.node() or "unknown") or not pid.isdigit():
+        return True
+    return pid_alive(int(pid))
+
+
+class StoredJob:
+    def __init__(self, row):
+        self.id = row["id"]
+        self.input_path = Path(row["input_path"])
+        self.settings = settings_from_json(row["settings"])
+        self.state = row["state"]
+        self.owner = row["owner"]
+        self.attempts = row["attempts"]
+        self.created = row["created"]
+        self.started = row["started"]
+        self.finished = row["finished"]
+        self.output_dir = row["output_dir"]
+        self.files = json.loads(row["files"]) if row["files"] else []
+        # Final name -> staged WAV of the stems handed to the encoder
+        self.encodes = json.loads(row["encodes"]) if row["encodes"] else {}
+        self.timings = json.loads(row["timings"]) if row["timings"] else {}
+        self.error = row["error"]
+
+    @property
+    def model_name(self):
+        return self.settings.model_name
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "input": str(self.input_path),
+            "settings": json.loads(settings_to_json(self.settings)),
+            "state": self.state,
+            "owner": self.owner,
+            "attempts": self.attempts,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "output_dir": self.output_dir,
+            "files": self.files,
+            "timings": self.timings,
+            "error": self.error,
+        }
+
+
+class JobStore:
+    def __init__(self, path, owner=None):
+        self.path = Path(path)
+        self.owner = owner or process_owner()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # One connection per store, shared by this process's threads under the lock;
+        # other processes are serialized by SQLite itself (busy timeout below)
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(str(self.path), timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.transaction() as db:
+            # executescript() would commit the transaction; run the statements one by one
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    db.execute(statement)
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}
+            for name, column_type in ADDED_COLUMNS:
+                if name not in columns:
+                    db.execute(f"ALTER TABLE jobs ADD COLUMN {name} {column_type}")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so a select-then-update cannot race another process
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def record_event(self, db, job_id, state, detail=None):
+        db.execute("INSERT INTO job_events (job_id, state, time, owner, detail) VALUES (?, ?, ?, ?, ?)",
+                   (job_id, state, time.time(), self.owner, detail))
+
+    def add(self, input_path, settings, reuse=True):
+        # Returns (job, added). With reuse, an existing job for the same input and settings is returned
+        # instead, unless it failed or was cancelled.
+        input_path = str(Path(input_path).resolve())
+        settings_json = settings_to_json(settings)
+        with self.transaction() as db:
+            row = None if not reuse else db.execute("SELECT * FROM jobs WHERE input_path = ? AND settings = ? AND state NOT IN (?, ?) ORDER BY id DESC LIMIT 1",
+                             (input_path, settings_json) + RETRYABLE).fetchone()
+            if row is not None:
+                return StoredJob(row), False
+            now = time.time()
+            cursor = db.execute("INSERT INTO jobs (input_path, settings, model_name, state, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                                (input_path, settings_json, settings.model_name, PENDING, now, now))
+            self.record_event(db, cursor.lastrowid, PENDING)
+            return StoredJob(db.execute("SELECT * FROM jobs WHERE id = ?", (cursor.lastrowid,)).fetchone()), True
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return StoredJob(row) if row is not None else None
+
+    def jobs(self, states=None):
+        query, params = "SELECT * FROM jobs", ()
+        if states:
+            query += f" WHERE state IN ({', '.join('?' * len(states))})"
+            params = tuple(states)
+        with self.lock:
+            rows = self.connection.execute(query + " ORDER BY id", params).fetchall()
+        return [StoredJob(row) for row in rows]
+
+    def counts(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
+
+    def mark_running(self, db, job_id):
+        now = time.time()
+        cursor = db.execute("UPDATE jobs SET state = ?, owner = ?, attempts = attempts + 1, started = ?, updated = ?, error = NULL "
+                            "WHERE id = ? AND state = ?", (RUNNING, self.owner, now, now, job_id, PENDING))
+        if cursor.rowcount != 1:
+            return False
+        self.record_event(db, job_id, RUNNING)
+        return True
+
+    def start(self, job_id):
+        # Claims a specific pending job; False if it is gone or another process took it first
+        with self.transaction() as db:
+            return self.mark_running(db, job_id)
+
+    def claim(self, prefer_models=()):
+        # Claims the oldest pending job, preferring the given models (e.g. the ones already loaded), in order
+        with self.transaction() as db:
+            row = None
+            for model_name in prefer_models:
+                row = db.execute("SELECT id FROM jobs WHERE state = ? AND model_name = ? ORDER BY id LIMIT 1",
+                                 (PENDING, model_name)).fetchone()
+                if row is not None:
+                    break
+            if row is None:
+                row = db.execute("SELECT id FROM jobs WHERE state = ? ORDER BY id LIMIT 1", (PENDING,)).fetchone()
+            if row is None or not self.mark_running(db, row["id"]):
+                return None
+            return StoredJob(db.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+
+    def update(self, job_id, state, detail=None, output_dir=None, files=None, timings=None, error=None, encodes=None):
+        now = time.time()
+        finished = now if state in (DONE, FAILED, CANCELLED) else None
+        owner = None if state == PENDING else self.owner
+        with self.transaction() as db:
+            db.execute("UPDATE jobs SET state = ?, owner = ?, updated = ?, finished = ?, "
+                       "output_dir = COALESCE(?, output_dir), files = COALESCE(?, files), timings = COALESCE(?, timings), "
+                       "encodes = COALESCE(?, encodes), error = ? WHERE id = ?",
+                       (state, owner, now, finished, str(output_dir) if output_dir else None,
+                        json.dumps(files) if files is not None else None, json.dumps(timings) if timings is not None else None,
+                        json.dumps(encodes) if encodes is not None else None, error, job_id))
+            self.record_event(db, job_id, state, detail or error)
+
+    def separated(self, job_id, result):
+        # The model is done; the stems may still be encoding in the background
+        self.update(job_id, ENCODING if result.encodes else DONE, output_dir=result.output_dir, files=result.files, timings=result.timings,
+                    encodes=result.encodes)
+
+    def finish(self, job_id, errors=None):
+        if errors:
+            self.update(job_id, FAILED, error="; ".join(errors))
+        else:
+            self.update(job_id, DONE)
+
+    def fail(self, job_id, error):
+        self.update(job_id, FAILED, error=str(error))
+
+    def cancel(self, job_id):
+        self.update(job_id, CANCELLED)
+
+    def requeue(self, job_id, detail=None):
+        self.update(job_id, PENDING, detail=detail)
+
+    def recover(self):
+        # Puts jobs interrupted by a dead process back to pending; returns their ids
+        recovered = []
+        with self.transaction() as db:
+            rows = db.execute(f"SELECT * FROM jobs WHERE state IN ({', '.join('?' * len(ACTIVE))})", ACTIVE).fetchall()
+            for row in rows:
+                if row["owner"] == self.owner or owner_alive(row["owner"]):
+                    continue
+                if row["state"] == ENCODING:
+                    self.discard_outputs(StoredJob(row))
+                db.execute("UPDATE jobs SET state = ?, owner = NULL, updated = ?, files = NULL, encodes = NULL WHERE id = ?",
+                           (PENDING, time.time(), row["id"]))
+                self.record_event(db, row["id"], PENDING, f"interrupted ({row['state']} in {row['owner']})")
+                recovered.append(row["id"])
+        if recovered:
+            logger.info(f"Resuming {len(recovered)} interrupted jobs.")
+        return recovered
+
+    @staticmethod
+    def discard_outputs(job):
+        # The job runs again from scratch: its stems (encoded ones and empty placeholders alike) would
+        # otherwise come back as vocal_1.flac ..., and the staging folder would be left behind
+        if not job.output_dir:
+            return
+        for name in job.files:
+            path = Path(job.output_dir) / name
+            for leftover in (path, path.with_name(path.name + ".part")):
+                try:
+                    leftover.unlink()
+                except OSError:
+                    pass
+        for staging_dir in {Path(staged).parent for staged in job.encodes.values()}:
+            if staging_dir.name.startswith(STAGING_PREFIX):
+                shutil.rmtree(staging_dir, ignore_errors=True)
+
+def store_for(output_root):
+    return JobStore(Path(output_root) / JOB_STORE_FILE_NAME)
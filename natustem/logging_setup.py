@@ -0,0 +1,31 @@
+import logging
+
+
+# Custom Logging Handler to redirect logs to the Flet GUI (or to the parent of a worker process)
+class GuiLogHandler(logging.Handler):
+    def __init__(self, append_log_callback):
+        super().__init__()
+        self.append_log_callback = append_log_callback
+
+    def emit(self, record):
+        try:
+            # Save original exc_info, stack_info and exc_text to restore them later
+            orig_exc_info = record.exc_info
+            orig_stack_info = record.stack_info
+            orig_exc_text = record.exc_text
+
+            try:
+                # Suppress stack traces for the GUI log handler to prevent information leakage
+                record.exc_info = None
+                record.stack_info = None
+                record.exc_text = None # Clear cached formatted exception
+
+                msg = self.format(record)
+                self.append_log_callback(msg)
+            finally:
+                # Restore original info so other handlers (like file handler) can use it
+                record.exc_info = orig_exc_info
+                record.stack_info = orig_stack_info
+                record.exc_text = orig_exc_text
+        except Exception:
+            self.handleError(record)
@@ -0,0 +1,157 @@
+"""Memory-aware choice of the demucs segment size and the streaming window.
+
+Every job used to run with ``segment_size="Default"`` on the whole file,
+whatever the machine had left. Peak memory of a job has two parts:
+
+* the whole track: the decoded input and every stem of it stay in memory
+  until the stems are written, so this grows with the input length;
+* the activations of one segment, which grow with the segment length.
+
+Before each job ``plan_memory()`` estimates both for the model and the input
+length and compares them with what the process can still allocate
+(``resources.available_memory()``: MemAvailable, capped by a cgroup limit).
+The first candidate that fits is used, in order of preference: the whole file
+with the model's own segment, the whole file with shorter segments, then
+streaming windows of decreasing length (see natustem.streaming), which bound
+the whole-track part. If the model still runs out of memory, the engine
+retries the job with ``MemoryPlan.fallback()``.
+
+The estimates are rough on purpose; the job log shows them next to the
+measured peak RSS.
+"""
+from natustem.constants import (DEFAULT_CHUNK_SECONDS, MODEL_ACTIVATION_BYTES_PER_SECOND, MODEL_SEGMENT_SECONDS,
+                                STREAM_CROSSFADE_SECONDS)
+from natustem.stems import model_stems
+
+# The model's own segment length (demucs_params["segment_size"])
+DEFAULT_SEGMENT = "Default"
+# Stereo float32 at 44.1 kHz, the format demucs works in
+AUDIO_BYTES_PER_SECOND = 44100 * 2 * 4
+# Whole-track copies of the input (decoded array and tensor) and of every stem (output tensor and written array)
+INPUT_COPIES = 2
+STEM_COPIES = 2
+# Share of the available memory a plan may use; the rest is headroom for everything else in the process
+SAFETY_FRACTION = 0.8
+# Shorter segments tried after the model's own (only those shorter than it)
+SEGMENT_FALLBACKS = (20, 10, 6, 4, 2)
+# Streaming windows tried when the whole file does not fit with any segment
+CHUNK_FALLBACKS = (DEFAULT_CHUNK_SECONDS, 60, 30)
+
+
+def parse_segment_size(value):
+    # None (planned per job), "Default" (the model's own) or a whole number of seconds
+    if value is None or (isinstance(value, str) and value.strip().lower() in ("", "auto")):
+        return None
+    if isinstance(value, str) and value.strip().lower() == DEFAULT_SEGMENT.lower():
+        return DEFAULT_SEGMENT
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"Segment size must be a whole number of seconds, got {value}")
+    seconds = int(value)
+    if seconds < 1:
+        raise ValueError(f"Segment size must be at least 1 second, got {value}")
+    return seconds
+
+
+def model_segment_seconds(model_name):
+    # Unknown models are assumed to be as hungry as the hungriest known one
+    return MODEL_SEGMENT_SECONDS.get(model_name, max(MODEL_SEGMENT_SECONDS.values()))
+
+
+def segment_seconds(model_name, segment_size):
+    if segment_size == DEFAULT_SEGMENT:
+        return model_segment_seconds(model_name)
+    return min(segment_size, model_segment_seconds(model_name))
+
+
+def estimate_bytes(model_name, seconds, segment_size=DEFAULT_SEGMENT):
+    # Memory a job needs beyond its loaded model, holding `seconds` of audio at once
+    # (the input, or one streaming window; None if unknown) with the given segment size
+    activations = segment_seconds(model_name, segment_size) * MODEL_ACTIVATION_BYTES_PER_SECOND.get(
+        model_name, max(MODEL_ACTIVATION_BYTES_PER_SECOND.values()))
+    copies = INPUT_COPIES + STEM_COPIES * len(model_stems(model_name))
+    return int(activations + (seconds or 0) * AUDIO_BYTES_PER_SECOND * copies)
+
+
+def format_bytes(size):
+    return f"{size / 1024 ** 3:.2f} GB" if size >= 1024 ** 3 else f"{size / 1024 ** 2:.0f} MB"
+
+
+class MemoryPlan:
+    def __init__(self, segment_size, chunk_seconds, estimated_bytes, available_bytes, fallbacks=()):
+        # "Default" or seconds
+        self.segment_size = segment_size
+        # Streaming window in seconds, or None for the whole file at once
+        self.chunk_seconds = chunk_seconds
+        self.estimated_bytes = estimated_bytes
+        # What the process could allocate when the plan was made; None if unknown
+        self.available_bytes = available_bytes
+        # Smaller plans, in the order they are tried after this one
+        self.fallbacks = list(fallbacks)
+
+    @property
+    def fits(self):
+        return self.available_bytes is None or self.estimated_bytes <= self.available_bytes * SAFETY_FRACTION
+
+    def fallback(self):
+        # The next smaller plan, or None when nothing smaller is left
+        if not self.fallbacks:
+            return None
+        following = self.fallbacks[0]
+        following.fallbacks = self.fallbacks[1:]
+        return following
+
+    def to_dict(self):
+        return {
+            "segment_size": self.segment_size,
+            "chunk_seconds": self.chunk_seconds,
+            "estimated_bytes": self.estimated_bytes,
+            "available_bytes": self.available_bytes,
+        }
+
+    def describe(self):
+        segment = "model default segment" if self.segment_size == DEFAULT_SEGMENT else f"{self.segment_size}s segments"
+        window = f"{self.chunk_seconds}s streaming windows" if self.chunk_seconds else "whole file"
+        available = format_bytes(self.available_bytes) if self.available_bytes is not None else "unknown"
+        summary = f"Memory plan: {segment}, {window}; estimated {format_bytes(self.estimated_bytes)} of {available} available"
+        return summary if self.fits else summary + " (nothing smaller fits; expect swapping or an out-of-memory error)"
+
+    def __repr__(self):
+        return f"MemoryPlan(segment_size={self.segment_size!r}, chunk_seconds={self.chunk_seconds}, estimated_bytes={self.estimated_bytes})"
+
+
+def plan_memory(model_name, duration, available_bytes, segment_size=None, chunk_seconds=None, can_stream=True):
+    # available_bytes: what the process can still allocate with the model loaded (None if unknown).
+    # duration: input length in seconds (None if unknown). segment_size / chunk_seconds: the job's own settings;
+    # a fixed segment size is kept, a streaming window may still shrink. can_stream: whether the input can be
+    # read window by window (a WAV file, or ffmpeg installed).
+    segments = [segment_size] if segment_size is not None else (
+        [DEFAULT_SEGMENT] + [s for s in SEGMENT_FALLBACKS if s < model_segment_seconds(model_name)])
+    if chunk_seconds:
+        windows = [chunk_seconds] + [c for c in CHUNK_FALLBACKS if c < chunk_seconds]
+    else:
+        windows = [None]
+        if can_stream:
+            windows += [c for c in CHUNK_FALLBACKS if duration is None or c + STREAM_CROSSFADE_SECONDS < duration]
+
+    candidates = []
+    for window in windows:
+        held = duration if window is None else (window + STREAM_CROSSFADE_SECONDS if duration is None
+                                                 else min(duration, window + STREAM_CROSSFADE_SECONDS))
+        for segment in segments:
+            candidates.append(MemoryPlan(segment, window, estimate_bytes(model_name, held, segment), available_bytes))
+
+    for index, plan in enumerate(candidates):
+        if plan.fits:
+            plan.fallbacks = candidates[index + 1:]
+            return plan
+    # Nothing fits: the smallest candidate, with nothing left to fall back to
+    return candidates[-1]
+
+
+def is_out_of_memory(error):
+    # numpy raises MemoryError; torch's CPU allocator raises a RuntimeError
+    if isinstance(error, MemoryError):
+        return True
+    message = str(error).lower()
+    return isinstance(error, RuntimeError) and any(
+        text in message for text in ("out of memory", "can't allocate memory", "not enough memory", "bad_alloc"))
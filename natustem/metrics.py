@@ -0,0 +1,113 @@
+"""Per-job stage timings and resource usage, written as JSON lines.
+
+``Separator.separate()`` is a single call, but demucs reports progress on
+stderr while it runs. ``StderrTqdmHandler`` calls ``mark_progress()`` on each
+progress write, which splits the call into three stages: decoding (up to the
+first progress bar), inference (first to last bar) and writing the stems
+(after the last bar).
+
+Every finished, failed or cancelled job appends one record to
+``audio_separator.metrics.jsonl`` next to ``audio_separator.log``.
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+_active = threading.local()
+_write_lock = threading.Lock()
+
+# Stage order for summaries
+STAGES = ("model_check", "init", "load_model", "hash", "decode", "inference", "write", "instrumental", "move", "cache_store", "cache_restore")
+STAGE_LABELS = {"model_check": "check model files", "init": "Separator init", "load_model": "load model", "instrumental": "derive instrumental",
+                "cache_store": "cache store", "cache_restore": "cache restore"}
+
+
+class ProgressMarks:
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.first = None
+        self.last = None
+
+    def mark(self):
+        now = self.clock()
+        if self.first is None:
+            self.first = now
+        self.last = now
+
+    def split(self, started, finished):
+        # decode/inference/write durations of a separate() call that ran from started to finished
+        if self.first is None:
+            return {}
+        return {
+            "decode": self.first - started,
+            "inference": self.last - self.first,
+            "write": finished - self.last,
+        }
+
+
+@contextmanager
+def activate(marks):
+    # Registers marks for progress writes on the current thread
+    previous = getattr(_active, "marks", None)
+    _active.marks = marks
+    try:
+        yield marks
+    finally:
+        _active.marks = previous
+
+
+def mark_progress():
+    marks = getattr(_active, "marks", None)
+    if marks is not None:
+        marks.mark()
+
+
+def build_record(input_path, settings, status, timings=None, resources=None, cached=False, error=None, execution=None,
+                 memory_plan=None):
+    record = {
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "input": str(input_path),
+        "settings": settings.to_dict(),
+        "status": status,
+        "cached": cached,
+        "stages": {name: round(seconds, 4) for name, seconds in (timings or {}).items()},
+        "resources": resources or {},
+    }
+    if execution:
+        record["execution"] = execution
+    if memory_plan:
+        record["memory_plan"] = memory_plan
+    if error:
+        record["error"] = error
+    return record
+
+
+def append_record(path, record):
+    # One line per job; the lock keeps records of concurrent engines from interleaving
+    line = json.dumps(record) + "\n"
+    try:
+        with _write_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError as e:
+        logger.warning(f"Could not write metrics to {path}: {e}")
+
+
+def describe(timings, resources=None):
+    # One-line, per-stage summary for the GUI log
+    parts = [f"{STAGE_LABELS.get(name, name)} {timings[name]:.2f}s" for name in STAGES if name in timings]
+    if "inference" not in timings and "separate" in timings:
+        parts.append(f"separate {timings['separate']:.2f}s")
+    summary = "Stages: " + " | ".join(parts)
+    if "total" in timings:
+        summary += f" | total {timings['total']:.2f}s"
+    if resources:
+        if resources.get("peak_rss_bytes"):
+            summary += f"; peak RSS {resources['peak_rss_bytes'] / 1024 ** 3:.2f} GB"
+        if resources.get("cpu_percent") is not None:
+            summary += f", CPU {resources['cpu_percent']:.0f}% (of {resources.get('cores') or '?'} cores x 100%)"
+    return summary
@@ -0,0 +1,412 @@
+"""Local model store: the files of every model in ``MODELS``, verified once.
+
+``Separator.load_model()`` looks for a model's files in its ``model_file_dir``
+and downloads whatever is missing, so the first job on a fresh host waits for
+the download and an air-gapped host fails halfway through its first job.
+Demucs then re-hashes every checkpoint on each load.
+
+The store is that directory (``models/`` by default, or
+``AUDIO_SEPARATOR_MODEL_DIR``) plus ``manifest.json``, which records the
+SHA-256, size and modification time of each file once it has been verified.
+Checkpoints are checked against the hash in their name, the other files
+against the manifest of the source they were imported from, if there is one.
+
+* ``python -m natustem models fetch`` downloads every missing file.
+* ``models import <dir or archive>`` copies the files from a directory, a zip
+  or a tar archive (e.g. one written by ``models export`` on a host with
+  network access), without any network access.
+* ``models verify`` re-hashes everything.
+
+Before a model is loaded, ``ensure()`` trusts every file whose size and
+modification time still match the manifest without reading it, and demucs'
+own checksum pass is skipped for those files. A file that fails verification
+is removed so it is fetched again. In offline mode a missing file is an error
+before the job starts, not a failed download in the middle of it.
+"""
+import functools
+import hashlib
+import io
+import json
+import logging
+import os
+import tarfile
+import threading
+import urllib.request
+import zipfile
+from pathlib import Path, PurePosixPath
+
+from natustem.constants import MODEL_FILES, MODEL_INDEX_URL, MODEL_STORE_DIR
+
+logger = logging.getLogger(__name__)
+
+# audio-separator's list of supported models, read (or downloaded) on every load_model()
+INDEX_FILE_NAME = "download_checks.json"
+MANIFEST_FILE_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+# Set to 1 to never download (air-gapped hosts); also --offline in the CLI
+OFFLINE_ENV = "NATUSTEM_OFFLINE"
+# audio-separator's own override of model_file_dir, honoured so both agree on the directory
+MODEL_DIR_ENV = "AUDIO_SEPARATOR_MODEL_DIR"
+COPY_BLOCK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = 300
+PART_SUFFIX = ".part"
+
+
+class ModelStoreError(Exception):
+    pass
+
+
+def default_model_dir():
+    return os.environ.get(MODEL_DIR_ENV) or MODEL_STORE_DIR
+
+
+def default_offline():
+    return os.environ.get(OFFLINE_ENV, "").strip().lower() in ("1", "true", "yes")
+
+
+def model_file_urls(model_name):
+    # File name -> download URL of everything load_model(model_name) reads from the store
+    if model_name not in MODEL_FILES:
+        raise ModelStoreError(f"Unknown model {model_name}; choose from {', '.join(sorted(MODEL_FILES))}")
+    urls = {INDEX_FILE_NAME: MODEL_INDEX_URL}
+    urls.update((url.rsplit("/", 1)[-1], url) for url in MODEL_FILES[model_name])
+    return urls
+
+
+def name_checksum(name):
+    # Demucs checkpoints carry the start of their SHA-256 in the name: <signature>-<sha256 prefix>.th
+    stem, suffix = os.path.splitext(name)
+    if suffix == ".th" and "-" in stem:
+        return stem.rsplit("-", 1)[1]
+    return None
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(COPY_BLOCK_SIZE)
+            if not block:
+                return sha.hexdigest()
+            sha.update(block)
+
+
+def check_checksum(name, sha256, expected=None):
+    # expected: the SHA-256 recorded by the source's manifest, if any
+    prefix = name_checksum(name)
+    if prefix is not None and not sha256.startswith(prefix):
+        raise ModelStoreError(f"{name} is corrupt: its SHA-256 {sha256[:len(prefix)]}... does not match the {prefix} in its name")
+    if expected is not None and sha256 != expected:
+        raise ModelStoreError(f"{name} is corrupt: SHA-256 {sha256} instead of {expected}")
+
+
+def open_url(url):
+    return urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT)
+
+
+class ModelStore:
+    def __init__(self, root=None, offline=None, opener=open_url):
+        self.root = Path(root or default_model_dir())
+        self.offline = default_offline() if offline is None else offline
+        # opener(url) returns a readable response; replaced in tests
+        self.opener = opener
+        self.lock = threading.Lock()
+        self._manifest = None
+
+    @property
+    def manifest_path(self):
+        return self.root / MANIFEST_FILE_NAME
+
+    def entries(self):
+        # File name -> {"sha256", "size", "mtime_ns"} of every verified file
+        if self._manifest is None:
+            try:
+                manifest = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+                self._manifest = manifest["files"] if manifest.get("version") == MANIFEST_VERSION else {}
+            except (OSError, ValueError, KeyError, AttributeError):
+                self._manifest = {}
+        return self._manifest
+
+    def save(self):
+        # Atomic, so a reader never sees half a manifest; concurrent writers at worst drop an entry,
+        # which is then verified again on its next use
+        self.root.mkdir(parents=True, exist_ok=True)
+        partial = self.root / f"{MANIFEST_FILE_NAME}.{os.getpid()}.{threading.get_ident()}{PART_SUFFIX}"
+        partial.write_text(json.dumps({"version": MANIFEST_VERSION, "files": self.entries()}, indent=2, sort_keys=True),
+                           encoding="utf-8")
+        os.replace(partial, self.manifest_path)
+
+    def unchanged(self, name):
+        # Verified and not modified since: same size and modification time, without reading the file
+        entry = self.entries().get(name)
+        try:
+            stat = (self.root / name).stat()
+        except OSError:
+            return False
+        return entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+
+    def record(self, name, sha256):
+        stat = (self.root / name).stat()
+        self.entries()[name] = {"sha256": sha256, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def verify_file(self, name):
+        # Hashes a file in the store and records it; ModelStoreError if it does not match
+        sha256 = file_sha256(self.root / name)
+        entry = self.entries().get(name)
+        check_checksum(name, sha256, expected=entry["sha256"] if entry is not None and name_checksum(name) is None else None)
+        self.record(name, sha256)
+
+    def is_trusted(self, path, checksum=None):
+        # For demucs' checksum pass: a verified, unchanged store file whose hash starts with checksum
+        path = Path(path)
+        if path.parent.resolve() != self.root.resolve() or not self.unchanged(path.name):
+            return False
+        return checksum is None or self.entries()[path.name]["sha256"].startswith(checksum)
+
+    def status(self, model_names=None):
+        # Model -> {file name: "ok" | "unverified" | "missing"}, without reading any file
+        with self.lock:
+            return {model_name: {name: "ok" if self.unchanged(name) else "unverified" if (self.root / name).is_file() else "missing"
+                                 for name in model_file_urls(model_name)}
+                    for model_name in model_names or MODEL_FILES}
+
+    def check(self, model_name, log=logger.info):
+        # Verifies new or changed files (removing those that fail) and returns the names still missing.
+        # Models outside MODEL_FILES are left to load_model().
+        if model_name not in MODEL_FILES:
+            return []
+        missing = []
+        changed = False
+        with self.lock:
+            for name in model_file_urls(model_name):
+                path = self.root / name
+                if not path.is_file():
+                    missing.append(name)
+                elif not self.unchanged(name):
+                    changed = True
+                    try:
+                        self.verify_file(name)
+                        log(f"Verified {name}.")
+                    except ModelStoreError as e:
+                        log(f"{e}; removing it.")
+                        self.entries().pop(name, None)
+                        path.unlink()
+                        missing.append(name)
+            if changed:
+                self.save()
+        return missing
+
+    def ensure(self, model_name, log=logger.info):
+        # Runs before load_model(). Returns the files load_model() still has to download; offline, raises instead.
+        missing = self.check(model_name, log=log)
+        if missing and self.offline:
+            raise ModelStoreError(
+                f"{model_name} is not in the local model store {self.root} (missing {', '.join(missing)}). Run "
+                f"`python -m natustem models import <folder or archive>` on this host, or `models fetch` on one with network access.")
+        if missing:
+            log(f"{model_name}: {len(missing)} file(s) not in the local model store yet, downloading them on load.")
+        return missing
+
+    def adopt(self, model_name, log=logger.info):
+        # After load_model() downloaded missing files: verifies and records them
+        self.check(model_name, log=log)
+
+    def add(self, name, reader, expected=None):
+        # Copies reader into the store as `name`, hashing while copying; nothing replaces a good file unless verified
+        self.root.mkdir(parents=True, exist_ok=True)
+        partial = self.root / f"{name}.{os.getpid()}.{threading.get_ident()}{PART_SUFFIX}"
+        sha = hashlib.sha256()
+        try:
+            with open(partial, "wb") as f:
+                while True:
+                    block = reader.read(COPY_BLOCK_SIZE)
+                    if not block:
+                        break
+                    sha.update(block)
+                    f.write(block)
+            check_checksum(name, sha.hexdigest(), expected)
+            os.replace(partial, self.root / name)
+        finally:
+            if partial.exists():
+                partial.unlink()
+        with self.lock:
+            self.record(name, sha.hexdigest())
+
+    def fetch(self, model_names=None, log=logger.info):
+        # Downloads every file of the models that is missing or fails verification; returns the names downloaded
+        fetched = []
+        for model_name in model_names or MODEL_FILES:
+            for name in self.check(model_name, log=log):
+                url = model_file_urls(model_name)[name]
+                log(f"Downloading {name} from {url}...")
+                with self.opener(url) as response:
+                    self.add(name, response)
+                fetched.append(name)
+            with self.lock:
+                self.save()
+        return fetched
+
+    def import_from(self, source, model_names=None, log=logger.info):
+        # Copies the models' missing files from a directory or a zip/tar archive; returns the names imported.
+        # ModelStoreError if the source lacks some of them.
+        source = Path(source)
+        wanted = {}
+        for model_name in model_names or MODEL_FILES:
+            for name in self.check(model_name, log=log):
+                wanted[name] = model_name
+        with open_source(source) as members:
+            expected = members.manifest()
+            imported = []
+            for name in wanted:
+                reader = members.open(name)
+                if reader is None:
+                    continue
+                with reader:
+                    self.add(name, reader, expected=expected.get(name, {}).get("sha256"))
+                log(f"Imported {name}.")
+                imported.append(name)
+        with self.lock:
+            self.save()
+        absent = sorted(set(wanted) - set(imported))
+        if absent:
+            raise ModelStoreError(f"{source} does not contain {', '.join(absent)} "
+                                  f"(needed by {', '.join(sorted({wanted[name] for name in absent}))})")
+        return imported
+
+    def export(self, archive, model_names=None, log=logger.info):
+        # Writes the models' files and their manifest entries into a zip or tar archive for `models import`
+        names = {name for model_name in model_names or MODEL_FILES for name in model_file_urls(model_name)}
+        with self.lock:
+            not_ready = sorted(name for name in names if not self.unchanged(name))
+            if not_ready:
+                raise ModelStoreError(f"Not verified in {self.root}: {', '.join(not_ready)}; run `models fetch` or `models verify` first")
+            manifest = json.dumps({"version": MANIFEST_VERSION, "files": {name: self.entries()[name] for name in names}},
+                                  indent=2, sort_keys=True).encode("utf-8")
+        archive = Path(archive)
+        if archive.suffix.lower() == ".zip":
+            # Checkpoints do not compress
+            with zipfile.ZipFile(archive, "w", zipfile.ZIP_STORED) as zf:
+                for name in sorted(names):
+                    zf.write(self.root / name, name)
+                zf.writestr(MANIFEST_FILE_NAME, manifest)
+        else:
+            mode = "w:gz" if archive.name.lower().endswith((".tar.gz", ".tgz")) else "w"
+            with tarfile.open(archive, mode) as tf:
+                for name in sorted(names):
+                    tf.add(self.root / name, name)
+                info = tarfile.TarInfo(MANIFEST_FILE_NAME)
+                info.size = len(manifest)
+                tf.addfile(info, io.BytesIO(manifest))
+        log(f"Exported {len(names)} files to {archive}.")
+        return sorted(names)
+
+    def verify(self, model_names=None, log=logger.info):
+        # Re-hashes every present file of the models; returns {file name: error or None}. Failures are removed.
+        results = {}
+        with self.lock:
+            for model_name in model_names or MODEL_FILES:
+                for name in model_file_urls(model_name):
+                    if name in results or not (self.root / name).is_file():
+                        continue
+                    try:
+                        self.verify_file(name)
+                        results[name] = None
+                    except ModelStoreError as e:
+                        log(f"{e}; removing it.")
+                        self.entries().pop(name, None)
+                        (self.root / name).unlink()
+                        results[name] = str(e)
+            self.save()
+        return results
+
+
+class DirectorySource:
+    def __init__(self, root):
+        self.root = root
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def find(self, name):
+        path = self.root / name
+        if path.is_file():
+            return path
+        return next((p for p in self.root.rglob(name) if p.is_file()), None)
+
+    def open(self, name):
+        path = self.find(name)
+        return open(path, "rb") if path is not None else None
+
+    def manifest(self):
+        path = self.find(MANIFEST_FILE_NAME)
+        return read_source_manifest(path.read_bytes()) if path is not None else {}
+
+
+class ArchiveSource:
+    # Members are matched by file name, wherever they are in the archive
+    def __init__(self, path):
+        self.path = path
+        self.archive = None
+
+    def __enter__(self):
+        if zipfile.is_zipfile(self.path):
+            self.archive = zipfile.ZipFile(self.path)
+            self.members = {PurePosixPath(info.filename).name: info for info in self.archive.infolist() if not info.is_dir()}
+        else:
+            self.archive = tarfile.open(self.path)
+            self.members = {PurePosixPath(member.name).name: member for member in self.archive.getmembers() if member.isfile()}
+        return self
+
+    def __exit__(self, *exc_info):
+        self.archive.close()
+        return False
+
+    def open(self, name):
+        member = self.members.get(name)
+        if member is None:
+            return None
+        if isinstance(self.archive, zipfile.ZipFile):
+            return self.archive.open(member)
+        return self.archive.extractfile(member)
+
+    def manifest(self):
+        reader = self.open(MANIFEST_FILE_NAME)
+        if reader is None:
+            return {}
+        with reader:
+            return read_source_manifest(reader.read())
+
+
+def read_source_manifest(data):
+    try:
+        return json.loads(data)["files"]
+    except (ValueError, KeyError, TypeError):
+        return {}
+
+
+def open_source(source):
+    if source.is_dir():
+        return DirectorySource(source)
+    if source.is_file() and (zipfile.is_zipfile(source) or tarfile.is_tarfile(source)):
+        return ArchiveSource(source)
+    raise ModelStoreError(f"{source} is neither a folder nor a zip or tar archive")
+
+
+def skip_verified_checksums(store):
+    # Demucs hashes every checkpoint in full on each load; files the store has verified and that have not
+    # changed since are skipped. Returns False if audio-separator's demucs is not importable.
+    try:
+        from audio_separator.separator.uvr_lib_v5.demucs import repo
+        original = getattr(repo.check_checksum, "__wrapped__", repo.check_checksum)
+    except (ImportError, AttributeError):
+        return False
+
+    @functools.wraps(original)
+    def check_checksum(path, checksum):
+        if not store.is_trusted(path, checksum):
+            original(path, checksum)
+    repo.check_checksum = check_checksum
+    return True
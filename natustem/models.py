@@ -0,0 +1,130 @@
+"""LRU cache of loaded models.
+
+Each resident model has its own ``Separator`` instance. Switching between
+models (e.g. ``htdemucs_ft.yaml`` and ``htdemucs_6s.yaml``) reuses the
+already loaded instance instead of calling ``load_model`` again. Resident
+models are kept within a RAM budget and the least recently used one is
+evicted first; the model currently in use is never evicted.
+"""
+import gc
+import logging
+import time
+from collections import OrderedDict
+
+from natustem.constants import MODEL_MEMORY_ESTIMATES
+from natustem.resources import current_rss
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_MEMORY_BUDGET = 2 * 1024 ** 3
+# Used when the resident size of a freshly loaded model cannot be measured
+FALLBACK_MODEL_MEMORY = 512 * 1024 ** 2
+
+
+class CachedModel:
+    def __init__(self, model_name, separator, size_bytes, load_seconds):
+        self.model_name = model_name
+        self.separator = separator
+        self.size_bytes = size_bytes
+        self.load_seconds = load_seconds
+        self.hits = 0
+
+
+class ModelCache:
+    def __init__(self, separator_builder, budget_bytes=DEFAULT_MODEL_MEMORY_BUDGET):
+        # separator_builder() returns a fresh, not yet loaded Separator
+        self.separator_builder = separator_builder
+        self.budget_bytes = budget_bytes
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_seconds = {}
+
+    def acquire(self, model_name, log=logger.info, configure=None):
+        # Returns (separator, timings) with model_name loaded, loading it on a miss.
+        # configure(separator) runs on a new Separator before its model is loaded.
+        entry = self.entries.get(model_name)
+        if entry is not None:
+            self.entries.move_to_end(model_name)
+            entry.hits += 1
+            self.hits += 1
+            log(f"Model {model_name} already loaded.")
+            return entry.separator, {}
+
+        self.misses += 1
+        timings = {}
+        rss_before = current_rss()
+
+        log("Initializing Separator instance (persistent)...")
+        start = time.perf_counter()
+        separator = self.separator_builder()
+        timings["init"] = time.perf_counter() - start
+        if configure is not None:
+            configure(separator)
+
+        log(f"Loading model {model_name}...")
+        start = time.perf_counter()
+        separator.load_model(model_filename=model_name)
+        timings["load_model"] = time.perf_counter() - start
+        log("Model loaded.")
+
+        size = self.measure(model_name, rss_before)
+        self.entries[model_name] = CachedModel(model_name, separator, size, timings["load_model"])
+        self.load_seconds.setdefault(model_name, []).append(timings["load_model"])
+        self.evict(keep=model_name, log=log)
+        return separator, timings
+
+    def measure(self, model_name, rss_before):
+        # RSS growth during loading; falls back to a per-model estimate when not measurable
+        rss_after = current_rss()
+        if rss_before is not None and rss_after is not None and rss_after > rss_before:
+            return rss_after - rss_before
+        return MODEL_MEMORY_ESTIMATES.get(model_name, FALLBACK_MODEL_MEMORY)
+
+    def evict(self, keep=None, log=logger.info):
+        evicted = False
+        while self.resident_bytes() > self.budget_bytes:
+            victim = next((name for name in self.entries if name != keep), None)
+            if victim is None:
+                break
+            entry = self.entries.pop(victim)
+            self.evictions += 1
+            evicted = True
+            log(f"Unloaded model {victim} ({entry.size_bytes / 1024 ** 2:.0f} MB) to stay within the model memory budget.")
+        if evicted:
+            # Release the evicted model's tensors now rather than at the next collection
+            gc.collect()
+
+    def clear(self):
+        self.entries.clear()
+        gc.collect()
+
+    def resident_models(self):
+        return list(self.entries)
+
+    def resident_bytes(self):
+        return sum(entry.size_bytes for entry in self.entries.values())
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "budget_bytes": self.budget_bytes,
+            "resident_bytes": self.resident_bytes(),
+            "resident": {name: entry.size_bytes for name, entry in self.entries.items()},
+            "load_seconds": {name: [round(s, 3) for s in seconds] for name, seconds in self.load_seconds.items()},
+        }
+
+    def describe(self):
+        return describe_stats(self.stats())
+
+
+def describe_stats(stats):
+    # One-line summary of ModelCache.stats() for logs
+    resident = ", ".join(f"{name} ({size / 1024 ** 2:.0f} MB)" for name, size in stats["resident"].items())
+    loads = ", ".join(f"{name} {sum(seconds) / len(seconds):.1f}s" for name, seconds in stats["load_seconds"].items())
+    return (f"Model cache: {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions; "
+            f"resident {stats['resident_bytes'] / 1024 ** 2:.0f}/{stats['budget_bytes'] / 1024 ** 2:.0f} MB: {resident or 'none'}"
+            f"{'; mean load time: ' + loads if loads else ''}")
@@ -0,0 +1,193 @@
+"""Publishing stems into ``output/<stem>/`` safely when several jobs run at once.
+
+The Separator writes straight into the job's output folder, so publishing a
+stem is a rename within one directory. Names are chosen from a single scan
+of the folder (``vocal.wav``, else one past the highest ``vocal_<n>.wav``)
+instead of one ``exists()`` call per candidate, and files are published
+with ``os.link``, which fails rather than replaces when another job took
+the name first; the job then simply moves on to the next free name.
+Stems restored from the result cache are published as copies (clones where
+the filesystem supports them), never as links, so editing a published stem
+in place cannot change the cached result.
+
+``OutputDirLock`` serializes jobs writing into the same folder (two inputs
+called ``song.mp3`` in different directories), across threads and worker
+processes. Lock files live in ``output/.locks/``; the OS releases them when
+a process dies.
+"""
+import errno
+import logging
+import os
+import re
+import shutil
+import sys
+import threading
+import uuid
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+LOCKS_DIR_NAME = ".locks"
+# ioctl cloning a whole file on Linux copy-on-write filesystems (btrfs, XFS)
+FICLONE = 0x40049409
+
+
+def existing_names(output_dir):
+    try:
+        return {entry.name for entry in os.scandir(output_dir)}
+    except FileNotFoundError:
+        return set()
+
+
+def free_name(filename, taken):
+    # filename if unused, else <stem>_<n><suffix> with n one past the highest in use (e.g. vocal_3.wav)
+    if filename not in taken:
+        return filename
+    stem, suffix = os.path.splitext(filename)
+    pattern = re.compile(re.escape(stem) + r"_(\d+)" + re.escape(suffix) + "$")
+    numbers = [int(match.group(1)) for match in map(pattern.match, taken) if match]
+    return f"{stem}_{max(numbers, default=0) + 1}{suffix}"
+
+
+def clone_or_copy(source, target):
+    # A copy that shares no data with source: a copy-on-write clone where the filesystem can (instant, no
+    # extra space until either side changes), a plain copy elsewhere
+    if fcntl is not None and sys.platform.startswith("linux"):
+        try:
+            with open(source, "rb") as src, open(target, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            shutil.copystat(source, target)
+            return
+        except OSError:
+            pass
+    shutil.copy2(source, target)
+
+
+def publish_file(source, output_dir, filename, taken, keep_source=False):
+    # Puts source at output_dir/<free name> without ever replacing a file; returns the final path.
+    # `taken` (from existing_names) is updated, so one scan serves every stem of a job.
+    # keep_source publishes a copy (see clone_or_copy) and leaves source alone.
+    if keep_source:
+        copy = Path(output_dir) / f".{filename}.{uuid.uuid4().hex[:12]}.part"
+        clone_or_copy(source, copy)
+        try:
+            return publish_file(copy, output_dir, filename, taken)
+        finally:
+            copy.unlink(missing_ok=True)
+    while True:
+        final_path = Path(output_dir) / free_name(filename, taken)
+        taken.add(final_path.name)
+        try:
+            os.link(source, final_path)
+        except FileExistsError:
+            continue  # Published by someone else since the scan
+        except OSError:
+            # No hard links on this filesystem: reserve the name, then fill it in one rename
+            if not reserve(final_path):
+                continue
+            os.replace(source, final_path)
+            return final_path
+        os.unlink(source)
+        return final_path
+
+
+def discard_new_files(output_dir, existing, remove_dir=False, log=logger.info):
+    # Removes what an interrupted job wrote into output_dir since `existing` (from existing_names) was taken:
+    # every new file, except hidden ones and the .part files of earlier jobs' encodes. The caller holds
+    # the folder's OutputDirLock, so these can only be the job's own files.
+    output_dir = Path(output_dir)
+    for name in existing_names(output_dir) - existing:
+        path = output_dir / name
+        if name.startswith(".") or name.endswith(".part") or not path.is_file():
+            continue
+        try:
+            path.unlink()
+        except OSError as e:
+            log(f"Could not remove partial file {name}: {e}")
+    if remove_dir:
+        try:
+            output_dir.rmdir() # Only succeeds if the job did not publish anything
+        except OSError:
+            pass
+
+
+def reserve_name(output_dir, filename, taken):
+    # Creates an empty placeholder under a free name (filled in later, e.g. by the encoder)
+    while True:
+        final_path = Path(output_dir) / free_name(filename, taken)
+        taken.add(final_path.name)
+        if reserve(final_path):
+            return final_path
+
+
+def reserve(path):
+    try:
+        with open(path, "x"):
+            return True
+    except FileExistsError:
+        return False
+
+
+def lock_windows_file(file):
+    # LK_LOCK gives up with an OSError after about 10 s, and another worker may hold the folder
+    # for a whole separation: keep waiting as long as the only problem is that the lock is taken
+    file.seek(0)
+    while True:
+        try:
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EDEADLOCK, errno.EACCES):
+                raise
+
+
+class OutputDirLock:
+    _thread_locks = {}
+    _guard = threading.Lock()
+
+    def __init__(self, output_root, name):
+        self.path = Path(output_root) / LOCKS_DIR_NAME / f"{name}.lock"
+        with self._guard:
+            self.thread_lock = self._thread_locks.setdefault(str(self.path.resolve()), threading.Lock())
+        self.file = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.file = open(self.path, "a+b")
+        except OSError as e:
+            # Read-only or unusual output root: jobs of this process are still serialized
+            logger.debug(f"No lock file for {self.path.name}: {e}")
+            self.file = None
+            return self
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+            else:
+                lock_windows_file(self.file)
+        except BaseException:
+            self.file.close()
+            self.file = None
+            self.thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            if self.file is not None:
+                if fcntl is not None:
+                    fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+                else:
+                    self.file.seek(0)
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+                self.file.close()
+        finally:
+            self.file = None
+            self.thread_lock.release()
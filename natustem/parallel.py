@@ -0,0 +1,86 @@
+"""Parallel multi-file separation across CPU cores.
+
+Parallel mode runs N ``WorkerProcess`` instances. Each one has its own
+Separator and is pinned to a contiguous slice of the available cores, with
+torch limited to that many threads. Files are handed out longest first from
+a shared queue, so a long file does not end up alone at the end of the run.
+
+``measure_throughput`` runs the same batch with several worker counts and
+reports the total throughput of each, for choosing the split on a given host.
+"""
+import json
+import logging
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from natustem.audio import probe_duration
+from natustem.cpu import available_cores, split_cores
+from natustem.worker import WorkerProcess
+
+logger = logging.getLogger(__name__)
+
+
+def schedule_order(files):
+    # Largest (≈ longest) files first: shorter ones fill the gaps at the end
+    def size(path):
+        try:
+            return Path(path).stat().st_size
+        except OSError:
+            return 0
+    return sorted(files, key=size, reverse=True)
+
+
+def worker_factory(workers, cores=None, **worker_kwargs):
+    # Engine factory for cli.run_batch: each new WorkerProcess takes the next core share
+    shares = iter(split_cores(cores or available_cores(), workers))
+    lock = threading.Lock()
+
+    def create(output_root):
+        with lock:
+            share = next(shares, None)
+        if share:
+            logger.info(f"Worker pinned to CPUs {share[0]}-{share[-1]} with {len(share)} torch threads.")
+        return WorkerProcess(output_root=output_root, torch_threads=len(share) if share else None,
+                             cpu_affinity=share, **worker_kwargs)
+    return create
+
+
+def measure_throughput(files, settings, worker_counts, run_batch, cores=None, **worker_kwargs):
+    # Separates `files` once per worker count (no result cache) and returns one record per count
+    cores = cores or available_cores()
+    audio_seconds = sum(probe_duration(f) or 0.0 for f in files)
+    records = []
+    for workers in worker_counts:
+        workers = min(workers, len(cores))
+        output_root = Path(tempfile.mkdtemp(prefix=f"natustem-scale-{workers}-"))
+        try:
+            started = time.perf_counter()
+            results = run_batch(schedule_order(files), settings, output_root=str(output_root), workers=workers,
+                                engine_factory=worker_factory(workers, cores, **worker_kwargs))
+            seconds = time.perf_counter() - started
+        finally:
+            shutil.rmtree(output_root, ignore_errors=True)
+        record = {
+            "workers": workers,
+            "threads_per_worker": len(cores) // workers,
+            "files": len(files),
+            "failed": sum(1 for r in results if r["status"] != "ok"),
+            "seconds": round(seconds, 3),
+            "files_per_minute": round(len(files) * 60 / seconds, 3),
+            "audio_seconds_per_second": round(audio_seconds / seconds, 3) if audio_seconds else None,
+        }
+        if records:
+            record["speedup"] = round(records[0]["seconds"] / seconds, 3)
+        logger.info(f"Throughput with {workers} worker(s): {json.dumps(record)}")
+        records.append(record)
+    return records
+
+
+def best_worker_count(records):
+    # The worker count with the highest throughput among runs without failures
+    successful = [r for r in records if not r["failed"]] or records
+    return max(successful, key=lambda r: r["files_per_minute"])["workers"]
+
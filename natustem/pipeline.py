@@ -0,0 +1,91 @@
+"""Staged pipeline for multi-file runs: prefetch -> model -> publish.
+
+Only the model stage needs the engine's Separator, so while file N is in
+inference:
+
+* a prefetch thread reads file N+1 (hashing it for the result cache), so its
+  decode inside ``Separator.separate()`` starts from the OS page cache;
+* a publish thread selects, renames and caches the stems of file N-1
+  (``PendingSeparation.finish()``) and hands them to the encoder pool.
+
+The hand-offs are bounded queues of ``depth`` entries, so only a couple of
+files are ever ahead of or behind the model. Every file goes through the same
+steps in the same order as ``engine.separate()``, and its output folder stays
+locked from the model run until it is published, so the files on disk do not
+change.
+"""
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEPTH = 1
+_END = object()
+
+
+def run_pipeline(engine, jobs, on_finished, on_started=None, depth=DEFAULT_DEPTH, log=logger.info):
+    # jobs: iterable of (key, input_path, settings), consumed by the prefetch thread.
+    # on_started(key) runs on the calling thread before a job's model run; on_finished(key, result, error)
+    # runs on the publish thread (result is None and error the exception when the job failed).
+    # Returns once every job is published; the calling thread is the model stage.
+    prefetched = queue.Queue(maxsize=depth)
+    separated = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+
+    def prefetch():
+        try:
+            for key, input_path, settings in jobs:
+                if stopped.is_set():
+                    return
+                prefetched.put((key, input_path, settings, engine.prefetch(input_path, settings)))
+        except Exception as e:
+            logger.error(f"Prefetch stage failed: {e}", exc_info=True)
+        finally:
+            prefetched.put(_END)
+
+    def publish():
+        while True:
+            item = separated.get()
+            if item is _END:
+                return
+            key, pending, error = item
+            result = None
+            if pending is not None:
+                try:
+                    result = pending.finish()
+                except Exception as e:
+                    error = e
+            try:
+                on_finished(key, result, error)
+            except Exception:
+                logger.error("Pipeline callback failed", exc_info=True)
+
+    prefetcher = threading.Thread(target=prefetch, name="pipeline-prefetch", daemon=True)
+    publisher = threading.Thread(target=publish, name="pipeline-publish", daemon=True)
+    prefetcher.start()
+    publisher.start()
+    try:
+        while True:
+            item = prefetched.get()
+            if item is _END:
+                break
+            key, input_path, settings, prefetched_input = item
+            if on_started is not None:
+                on_started(key)
+            try:
+                pending = engine.begin(input_path, settings, log=log, prefetched=prefetched_input)
+            except Exception as e:
+                separated.put((key, None, e))
+                continue
+            separated.put((key, pending, None))
+    finally:
+        # On an early exit (e.g. Ctrl+C) the prefetcher may be blocked on a full queue
+        stopped.set()
+        while prefetcher.is_alive():
+            try:
+                prefetched.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        separated.put(_END)
+        publisher.join()
@@ -0,0 +1,85 @@
+"""Quick previews: separate a short excerpt before committing to a full render.
+
+A full ``htdemucs_ft.yaml`` render with shifts=2 of a ten-minute track takes a
+while, and only then does it show whether the model suits the track. A
+preview cuts a 20-30 second window from the input, separates it with at most
+``PREVIEW_SHIFTS`` shifts and ``PREVIEW_OVERLAP`` overlap on the engine's
+already loaded model, and publishes the stems to ``preview/<file name>/``,
+away from the full renders in ``output/``. Each preview of a file replaces
+the previous one. The full render then runs with the original settings.
+"""
+import logging
+import shutil
+import tempfile
+from pathlib import Path
+
+from natustem.audio import cut_excerpt, probe_duration
+from natustem.constants import DEFAULT_PREVIEW_SECONDS, PREVIEW_OUTPUT_DIR, PREVIEW_OVERLAP, PREVIEW_SHIFTS
+from natustem.engine import SeparationSettings
+
+logger = logging.getLogger(__name__)
+
+MIN_PREVIEW_SECONDS = 5
+MAX_PREVIEW_SECONDS = 60
+
+
+def preview_settings(settings):
+    # The same model and stems with cheaper shifts/overlap; WAV, since the stems are only auditioned
+    return SeparationSettings(settings.model_name, min(settings.shifts, PREVIEW_SHIFTS), min(settings.overlap, PREVIEW_OVERLAP),
+                              stems=settings.stems, segment_size=settings.segment_size)
+
+
+def preview_window(start_seconds, seconds, duration=None):
+    # (start, length) clamped to the input: a window past the end slides back to end with the input
+    if not MIN_PREVIEW_SECONDS <= seconds <= MAX_PREVIEW_SECONDS:
+        raise ValueError(f"preview length must be between {MIN_PREVIEW_SECONDS} and {MAX_PREVIEW_SECONDS} seconds")
+    start_seconds = max(0.0, start_seconds)
+    if duration:
+        seconds = min(seconds, duration)
+        start_seconds = min(start_seconds, duration - seconds)
+    return start_seconds, seconds
+
+
+def preview_dir_for(input_path, preview_root=PREVIEW_OUTPUT_DIR):
+    return Path(preview_root) / Path(input_path).stem
+
+
+def parse_time(text):
+    # "90", "1:30" or "1:02:03" -> seconds
+    value = 0.0
+    for part in text.strip().split(":"):
+        value = value * 60 + float(part)
+    if value < 0:
+        raise ValueError("time must not be negative")
+    return value
+
+
+def format_time(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    return f"{minutes}:{seconds:02d}"
+
+
+def clear_preview(output_dir):
+    # Only the latest preview of a file is kept
+    if not output_dir.is_dir():
+        return
+    for path in output_dir.iterdir():
+        if path.is_file() and not path.name.startswith("."):
+            path.unlink()
+
+
+def run_preview(engine, input_path, settings, start_seconds=0.0, seconds=DEFAULT_PREVIEW_SECONDS, preview_root=PREVIEW_OUTPUT_DIR,
+                log=logger.info, cancel_token=None):
+    # Separates the window on `engine` (a SeparationEngine or WorkerProcess) and returns its SeparationResult
+    input_path = Path(input_path)
+    start_seconds, seconds = preview_window(start_seconds, seconds, probe_duration(input_path))
+    output_dir = preview_dir_for(input_path, preview_root)
+    log(f"Preview of {input_path.name}: {format_time(start_seconds)}-{format_time(start_seconds + seconds)}")
+    # The excerpt keeps the input's name, so the separator names the stems as for the full file
+    excerpt_dir = Path(tempfile.mkdtemp(prefix="natustem-preview-"))
+    try:
+        excerpt = cut_excerpt(input_path, start_seconds, seconds, excerpt_dir / f"{input_path.stem}.wav")
+        clear_preview(output_dir)
+        return engine.separate(excerpt, preview_settings(settings), log=log, cancel_token=cancel_token, output_dir=output_dir)
+    finally:
+        shutil.rmtree(excerpt_dir, ignore_errors=True)
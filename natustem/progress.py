@@ -0,0 +1,227 @@
+"""Structured progress parsed from the tqdm bars that audio-separator/demucs print.
+
+A demucs progress line looks like::
+
+     45%|████▌     | 105.3/234.0 [00:20<00:24,  5.23seconds/s]
+
+``StderrTqdmHandler`` intercepts ``sys.stderr``, extracts the latest complete
+line with bounded work per write and hands a ``TqdmProgress`` to a callback at
+a limited rate. ``ProgressTracker`` folds the successive bars of one job
+(one per shift and per model in a bag) into an overall fraction, ETA and
+real-time factor.
+"""
+import re
+import sys
+import time
+
+from natustem.cancellation import checkpoint
+from natustem.constants import MODEL_BAG_SIZES
+from natustem.metrics import mark_progress
+
+# percent | bar | n/total [elapsed<remaining, rate unit]
+TQDM_PATTERN = re.compile(
+    r"(?P<percent>\d+)%\|[^|]*\|\s*(?P<n>[\d.]+)(?P<n_suffix>[kMG]?)/(?P<total>[\d.]+)(?P<total_suffix>[kMG]?)"
+    r"\s*\[(?P<elapsed>[\d:]+)(?:<(?P<remaining>[\d:?]+))?(?:,\s*(?P<rate>[\d.?]+)\s*(?P<unit>[^\]\s,]*))?"
+)
+UNIT_SUFFIXES = {"": 1, "k": 1e3, "M": 1e6, "G": 1e9}
+
+# Bytes kept while waiting for a line terminator; tqdm lines are ~120 characters
+MAX_BUFFER_SIZE = 4096
+# Minimum seconds between two progress callbacks
+DEFAULT_MIN_INTERVAL = 0.1
+
+
+def parse_clock(value):
+    # "01:02:03" / "02:03" -> seconds; "?" -> None
+    if not value or "?" in value:
+        return None
+    seconds = 0
+    for part in value.split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def format_clock(seconds):
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+
+class TqdmProgress:
+    def __init__(self, line, percent, n, total, elapsed, remaining, rate, unit):
+        self.line = line
+        self.percent = percent
+        self.n = n
+        self.total = total
+        self.elapsed = elapsed
+        self.remaining = remaining
+        self.rate = rate
+        self.unit = unit
+
+    @property
+    def fraction(self):
+        if self.total:
+            return min(self.n / self.total, 1.0)
+        return self.percent / 100
+
+    @property
+    def finished(self):
+        return self.percent >= 100
+
+    def __repr__(self):
+        return f"TqdmProgress({self.percent}%, {self.n}/{self.total}, rate={self.rate}{self.unit})"
+
+
+def parse_tqdm_line(line):
+    # Returns a TqdmProgress, or None if line is not a tqdm progress line
+    match = TQDM_PATTERN.search(line)
+    if match is None:
+        return None
+    rate = match.group("rate")
+    return TqdmProgress(
+        line=line.strip(),
+        percent=int(match.group("percent")),
+        n=float(match.group("n")) * UNIT_SUFFIXES[match.group("n_suffix")],
+        total=float(match.group("total")) * UNIT_SUFFIXES[match.group("total_suffix")],
+        elapsed=parse_clock(match.group("elapsed")),
+        remaining=parse_clock(match.group("remaining")),
+        rate=float(rate) if rate and "?" not in rate else None,
+        unit=match.group("unit") or "",
+    )
+
+
+def expected_passes(model_name, shifts):
+    # demucs draws one bar per random shift and per model of a bag (htdemucs_ft is a bag of 4)
+    return MODEL_BAG_SIZES.get(model_name, 1) * max(1, shifts)
+
+
+# Stderr handler to capture tqdm progress
+class StderrTqdmHandler:
+    def __init__(self, progress_callback, min_interval=DEFAULT_MIN_INTERVAL, clock=time.monotonic):
+        self.progress_callback = progress_callback
+        self.original_stderr = sys.stderr
+        self.min_interval = min_interval
+        self.clock = clock
+        self.last_emit = None
+        # Pieces of the current, not yet terminated line
+        self.buffer = []
+        self.buffer_size = 0
+
+    def write(self, message):
+        # Pass through to original stderr
+        try:
+            self.original_stderr.write(message)
+        except (OSError, ValueError):
+            pass
+
+        # Every progress write is a cancellation point for the job running on this thread
+        # (and a timestamp for its stage metrics).
+        # Only tqdm output: raising out of a logging handler would be swallowed by logging.
+        if "%|" in message:
+            checkpoint()
+            mark_progress()
+
+        # Only look at the part after the last line terminator; earlier lines are superseded
+        last_break = max(message.rfind("\r"), message.rfind("\n"))
+        if last_break < 0:
+            if self.buffer_size + len(message) > MAX_BUFFER_SIZE:
+                # Not a progress line (or a runaway one): drop it rather than grow forever
+                self.buffer.clear()
+                self.buffer_size = 0
+            self.buffer.append(message)
+            self.buffer_size += len(message)
+            return len(message)
+
+        completed = "".join(self.buffer) + message[:last_break]
+        tail = message[last_break + 1:]
+        self.buffer = [tail] if tail else []
+        self.buffer_size = len(tail)
+        # tqdm writes "\r<line>": a trailing line that already ends with "]" is complete
+        if tail.endswith("]"):
+            completed = f"{completed}\n{tail}"
+        self.handle_completed(completed)
+        return len(message)
+
+    def handle_completed(self, text):
+        # Heuristic for tqdm progress bar: looks for percentage or iteration speed
+        if "%|" not in text:
+            return
+        now = self.clock()
+        finished = "100%|" in text
+        if not finished and self.last_emit is not None and now - self.last_emit < self.min_interval:
+            return
+        for chunk in reversed(text.splitlines()):
+            progress = parse_tqdm_line(chunk)
+            if progress is not None:
+                self.last_emit = now
+                self.progress_callback(progress)
+                return
+
+    def flush(self):
+        try:
+            self.original_stderr.flush()
+        except (OSError, ValueError):
+            pass
+
+
+class ProgressTracker:
+    def __init__(self, passes=1, audio_duration=None, clock=time.monotonic):
+        self.passes = max(1, passes)
+        self.audio_duration = audio_duration
+        self.clock = clock
+        # Inference time starts with the first bar, after model loading and decoding
+        self.started = None
+        self.completed_passes = 0
+        self.last_n = None
+        self.fraction = 0.0
+
+    def update(self, progress):
+        if self.started is None:
+            self.started = self.clock() - (progress.elapsed or 0)
+        # A bar that starts over means demucs moved on to the next shift or model
+        if self.last_n is not None and progress.n < self.last_n:
+            self.completed_passes += 1
+            if self.completed_passes >= self.passes:
+                self.passes = self.completed_passes + 1
+        self.last_n = progress.n
+
+        # demucs counts in seconds of audio: use it when the duration could not be probed
+        if self.audio_duration is None and progress.unit.startswith("seconds") and progress.total:
+            self.audio_duration = progress.total
+
+        self.fraction = min((self.completed_passes + progress.fraction) / self.passes, 1.0)
+        return self.fraction
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return self.clock() - self.started
+
+    @property
+    def eta(self):
+        if self.fraction <= 0:
+            return None
+        return self.elapsed * (1 - self.fraction) / self.fraction
+
+    @property
+    def real_time_factor(self):
+        # Projected processing time divided by audio duration (below 1 = faster than real time)
+        if not self.audio_duration or self.fraction <= 0:
+            return None
+        return (self.elapsed / self.fraction) / self.audio_duration
+
+    def describe(self, progress):
+        parts = [f"{self.fraction * 100:5.1f}%"]
+        if self.passes > 1:
+            parts.append(f"pass {min(self.completed_passes + 1, self.passes)}/{self.passes}")
+        if progress.rate is not None:
+            parts.append(f"{progress.rate:g} {progress.unit}")
+        parts.append(f"elapsed {format_clock(self.elapsed)}")
+        parts.append(f"ETA {format_clock(self.eta)}")
+        rtf = self.real_time_factor
+        if rtf is not None:
+            parts.append(f"RTF {rtf:.2f} ({1 / rtf:.1f}x real time)")
+        return " | ".join(parts)
@@ -0,0 +1,146 @@
+"""Process resource readings (memory, CPU) without hard dependencies.
+
+psutil is used when installed; otherwise Linux /proc is read directly.
+Functions return None when a value is not available on this platform.
+"""
+import os
+import threading
+import time
+from pathlib import Path
+
+from natustem.cpu import CGROUP_ROOT
+
+MEMINFO_PATH = "/proc/meminfo"
+# cgroup v1 reports "no limit" as a huge number near 2**63
+CGROUP_V1_UNLIMITED = 2 ** 60
+
+
+def current_rss():
+    # Resident set size of this process in bytes
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def system_available_memory(meminfo=MEMINFO_PATH):
+    # Memory the kernel can hand out without swapping (MemAvailable), in bytes
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        with open(meminfo) as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def read_int(path):
+    try:
+        return int(Path(path).read_text().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def inactive_file_bytes(stat_path, key):
+    # Reclaimable page cache charged to the cgroup (docker and the kubelet leave it out of "usage" too)
+    try:
+        for line in Path(stat_path).read_text().splitlines():
+            name, _, value = line.partition(" ")
+            if name == key:
+                return int(value)
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def cgroup_available_memory(root=CGROUP_ROOT):
+    # Headroom below the cgroup memory limit (containers), in bytes; None when there is no limit
+    limit = None
+    try:
+        text = Path(root, "memory.max").read_text().strip()
+        if text != "max":
+            limit = int(text)
+            usage = (read_int(Path(root, "memory.current")) or 0) - inactive_file_bytes(Path(root, "memory.stat"), "inactive_file")
+    except (OSError, ValueError):
+        # cgroup v1
+        limit = read_int(Path(root, "memory", "memory.limit_in_bytes"))
+        if limit is not None and limit >= CGROUP_V1_UNLIMITED:
+            limit = None
+        if limit is not None:
+            usage = ((read_int(Path(root, "memory", "memory.usage_in_bytes")) or 0)
+                     - inactive_file_bytes(Path(root, "memory", "memory.stat"), "total_inactive_file"))
+    if limit is None:
+        return None
+    return max(0, limit - max(0, usage))
+
+
+def available_memory(meminfo=MEMINFO_PATH, cgroup_root=CGROUP_ROOT):
+    # What this process can still allocate: the host's available memory, capped by a cgroup limit; None if unknown
+    readings = [value for value in (system_available_memory(meminfo), cgroup_available_memory(cgroup_root)) if value is not None]
+    return min(readings) if readings else None
+
+
+def process_cpu_seconds():
+    # User + system CPU time of this process, all threads included
+    times = os.times()
+    return times.user + times.system
+
+
+class ResourceSampler:
+    # Samples RSS on a background thread; summary() gives peak RSS and CPU utilization
+    def __init__(self, interval=0.1, clock=time.monotonic):
+        self.interval = interval
+        self.clock = clock
+        self.peak_rss = None
+        self.start_rss = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        rss = current_rss()
+        if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+        return rss
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.started = self.clock()
+        self.start_cpu = process_cpu_seconds()
+        self.start_rss = self.sample()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.sample()
+        return self.summary()
+
+    def summary(self):
+        wall = max(self.clock() - self.started, 1e-9)
+        cpu = process_cpu_seconds() - self.start_cpu
+        return {
+            "peak_rss_bytes": self.peak_rss,
+            "start_rss_bytes": self.start_rss,
+            "cpu_seconds": round(cpu, 3),
+            # 100% = one core fully busy
+            "cpu_percent": round(100 * cpu / wall, 1),
+            "cores": os.cpu_count(),
+        }
@@ -0,0 +1,509 @@
+"""Local HTTP job API: many clients, one process, models loaded once.
+
+    python -m natustem serve --port 8765 --workers 1 --batch-size 4
+
+Endpoints (JSON unless noted)::
+
+    GET    /health                         queue length and the models each worker has loaded
+    POST   /jobs                           {"input": "/path/song.mp3", "model": ..., "shifts": ..., "overlap": ...,
+                                            "stems": [...], "format": ..., "bit_depth": ...}
+    POST   /jobs?filename=song.mp3&...     the request body is the audio file itself (settings in the query)
+    GET    /jobs                           every job
+    GET    /jobs/<id>                      status, progress (0-1), error, output files
+    DELETE /jobs/<id>                      cancel
+    GET    /jobs/<id>/stems/<file>         the stem's bytes
+
+Each of the ``workers`` engines keeps its models resident (see
+``natustem.models``), so one worker serves every client with a single copy of
+the model. Jobs are grouped by model: a worker takes up to ``batch_size``
+consecutive jobs for the model it has loaded before returning to submission
+order. Only the latest ``keep_finished`` finished jobs are remembered, so a
+long-running server does not grow without bound. The server binds to
+localhost by default and has no authentication; it is meant for tools on the
+same machine.
+"""
+import asyncio
+import json
+import logging
+import shutil
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from natustem import cancellation
+from natustem.audio import probe_duration
+from natustem.constants import AUDIO_EXTENSIONS, DEFAULT_MODEL, DEFAULT_OVERLAP, DEFAULT_SHIFTS, MODELS
+from natustem.encoding import EncoderPool, OutputFormat
+from natustem.engine import SeparationSettings
+from natustem.memory import parse_segment_size
+from natustem.progress import ProgressTracker, StderrTqdmHandler, expected_passes
+from natustem.streaming import chunk_count
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_BATCH_SIZE = 4
+DEFAULT_MAX_QUEUE = 100
+# Finished jobs kept for GET /jobs; older ones are forgotten (their stems stay on disk)
+DEFAULT_KEEP_FINISHED = 1000
+MAX_UPLOAD_BYTES = 2 * 1024 ** 3
+MAX_HEADER_BYTES = 64 * 1024
+SEND_BLOCK_SIZE = 256 * 1024
+UPLOAD_DIR_NAME = ".uploads"
+
+QUEUED = "queued"
+RUNNING = "running"
+ENCODING = "encoding"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# The job running on the current worker thread, for progress lines written by demucs
+_current = threading.local()
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def settings_from(params):
+    # SeparationSettings from a job request; ValueError or TypeError for invalid values
+    model_name = params.get("model", DEFAULT_MODEL)
+    if not isinstance(model_name, str) or model_name not in MODELS:
+        raise ValueError(f"Unknown model {model_name}; choose from {', '.join(sorted(MODELS))}")
+    stems = params.get("stems")
+    if isinstance(stems, str):
+        stems = stems.split(",")
+    chunk_seconds = params.get("chunk_seconds")
+    settings = SeparationSettings(
+        model_name,
+        int(params.get("shifts", DEFAULT_SHIFTS)),
+        float(params.get("overlap", DEFAULT_OVERLAP)),
+        chunk_seconds=int(chunk_seconds) if chunk_seconds else None,
+        output_format=OutputFormat(params.get("format", "WAV"), int(params.get("bit_depth") or 16)),
+        stems=stems,
+        segment_size=parse_segment_size(params.get("segment_size")),
+    )
+    if not 0 <= settings.shifts <= 20 or not 0.0 <= settings.overlap <= 0.99:
+        raise ValueError("shifts must be 0-20 and overlap 0-0.99")
+    return settings
+
+
+class ServiceJob:
+    def __init__(self, input_path, settings, uploaded=False):
+        self.id = uuid.uuid4().hex[:12]
+        self.input_path = Path(input_path)
+        # Uploaded inputs live in their own folder, removed once the job is over
+        self.uploaded = uploaded
+        self.settings = settings
+        self.status = QUEUED
+        self.progress = 0.0
+        self.tracker = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.output_dir = None
+        self.files = []
+        self.error = None
+        self.cached = False
+        self.timings = {}
+        self.cancel_token = cancellation.CancelToken()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "input": str(self.input_path),
+            "settings": self.settings.to_dict(),
+            "status": self.status,
+            "progress": round(self.progress, 4),
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "output_dir": str(self.output_dir) if self.output_dir else None,
+            "files": self.files,
+            "cached": self.cached,
+            "timings": self.timings,
+            "error": self.error,
+        }
+
+
+class JobService:
+    def __init__(self, engine_factory, workers=1, batch_size=DEFAULT_BATCH_SIZE, max_queue=DEFAULT_MAX_QUEUE, output_root="output",
+                 keep_finished=DEFAULT_KEEP_FINISHED):
+        self.engine_factory = engine_factory
+        self.workers = workers
+        self.batch_size = max(1, batch_size)
+        self.max_queue = max_queue
+        self.keep_finished = keep_finished
+        self.output_root = Path(output_root)
+        self.jobs = {}
+        self.pending = deque()
+        self.lock = threading.Lock()
+        self.engines = []
+        self.executor = None
+        self.encoder = None
+        self.tasks = []
+        self.wakeup = None
+
+    async def start(self, warm_settings=None):
+        # Creates the engines; with warm_settings their model is loaded before the first job arrives
+        self.wakeup = asyncio.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="separation")
+        self.encoder = EncoderPool()
+        loop = asyncio.get_running_loop()
+        self.engines = [self.engine_factory(output_root=self.output_root) for _ in range(self.workers)]
+        if warm_settings is not None:
+            await asyncio.gather(*(loop.run_in_executor(self.executor, engine.prepare, warm_settings) for engine in self.engines))
+        self.tasks = [asyncio.create_task(self.worker(engine)) for engine in self.engines]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        for job in list(self.jobs.values()):
+            if job.status in (QUEUED, RUNNING):
+                job.cancel_token.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.executor.shutdown(wait=True)
+        self.encoder.shutdown()
+        for engine in self.engines:
+            engine.stop()
+
+    async def submit(self, input_path, settings, uploaded=False):
+        with self.lock:
+            if len(self.pending) >= self.max_queue:
+                raise QueueFullError(f"The queue is full ({self.max_queue} jobs).")
+            job = ServiceJob(input_path, settings, uploaded)
+            self.jobs[job.id] = job
+            self.pending.append(job)
+            self.forget_finished()
+        async with self.wakeup:
+            self.wakeup.notify_all()
+        return job
+
+    def forget_finished(self):
+        # Drops the oldest finished jobs beyond keep_finished. Caller holds the lock.
+        finished = [job for job in self.jobs.values() if job.status in FINISHED and job.finished is not None]
+        if len(finished) <= self.keep_finished:
+            return
+        finished.sort(key=lambda job: job.finished)
+        for job in finished[:len(finished) - self.keep_finished]:
+            del self.jobs[job.id]
+
+    def cancel(self, job):
+        with self.lock:
+            if job in self.pending:
+                self.pending.remove(job)
+                job.status = CANCELLED
+                job.finished = time.time()
+                self.remove_upload(job)
+                return
+        if job.status == RUNNING:
+            job.cancel_token.cancel()
+
+    def take_job(self, engine, state):
+        # Next job for this worker: the loaded model's jobs first, up to batch_size in a row
+        with self.lock:
+            if not self.pending:
+                return None
+            job = None
+            if state["streak"] < self.batch_size:
+                job = next((j for j in self.pending if j.settings.model_name == engine.loaded_model_name), None)
+            if job is None:
+                resident = engine.resident_models() if state["streak"] < self.batch_size else ()
+                job = next((j for j in self.pending if j.settings.model_name in resident), self.pending[0])
+            self.pending.remove(job)
+            same_model = job.settings.model_name == engine.loaded_model_name
+            state["streak"] = state["streak"] + 1 if same_model else 1
+            job.status = RUNNING
+            return job
+
+    async def worker(self, engine):
+        loop = asyncio.get_running_loop()
+        state = {"streak": 0}
+        while True:
+            async with self.wakeup:
+                await self.wakeup.wait_for(lambda: bool(self.pending))
+            job = self.take_job(engine, state)
+            if job is None:
+                continue
+            await loop.run_in_executor(self.executor, self.run_job, engine, job)
+
+    def run_job(self, engine, job):
+        # Runs on a separation thread
+        job.started = time.time()
+        duration = probe_duration(job.input_path)
+        passes = expected_passes(job.settings.model_name, job.settings.shifts) * chunk_count(duration, job.settings.chunk_seconds)
+        job.tracker = ProgressTracker(passes=passes, audio_duration=duration)
+        _current.job = job
+        try:
+            result = engine.separate(job.input_path, job.settings, log=logger.info, cancel_token=job.cancel_token)
+        except cancellation.JobCancelledError:
+            job.status = CANCELLED
+            job.finished = time.time()
+            return
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}", exc_info=True)
+            job.status = FAILED
+            job.error = str(e)
+            job.finished = time.time()
+            return
+        finally:
+            _current.job = None
+            self.remove_upload(job)
+        job.output_dir = result.output_dir
+        job.files = result.files
+        job.cached = result.cached
+        job.timings = result.timings
+        job.progress = 1.0
+        if result.encodes:
+            job.status = ENCODING
+            self.encoder.submit(result, job.settings.output_format, log=logger.info).add_done_callback(
+                lambda batch: self.encoding_finished(job, batch))
+        else:
+            job.status = DONE
+            job.finished = time.time()
+
+    def remove_upload(self, job):
+        if job.uploaded:
+            shutil.rmtree(job.input_path.parent, ignore_errors=True)
+
+    def encoding_finished(self, job, batch):
+        if batch.errors:
+            job.status = FAILED
+            job.error = "; ".join(batch.errors)
+        else:
+            job.status = DONE
+        job.finished = time.time()
+
+    def on_progress(self, progress):
+        # StderrTqdmHandler callback; runs on the thread that printed the bar
+        job = getattr(_current, "job", None)
+        if job is not None and job.tracker is not None:
+            job.progress = job.tracker.update(progress)
+
+    def health(self):
+        with self.lock:
+            queued = len(self.pending)
+        return {
+            "status": "ok",
+            "workers": [engine.model_state() for engine in self.engines],
+            "queued": queued,
+            "running": sum(1 for job in self.jobs.values() if job.status == RUNNING),
+            "batch_size": self.batch_size,
+            "max_queue": self.max_queue,
+        }
+
+
+class HttpApi:
+    def __init__(self, service, host=DEFAULT_HOST, port=DEFAULT_PORT, max_upload_bytes=MAX_UPLOAD_BYTES):
+        self.service = service
+        self.host = host
+        self.port = port
+        self.max_upload_bytes = max_upload_bytes
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        # The real port, when started with port 0
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"Serving the separation API on http://{self.host}:{self.port}")
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        try:
+            method, target, headers = await self.read_head(reader)
+            url = urlsplit(target)
+            await self.route(method, [unquote(p) for p in url.path.split("/") if p], parse_qs(url.query), headers, reader, writer)
+        except HttpError as e:
+            await self.send_json(writer, e.status, {"error": str(e)})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"API request failed: {e}", exc_info=True)
+            await self.send_json(writer, 500, {"error": "internal error"})
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def read_head(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise HttpError(431, "Request header too large")
+        if len(head) > MAX_HEADER_BYTES:
+            raise HttpError(431, "Request header too large")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        return method.upper(), target, headers
+
+    @staticmethod
+    def content_length(headers):
+        # The body's length in bytes (0 without a Content-Length header)
+        value = headers.get("content-length") or "0"
+        if not value.isdigit():
+            raise HttpError(400, f"Invalid Content-Length: {value}")
+        return int(value)
+
+    async def read_json(self, reader, headers):
+        length = self.content_length(headers)
+        if length > MAX_HEADER_BYTES:
+            raise HttpError(413, "JSON body too large")
+        try:
+            params = json.loads(await reader.readexactly(length) or b"{}")
+        except ValueError:
+            raise HttpError(400, "Body is not valid JSON")
+        if not isinstance(params, dict):
+            raise HttpError(400, "Body must be a JSON object")
+        return params
+
+    async def route(self, method, parts, query, headers, reader, writer):
+        service = self.service
+        if parts == ["health"] and method == "GET":
+            return await self.send_json(writer, 200, service.health())
+        if parts == ["jobs"] and method == "GET":
+            return await self.send_json(writer, 200, {"jobs": [job.to_dict() for job in service.jobs.values()]})
+        if parts == ["jobs"] and method == "POST":
+            return await self.submit(query, headers, reader, writer)
+        if len(parts) >= 2 and parts[0] == "jobs":
+            job = service.jobs.get(parts[1])
+            if job is None:
+                raise HttpError(404, f"No job {parts[1]}")
+            if len(parts) == 2 and method == "GET":
+                return await self.send_json(writer, 200, job.to_dict())
+            if len(parts) == 2 and method == "DELETE":
+                service.cancel(job)
+                return await self.send_json(writer, 202, job.to_dict())
+            if len(parts) == 3 and parts[2] == "stems" and method == "GET":
+                return await self.send_json(writer, 200, {"files": job.files if job.status == DONE else []})
+            if len(parts) == 4 and parts[2] == "stems" and method == "GET":
+                return await self.send_stem(writer, job, parts[3])
+        raise HttpError(404, "Not found")
+
+    async def submit(self, query, headers, reader, writer):
+        content_type = headers.get("content-type", "")
+        if content_type.startswith("application/json") or "filename" not in query:
+            params = await self.read_json(reader, headers)
+            input_path = params.get("input")
+            if not isinstance(input_path, str) or not input_path or not Path(input_path).is_file():
+                raise HttpError(400, f"Input file not found: {input_path}")
+        else:
+            params = {name: values[-1] for name, values in query.items()}
+            if "stems" in query:
+                params["stems"] = [stem for value in query["stems"] for stem in value.split(",")]
+            try:
+                settings = settings_from(params)
+            except (TypeError, ValueError) as e:
+                raise HttpError(400, str(e))
+            input_path = await self.receive_upload(reader, headers, Path(params["filename"]).name)
+            try:
+                job = await self.service.submit(input_path, settings, uploaded=True)
+            except QueueFullError as e:
+                shutil.rmtree(input_path.parent, ignore_errors=True)
+                raise HttpError(503, str(e))
+            return await self.send_json(writer, 202, job.to_dict())
+        try:
+            settings = settings_from(params)
+            job = await self.service.submit(input_path, settings)
+        except (TypeError, ValueError) as e:
+            raise HttpError(400, str(e))
+        except QueueFullError as e:
+            raise HttpError(503, str(e))
+        await self.send_json(writer, 202, job.to_dict())
+
+    async def receive_upload(self, reader, headers, filename):
+        if Path(filename).suffix.lower() not in AUDIO_EXTENSIONS:
+            raise HttpError(400, f"Unsupported file type: {filename}")
+        length = self.content_length(headers)
+        if length <= 0:
+            raise HttpError(411, "Content-Length required")
+        if length > self.max_upload_bytes:
+            raise HttpError(413, "Upload too large")
+        # One folder per upload: the file keeps its name, so the stems land in output/<name>/
+        target = self.service.output_root / UPLOAD_DIR_NAME / uuid.uuid4().hex[:12] / filename
+        target.parent.mkdir(parents=True, exist_ok=True)
+        remaining = length
+        try:
+            with open(target, "wb") as f:
+                while remaining:
+                    block = await reader.read(min(SEND_BLOCK_SIZE, remaining))
+                    if not block:
+                        raise HttpError(400, "Upload ended early")
+                    f.write(block)
+                    remaining -= len(block)
+        except BaseException:
+            shutil.rmtree(target.parent, ignore_errors=True)
+            raise
+        return target
+
+    async def send_stem(self, writer, job, name):
+        # Only the job's own files can be fetched
+        if job.status != DONE or name not in job.files:
+            raise HttpError(404, f"No stem {name} for job {job.id}")
+        path = Path(job.output_dir) / name
+        size = path.stat().st_size
+        content_type = {".wav": "audio/wav", ".flac": "audio/flac", ".mp3": "audio/mpeg"}.get(path.suffix.lower(),
+                                                                                            "application/octet-stream")
+        await self.send_head(writer, 200, content_type, size)
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(SEND_BLOCK_SIZE)
+                if not block:
+                    break
+                writer.write(block)
+                await writer.drain()
+
+    async def send_head(self, writer, status, content_type, length):
+        reason = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 411: "Length Required", 413: "Payload Too Large",
+                  431: "Request Header Fields Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}.get(status, "")
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\nContent-Length: {length}\r\n"
+                     f"Connection: close\r\n\r\n".encode("latin-1"))
+
+    async def send_json(self, writer, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        await self.send_head(writer, status, "application/json", len(body))
+        writer.write(body)
+        await writer.drain()
+
+
+async def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT, warm_settings=None, ready=None):
+    # Runs until cancelled (Ctrl+C); ready(api), if given, is called once the port is open
+    # demucs progress bars drive the jobs' progress and cancellation checkpoints
+    sys.stderr = StderrTqdmHandler(service.on_progress)
+    await service.start(warm_settings)
+    api = await HttpApi(service, host, port).start()
+    if ready is not None:
+        ready(api)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+        await service.stop()
+        sys.stderr = sys.stderr.original_stderr
@@ -0,0 +1,130 @@
+"""Choosing which stems a job produces.
+
+``SeparationSettings.stems`` lists the wanted stems (``None`` means every
+stem the model has). When a single model stem is needed the Separator's
+``output_single_stem`` is set, so the other stems are never written; when
+several are needed the unwanted ones are deleted as soon as the model
+returns, before anything is renamed, cached or encoded.
+
+"Instrumental" is not a model stem: it is derived as the mix minus the
+vocals, so a vocals/instrumental job only ever writes the vocal stem.
+"""
+import array
+import logging
+import shutil
+import subprocess
+import sys
+import wave
+from pathlib import Path
+
+from natustem.constants import RENAME_MAP
+
+logger = logging.getLogger(__name__)
+
+INSTRUMENTAL = "Instrumental"
+FOUR_STEMS = ("Vocals", "Drums", "Bass", "Other")
+SIX_STEMS = FOUR_STEMS + ("Guitar", "Piano")
+MODEL_STEMS = {"htdemucs_6s.yaml": SIX_STEMS}
+# Frames per block when subtracting without ffmpeg
+BLOCK_FRAMES = 65536
+
+
+def model_stems(model_name):
+    return MODEL_STEMS.get(model_name, FOUR_STEMS)
+
+
+def stem_choices(model_name):
+    return model_stems(model_name) + (INSTRUMENTAL,)
+
+
+def normalize_stems(stems, model_name):
+    # Canonical, ordered tuple of the requested stems, or None for "all of the model's stems"
+    if not stems:
+        return None
+    by_name = {name.lower(): name for name in stem_choices(model_name)}
+    selected = set()
+    for stem in stems:
+        name = by_name.get(stem.lower())
+        if name is None:
+            raise ValueError(f"{model_name} has no {stem} stem; choose from {', '.join(stem_choices(model_name))}")
+        selected.add(name)
+    if selected == set(model_stems(model_name)):
+        return None
+    return tuple(name for name in stem_choices(model_name) if name in selected)
+
+
+def separator_stems(stems):
+    # The model stems that have to be written for the requested stems
+    if stems is None:
+        return None
+    needed = {stem for stem in stems if stem != INSTRUMENTAL}
+    if INSTRUMENTAL in stems:
+        needed.add("Vocals")
+    return needed
+
+
+def single_stem(stems):
+    # Value for the Separator's output_single_stem, or None when several stems are written
+    needed = separator_stems(stems)
+    if needed is not None and len(needed) == 1:
+        return next(iter(needed))
+    return None
+
+
+def stem_of(file):
+    # The RENAME_MAP keyword of a separator output file, or None
+    for keyword in RENAME_MAP:
+        if f"({keyword})" in file or f"_{keyword}_" in file or keyword in file:
+            return keyword
+    return None
+
+
+def instrumental_name(vocals_file):
+    if "(Vocals)" in vocals_file:
+        return vocals_file.replace("(Vocals)", f"({INSTRUMENTAL})")
+    return vocals_file.replace("Vocals", INSTRUMENTAL)
+
+
+def derive_instrumental(input_path, vocals_path, target_path):
+    # Writes mix - vocals to target_path, matching the vocal stem's rate, channels and length
+    with wave.open(str(vocals_path), "rb") as f:
+        nchannels, sampwidth, framerate = f.getnchannels(), f.getsampwidth(), f.getframerate()
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is not None:
+        graph = (f"[0:a]aresample={framerate},aformat=sample_fmts=fltp:channel_layouts={'stereo' if nchannels == 2 else 'mono'}[mix];"
+                 "[1:a]aformat=sample_fmts=fltp,volume=-1[negated];"
+                 "[mix][negated]amix=inputs=2:normalize=0:duration=shortest")
+        subprocess.run(
+            [ffmpeg, "-nostdin", "-v", "error", "-y", "-i", str(input_path), "-i", str(vocals_path), "-filter_complex", graph,
+             "-c:a", {2: "pcm_s16le", 3: "pcm_s24le", 4: "pcm_f32le"}.get(sampwidth, "pcm_s16le"), "-f", "wav", str(target_path)],
+            check=True, capture_output=True
+        )
+        return
+    subtract_wav(input_path, vocals_path, target_path)
+
+
+def subtract_wav(input_path, vocals_path, target_path):
+    # Without ffmpeg: only a 16-bit PCM WAV input in the stem's own format can be used
+    with wave.open(str(input_path), "rb") as mix, wave.open(str(vocals_path), "rb") as vocals:
+        params = vocals.getparams()
+        if (mix.getnchannels(), mix.getsampwidth(), mix.getframerate()) != (params.nchannels, params.sampwidth, params.framerate) \
+                or params.sampwidth != 2:
+            raise RuntimeError(f"Deriving the instrumental of {Path(input_path).name} needs ffmpeg; install it or pick the other stems.")
+        with wave.open(str(target_path), "wb") as out:
+            out.setparams(params)
+            remaining = params.nframes
+            while remaining > 0:
+                frames = min(BLOCK_FRAMES, remaining)
+                mix_block = array.array("h", mix.readframes(frames))
+                vocal_block = array.array("h", vocals.readframes(frames))
+                if sys.byteorder == "big":
+                    mix_block.byteswap()
+                    vocal_block.byteswap()
+                count = min(len(mix_block), len(vocal_block))
+                if count == 0:
+                    break
+                block = array.array("h", (max(-32768, min(32767, m - v)) for m, v in zip(mix_block, vocal_block)))
+                if sys.byteorder == "big":
+                    block.byteswap()
+                out.writeframes(block.tobytes())
+                remaining -= count // params.nchannels
@@ -0,0 +1,306 @@
+"""Chunked streaming separation for very long recordings.
+
+``Separator.separate()`` loads the whole file and keeps every stem of it in
+memory, so an hour-long DJ mix needs far more RAM than a song and a failure
+near the end loses all the work. In streaming mode the input is cut into
+overlapping windows that are separated one at a time; the stems of
+consecutive windows are crossfaded over the overlap and appended to raw PCM
+files on disk, so peak memory depends on the window length only.
+
+Progress is recorded in a manifest in the job's work directory after every
+window. If a run fails or is cancelled, running the same input with the same
+settings again continues after the last finished window. Only PCM WAV is
+read directly; other formats are decoded once to a WAV file with ffmpeg.
+"""
+import array
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import subprocess
+import sys
+import wave
+from pathlib import Path
+
+from natustem import cancellation
+from natustem.constants import STREAM_CROSSFADE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+# Bytes copied at a time when writing the final WAV files
+COPY_BLOCK_SIZE = 1024 * 1024
+
+SAMPLE_TYPECODES = {2: "h", 4: "i"}
+
+
+def work_dir_for(root, input_path, settings):
+    # One directory per input and settings, so a re-run finds the chunks of a failed run
+    input_path = Path(input_path).resolve()
+    stat = input_path.stat()
+    identity = json.dumps([str(input_path), stat.st_size, stat.st_mtime_ns, settings.to_dict()], sort_keys=True)
+    return Path(root) / hashlib.sha256(identity.encode("utf-8")).hexdigest()[:16]
+
+
+def chunk_count(duration, chunk_seconds, crossfade_seconds=STREAM_CROSSFADE_SECONDS):
+    # Number of windows plan_windows() makes for an input of `duration` seconds
+    if not duration or not chunk_seconds:
+        return 1
+    return max(1, math.ceil((duration - crossfade_seconds) / chunk_seconds))
+
+
+def can_stream(input_path):
+    # Whether decoded_source() can read the input: a PCM WAV file, or anything once ffmpeg is installed
+    input_path = Path(input_path)
+    if input_path.suffix.lower() == ".wav":
+        try:
+            with wave.open(str(input_path), "rb"):
+                return True
+        except (OSError, wave.Error, EOFError):
+            pass
+    return shutil.which("ffmpeg") is not None
+
+
+def plan_windows(total_frames, framerate, chunk_seconds, crossfade_seconds):
+    # (start, length) in input frames; each window overlaps the next by the crossfade
+    step = max(1, int(chunk_seconds * framerate))
+    overlap = int(crossfade_seconds * framerate)
+    windows = []
+    start = 0
+    while True:
+        length = min(step + overlap, total_frames - start)
+        windows.append((start, length))
+        if start + length >= total_frames:
+            return windows
+        start += step
+
+
+def decode_samples(data, sampwidth):
+    # PCM bytes -> list of ints (WAV is little-endian; 8-bit WAV is unsigned)
+    if sampwidth == 1:
+        return [b - 128 for b in data]
+    if sampwidth == 3:
+        return [int.from_bytes(data[i:i + 3], "little", signed=True) for i in range(0, len(data), 3)]
+    samples = array.array(SAMPLE_TYPECODES[sampwidth], data)
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples
+
+
+def encode_samples(samples, sampwidth):
+    if sampwidth == 1:
+        return bytes(s + 128 for s in samples)
+    if sampwidth == 3:
+        return b"".join(s.to_bytes(3, "little", signed=True) for s in samples)
+    encoded = array.array(SAMPLE_TYPECODES[sampwidth], samples)
+    if sys.byteorder == "big":
+        encoded.byteswap()
+    return encoded.tobytes()
+
+
+def crossfade(previous, current, sampwidth, nchannels):
+    # Linear crossfade of two equally long PCM blocks: fades `previous` out and `current` in
+    a = decode_samples(previous, sampwidth)
+    b = decode_samples(current, sampwidth)
+    frames = len(a) // nchannels
+    limit = 2 ** (8 * sampwidth - 1)
+    mixed = []
+    for frame in range(frames):
+        t = (frame + 0.5) / frames
+        for i in range(frame * nchannels, (frame + 1) * nchannels):
+            value = round(a[i] * (1.0 - t) + b[i] * t)
+            mixed.append(max(-limit, min(limit - 1, value)))
+    return encode_samples(mixed, sampwidth)
+
+
+def read_manifest(work_dir):
+    try:
+        with open(work_dir / MANIFEST_NAME, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("version") == MANIFEST_VERSION else None
+
+
+def write_manifest(work_dir, manifest):
+    # Atomic replace: the manifest always describes a consistent set of files
+    tmp_path = work_dir / (MANIFEST_NAME + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, work_dir / MANIFEST_NAME)
+
+
+class StreamingSeparation:
+    def __init__(self, separator, input_path, work_dir, temp_dir, chunk_seconds, crossfade_seconds,
+                 log=logger.info, cancel_token=None):
+        self.separator = separator
+        self.input_path = Path(input_path)
+        self.work_dir = Path(work_dir)
+        # The separator's output_dir; chunk stems are read from here and removed
+        self.temp_dir = Path(temp_dir)
+        self.chunk_seconds = chunk_seconds
+        self.crossfade_seconds = crossfade_seconds
+        self.log = log
+        self.token = cancel_token or cancellation.CancelToken()
+
+    def run(self):
+        # Returns the stitched stem file names in temp_dir, like Separator.separate()
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        manifest = read_manifest(self.work_dir)
+        if manifest is not None and manifest["chunk_seconds"] == self.chunk_seconds and manifest["crossfade_seconds"] == self.crossfade_seconds:
+            self.restore(manifest)
+            if manifest["next_chunk"] > 0:
+                self.log(f"Resuming streaming separation at chunk {manifest['next_chunk'] + 1}/{len(manifest['windows'])}.")
+        else:
+            manifest = self.start()
+
+        windows = manifest["windows"]
+        for index in range(manifest["next_chunk"], len(windows)):
+            self.token.raise_if_cancelled()
+            start, length = windows[index]
+            self.log(f"Separating chunk {index + 1}/{len(windows)} ({start / manifest['framerate']:.0f}s - {(start + length) / manifest['framerate']:.0f}s)...")
+            self.separate_chunk(manifest, index)
+            manifest["next_chunk"] = index + 1
+            write_manifest(self.work_dir, manifest)
+            self.remove_tails(index - 1)
+
+        output_files = self.finish(manifest)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        return output_files
+
+    def start(self):
+        self.remove_stale(keep=())
+        source = self.decoded_source()
+        with wave.open(str(source), "rb") as f:
+            total_frames = f.getnframes()
+            framerate = f.getframerate()
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "source": str(source),
+            "chunk_seconds": self.chunk_seconds,
+            "crossfade_seconds": self.crossfade_seconds,
+            "framerate": framerate,
+            "windows": plan_windows(total_frames, framerate, self.chunk_seconds, self.crossfade_seconds),
+            "next_chunk": 0,
+            # stem suffix (e.g. "_(Vocals)_htdemucs.wav") -> [nchannels, sampwidth, framerate, bytes written]
+            "stems": {},
+        }
+        write_manifest(self.work_dir, manifest)
+        return manifest
+
+    def decoded_source(self):
+        # A PCM WAV input is read in place; anything else is decoded once into the work dir
+        if self.input_path.suffix.lower() == ".wav":
+            try:
+                with wave.open(str(self.input_path), "rb"):
+                    return self.input_path
+            except (wave.Error, EOFError):
+                pass
+        decoded = self.work_dir / "source.wav"
+        if decoded.exists():
+            return decoded
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is None:
+            raise RuntimeError(f"Streaming mode needs ffmpeg to decode {self.input_path.name}; convert it to WAV or install ffmpeg.")
+        self.log(f"Decoding {self.input_path.name} for streaming...")
+        partial = self.work_dir / "source.part.wav"
+        subprocess.run(
+            [ffmpeg, "-nostdin", "-v", "error", "-y", "-i", str(self.input_path), "-vn", "-acodec", "pcm_s16le", str(partial)],
+            check=True, capture_output=True
+        )
+        os.replace(partial, decoded)
+        return decoded
+
+    def restore(self, manifest):
+        # Drop anything appended after the last recorded chunk (a crash between writes)
+        self.remove_stale(keep=manifest["stems"])
+        for suffix, (_, _, _, written) in manifest["stems"].items():
+            with open(self.stem_path(suffix), "r+b") as f:
+                f.truncate(written)
+
+    def remove_stale(self, keep):
+        # Stem files of a run that never reached its first manifest update
+        for path in self.work_dir.glob("stem*.pcm"):
+            if path.name[len("stem"):-len(".pcm")] not in keep:
+                path.unlink()
+
+    def stem_path(self, suffix):
+        return self.work_dir / f"stem{suffix}.pcm"
+
+    def tail_path(self, suffix, index):
+        # The un-faded end of chunk `index`, mixed into the start of the next chunk
+        return self.work_dir / f"tail-{index:05d}{suffix}.pcm"
+
+    def remove_tails(self, index):
+        if index < 0:
+            return
+        for path in self.work_dir.glob(f"tail-{index:05d}*.pcm"):
+            path.unlink()
+
+    def separate_chunk(self, manifest, index):
+        start, length = manifest["windows"][index]
+        chunk_name = f"chunk-{index:05d}"
+        chunk_path = self.work_dir / f"{chunk_name}.wav"
+        with wave.open(manifest["source"], "rb") as src:
+            src.setpos(start)
+            frames = src.readframes(length)
+            with wave.open(str(chunk_path), "wb") as dst:
+                dst.setparams(src.getparams())
+                dst.writeframes(frames)
+        del frames
+
+        try:
+            output_files = self.separator.separate(str(chunk_path))
+        finally:
+            chunk_path.unlink()
+
+        is_last = index == len(manifest["windows"]) - 1
+        for file in output_files:
+            name = Path(file).name
+            stem_file = self.temp_dir / name
+            suffix = name[len(chunk_name):] if name.startswith(chunk_name) else f"_{name}"
+            try:
+                self.append_stem(manifest, suffix, stem_file, index, is_last)
+            finally:
+                stem_file.unlink(missing_ok=True)
+
+    def append_stem(self, manifest, suffix, stem_file, index, is_last):
+        with wave.open(str(stem_file), "rb") as f:
+            nchannels, sampwidth, framerate = f.getnchannels(), f.getsampwidth(), f.getframerate()
+            data = f.readframes(f.getnframes())
+        frame_size = nchannels * sampwidth
+        overlap = int(self.crossfade_seconds * framerate) * frame_size
+
+        previous_tail = self.tail_path(suffix, index - 1)
+        tail = previous_tail.read_bytes() if index > 0 and previous_tail.exists() else b""
+        faded = min(len(tail), len(data)) // frame_size * frame_size
+        keep = 0 if is_last else min(overlap, len(data) - faded) // frame_size * frame_size
+
+        stem = manifest["stems"].setdefault(suffix, [nchannels, sampwidth, framerate, 0])
+        with open(self.stem_path(suffix), "ab") as out:
+            if faded:
+                out.write(crossfade(tail[:faded], data[:faded], sampwidth, nchannels))
+            out.write(data[faded:len(data) - keep])
+            stem[3] = out.tell()
+        if keep:
+            self.tail_path(suffix, index).write_bytes(data[len(data) - keep:])
+
+    def finish(self, manifest):
+        # Wrap each raw stem in a WAV header next to the separator's other outputs
+        output_files = []
+        for suffix, (nchannels, sampwidth, framerate, _) in manifest["stems"].items():
+            name = f"{self.input_path.stem}{suffix}"
+            with open(self.stem_path(suffix), "rb") as src, wave.open(str(self.temp_dir / name), "wb") as dst:
+                dst.setnchannels(nchannels)
+                dst.setsampwidth(sampwidth)
+                dst.setframerate(framerate)
+                while True:
+                    block = src.read(COPY_BLOCK_SIZE)
+                    if not block:
+                        break
+                    dst.writeframes(block)
+            output_files.append(name)
+        return output_files
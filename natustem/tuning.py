@@ -0,0 +1,166 @@
+"""Runtime prediction and time-budget tuning of shifts and overlap.
+
+Every separation records its real-time factor (RTF: seconds of processing
+per second of audio) for its model, shifts and overlap on this host in
+``audio_separator.rtf.json``. Predictions use the measured RTF of the exact
+combination when there is one. Otherwise they scale the host's per-model base
+cost: demucs runs once per shift (and once per model of a bag), and overlap
+``o`` makes it process ``1 / (1 - o)`` times the audio. When the model has
+never run on this host, the other models' base costs are scaled by bag size;
+with no history at all a conservative default is used.
+
+``tune()`` picks the highest-quality candidate (most shifts, then most
+overlap) whose predicted runtime fits a time budget.
+"""
+import json
+import logging
+import os
+import platform
+import threading
+import uuid
+
+from natustem.constants import DEFAULT_OVERLAP, DEFAULT_SHIFTS, MODEL_BAG_SIZES, RTF_HISTORY_FILE_NAME
+
+logger = logging.getLogger(__name__)
+
+# Weight of a new measurement in the moving average
+EWMA_ALPHA = 0.3
+# RTF of one network and pass without overlap assumed on a host without any history: a modest CPU
+DEFAULT_BASE_RTF = 0.6
+# Candidates for tune(); beyond ~10 shifts quality gains are negligible
+TUNE_SHIFTS = range(0, 11)
+TUNE_OVERLAPS = (0.1, 0.25, 0.5, 0.75)
+
+
+def host_key():
+    return f"{platform.node() or 'unknown'}/{platform.machine()}/{os.cpu_count() or 1}cpu"
+
+
+def combo_key(model_name, shifts, overlap):
+    return f"{model_name}|{int(shifts)}|{round(float(overlap), 2)}"
+
+
+def cost_factor(model_name, shifts, overlap):
+    # Relative work of a combination compared to a single pass without overlap
+    return MODEL_BAG_SIZES.get(model_name, 1) * max(1, int(shifts)) / max(0.01, 1.0 - overlap)
+
+
+class Prediction:
+    def __init__(self, rtf, source, duration=None):
+        self.rtf = rtf
+        # "measured" (this exact combination), "scaled" (from this host's history) or "default"
+        self.source = source
+        self.seconds = rtf * duration if duration else None
+
+    def describe(self):
+        label = {"measured": "measured", "scaled": "from history", "default": "rough estimate, no history yet"}[self.source]
+        if self.seconds is None:
+            return f"RTF {self.rtf:.2f} ({label})"
+        return f"~{format_duration(self.seconds)} (RTF {self.rtf:.2f}, {label})"
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}m {seconds:02d}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m"
+
+
+class RtfHistory:
+    def __init__(self, path=RTF_HISTORY_FILE_NAME, host=None):
+        self.path = path
+        self.host = host or host_key()
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.data = self.load()
+
+    def load(self):
+        try:
+            self.mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        # Atomic replace of a temp file of this writer's own, so concurrent writers (worker processes) never
+        # interleave in one file; the last one wins, losing at most the other's latest sample
+        tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save RTF history to {self.path}: {e}")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    def entries(self):
+        # Reloads when another engine (e.g. a worker process) has recorded since
+        try:
+            if os.stat(self.path).st_mtime_ns != self.mtime:
+                self.data = self.load()
+        except OSError:
+            pass
+        return self.data.get(self.host, {})
+
+    def record(self, settings, processing_seconds, audio_seconds):
+        if not audio_seconds or audio_seconds <= 0 or processing_seconds <= 0:
+            return None
+        rtf = processing_seconds / audio_seconds
+        key = combo_key(settings.model_name, settings.shifts, settings.overlap)
+        with self.lock:
+            self.data = self.load()  # pick up other processes' measurements
+            entry = self.data.setdefault(self.host, {}).get(key)
+            if entry is None:
+                entry = {"rtf": rtf, "samples": 1}
+            else:
+                entry = {"rtf": (1 - EWMA_ALPHA) * entry["rtf"] + EWMA_ALPHA * rtf, "samples": entry["samples"] + 1}
+            self.data[self.host][key] = entry
+            self.save()
+        return rtf
+
+    def base_rtfs(self):
+        # model -> RTF per network and pass (cost_factor 1), averaged over the host's measurements
+        totals = {}
+        for key, entry in self.entries().items():
+            model_name, shifts, overlap = key.split("|")
+            base = entry["rtf"] / cost_factor(model_name, int(shifts), float(overlap))
+            weight_sum, value_sum = totals.get(model_name, (0, 0.0))
+            totals[model_name] = (weight_sum + entry["samples"], value_sum + base * entry["samples"])
+        return {model: value / weight for model, (weight, value) in totals.items()}
+
+    def predict(self, model_name, shifts, overlap, duration=None):
+        entry = self.entries().get(combo_key(model_name, shifts, overlap))
+        if entry is not None:
+            return Prediction(entry["rtf"], "measured", duration)
+        cost = cost_factor(model_name, shifts, overlap)
+        bases = self.base_rtfs()
+        if model_name in bases:
+            return Prediction(bases[model_name] * cost, "scaled", duration)
+        if bases:
+            # Other models ran here: their per-network cost is the best guess for this one
+            return Prediction(sum(bases.values()) / len(bases) * cost, "scaled", duration)
+        return Prediction(DEFAULT_BASE_RTF * cost, "default", duration)
+
+
+def tune(history, model_name, duration, budget_seconds):
+    # Returns (shifts, overlap, prediction, fits) for the best candidate within the budget
+    candidates = sorted(((s, o) for s in TUNE_SHIFTS for o in TUNE_OVERLAPS), reverse=True)
+    for shifts, overlap in candidates:
+        prediction = history.predict(model_name, shifts, overlap, duration)
+        if prediction.seconds is not None and prediction.seconds <= budget_seconds:
+            return shifts, overlap, prediction, True
+    if duration is None:
+        # Unknown duration: keep the defaults rather than guess
+        shifts, overlap = DEFAULT_SHIFTS, DEFAULT_OVERLAP
+    else:
+        shifts, overlap = 0, min(TUNE_OVERLAPS)
+    return shifts, overlap, history.predict(model_name, shifts, overlap, duration), False
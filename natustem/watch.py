@@ -0,0 +1,153 @@
+"""Drop folder: separate audio files as they appear in ``input/``.
+
+``FolderWatcher`` polls the folder (no platform file-event APIs needed) and
+hands a file over once its size and modification time have stopped changing
+for ``settle_seconds``, so files still being copied are left alone. Every
+finished file is recorded in a ``ProcessedLedger`` (``output/.watch-ledger.json``)
+with the size and mtime it had; after a restart those files are skipped
+unless they have been replaced since.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from natustem.constants import AUDIO_EXTENSIONS, WATCH_LEDGER_FILE_NAME
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLL_SECONDS = 1.0
+# How long a file's size and mtime must stay unchanged before it counts as fully copied
+DEFAULT_SETTLE_SECONDS = 2.0
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class ProcessedLedger:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.entries = self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save watch ledger {self.path}: {e}")
+
+    @staticmethod
+    def key(path):
+        return str(Path(path).resolve())
+
+    def is_processed(self, path, signature):
+        entry = self.entries.get(self.key(path))
+        return entry is not None and (entry["size"], entry["mtime_ns"]) == tuple(signature)
+
+    def record(self, path, status, signature=None, output_dir=None):
+        # status: "done", "failed" or "cancelled"; all of them are final, a restart does not retry them
+        try:
+            size, mtime_ns = signature or file_signature(path)
+        except OSError:
+            return  # Removed meanwhile; nothing to remember
+        with self.lock:
+            self.entries[self.key(path)] = {
+                "size": size,
+                "mtime_ns": mtime_ns,
+                "status": status,
+                "output_dir": str(output_dir) if output_dir else None,
+                "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            }
+            self.save()
+
+
+class FolderWatcher:
+    def __init__(self, input_dir, ledger, settle_seconds=DEFAULT_SETTLE_SECONDS, clock=time.monotonic):
+        self.input_dir = Path(input_dir)
+        self.ledger = ledger
+        self.settle_seconds = settle_seconds
+        self.clock = clock
+        # path -> (signature, time it was first seen with that signature)
+        self.candidates = {}
+        # Handed over during this run (the ledger only learns about them once they finish)
+        self.handed_over = {}
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def scan(self):
+        try:
+            entries = list(os.scandir(self.input_dir))
+        except FileNotFoundError:
+            return {}
+        found = {}
+        for entry in entries:
+            if not entry.is_file() or entry.name.startswith(".") or Path(entry.name).suffix.lower() not in AUDIO_EXTENSIONS:
+                continue
+            stat = entry.stat()
+            found[Path(entry.path)] = (stat.st_size, stat.st_mtime_ns)
+        return found
+
+    def poll(self):
+        # Returns the files that have become ready since the last poll, oldest first
+        now = self.clock()
+        found = self.scan()
+        for path in list(self.candidates):
+            if path not in found:
+                del self.candidates[path]
+        ready = []
+        for path, signature in sorted(found.items(), key=lambda item: item[1][1]):
+            if self.handed_over.get(path) == signature or self.ledger.is_processed(path, signature):
+                continue
+            previous = self.candidates.get(path)
+            if previous is None or previous[0] != signature:
+                self.candidates[path] = (signature, now)  # New or still growing
+                continue
+            if signature[0] > 0 and now - previous[1] >= self.settle_seconds:
+                del self.candidates[path]
+                self.handed_over[path] = signature
+                ready.append(path)
+        return ready
+
+    def signature_of(self, path):
+        # The signature the file had when it was handed over (what the ledger should record)
+        return self.handed_over.get(Path(path))
+
+    def run(self, on_ready, interval=DEFAULT_POLL_SECONDS):
+        logger.info(f"Watching {self.input_dir} for new audio files...")
+        while not self.stopped.is_set():
+            try:
+                for path in self.poll():
+                    on_ready(path)
+            except Exception:
+                logger.error("Watch folder poll failed", exc_info=True)
+            self.stopped.wait(interval)
+
+    def start(self, on_ready, interval=DEFAULT_POLL_SECONDS):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, args=(on_ready, interval), daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+
+def ledger_for(output_root):
+    return ProcessedLedger(Path(output_root) / WATCH_LEDGER_FILE_NAME)
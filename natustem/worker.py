@@ -0,0 +1,384 @@
+"""Out-of-process separation worker.
+
+``WorkerProcess`` runs a ``SeparationEngine`` in a long-lived child process
+(``python -m natustem.worker``) that keeps its model loaded between jobs. It
+has the same ``separate(input_path, settings, log=...)`` interface as the
+in-process engine, so the GUI and the CLI can use either one. Torch inference
+no longer shares the interpreter with the GUI, and if the child crashes or is
+OOM-killed, only the current job fails: the next job starts a fresh worker.
+
+Messages are pickled tuples with a length prefix, sent over the child's
+stdin/stdout pipes::
+
+    parent -> child   ("job", job_id, input_path, settings, output_dir)
+                      ("cancel", job_id, reason)
+                      ("shutdown",)
+    child -> parent   ("ready", pid)
+                      ("log", job_id, message)
+                      ("progress", job_id, TqdmProgress)
+                      ("done", job_id, SeparationResult, model_state)
+                      ("error", job_id, message, model_state)
+                      ("cancelled", job_id, reason, model_state)
+
+``model_state`` is ``SeparationEngine.model_state()``: the loaded and resident
+models and the model cache statistics.
+
+Cancellation is cooperative (the child stops at the next demucs chunk and
+keeps its model); a forced cancel kills the child instead. When the child is
+killed or crashes mid-job, the parent removes the partial stems it left in
+the job's output folder.
+"""
+import argparse
+import itertools
+import logging
+import os
+import pickle
+import queue
+import struct
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+from natustem.cache import DEFAULT_CACHE_MAX_BYTES, ResultCache
+from natustem.cancellation import CancelToken, JobCancelledError
+from natustem.constants import LOG_FILE_NAME
+from natustem.cpu import ExecutionSettings, apply_execution_settings
+from natustem.engine import SeparationEngine
+from natustem.logging_setup import GuiLogHandler
+from natustem.model_store import ModelStore
+from natustem.models import DEFAULT_MODEL_MEMORY_BUDGET
+from natustem.outputs import OutputDirLock, discard_new_files, existing_names
+from natustem.progress import StderrTqdmHandler
+from natustem.tuning import RtfHistory
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER = struct.Struct("!I")
+# Seconds between liveness and cancellation checks while waiting for a job to finish
+POLL_INTERVAL = 0.2
+# Seconds to wait for a clean exit before killing the child
+SHUTDOWN_TIMEOUT = 10
+
+
+class WorkerCrashedError(RuntimeError):
+    pass
+
+
+def write_frame(stream, message):
+    payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    stream.write(FRAME_HEADER.pack(len(payload)) + payload)
+    stream.flush()
+
+
+def read_frame(stream):
+    # Returns the next message, or None at end of stream
+    header = stream.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None
+    (size,) = FRAME_HEADER.unpack(header)
+    payload = stream.read(size)
+    if len(payload) < size:
+        return None
+    return pickle.loads(payload)
+
+
+def execution_options(execution):
+    # WorkerProcess keyword arguments for cpu.ExecutionSettings; auto mode is resolved here, on the same host
+    if execution is None:
+        return {}
+    resolved = execution.resolve()
+    return {"torch_threads": resolved.intra_op_threads, "interop_threads": resolved.inter_op_threads, "cpu_affinity": resolved.cpus}
+
+
+class WorkerProcess:
+    def __init__(self, output_root="output", cache_root=None, cache_max_bytes=DEFAULT_CACHE_MAX_BYTES,
+                 progress_callback=None, model_memory_bytes=DEFAULT_MODEL_MEMORY_BUDGET, torch_threads=None, cpu_affinity=None,
+                 metrics_path=None, rtf_history_path=None, interop_threads=None, model_dir=None, offline=False):
+        self.output_root = output_root
+        self.cache_root = cache_root
+        self.cache_max_bytes = cache_max_bytes
+        self.model_memory_bytes = model_memory_bytes
+        # Parallel mode or execution settings: this worker's torch thread counts and the cores it is pinned to
+        self.torch_threads = torch_threads
+        self.interop_threads = interop_threads
+        self.cpu_affinity = cpu_affinity
+        # The child appends its per-job metrics records here
+        self.metrics_path = metrics_path
+        self.rtf_history_path = rtf_history_path
+        # The child's model store (see natustem.model_store); None keeps audio-separator's own model directory
+        self.model_dir = model_dir
+        self.offline = offline
+        self.progress_callback = progress_callback
+        self.process = None
+        self.events = None
+        self.send_lock = threading.Lock()
+        self.job_ids = itertools.count(1)
+        # Mirrors the child's engine so job schedulers can group by model
+        self.loaded_model_name = None
+        self.last_model_state = {}
+
+    def command(self):
+        cmd = [sys.executable, "-m", "natustem.worker", "--output", str(self.output_root),
+               "--model-memory", str(self.model_memory_bytes)]
+        if self.cache_root:
+            cmd += ["--cache", str(self.cache_root), "--cache-size", str(self.cache_max_bytes)]
+        if self.metrics_path:
+            cmd += ["--metrics", str(self.metrics_path)]
+        if self.rtf_history_path:
+            cmd += ["--rtf-history", str(self.rtf_history_path)]
+        if self.torch_threads:
+            cmd += ["--threads", str(self.torch_threads)]
+        if self.interop_threads:
+            cmd += ["--interop-threads", str(self.interop_threads)]
+        if self.cpu_affinity:
+            cmd += ["--cpus", ",".join(map(str, self.cpu_affinity))]
+        if self.model_dir:
+            cmd += ["--model-dir", str(self.model_dir)]
+        if self.offline:
+            cmd.append("--offline")
+        return cmd
+
+    def resident_models(self):
+        return self.last_model_state.get("resident_models", [])
+
+    def model_state(self):
+        return self.last_model_state
+
+    def update_model_state(self, state):
+        self.last_model_state = state or {}
+        self.loaded_model_name = self.last_model_state.get("loaded_model_name")
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        if self.is_alive():
+            return
+        # stderr is inherited so tqdm and logs still reach the console
+        self.process = subprocess.Popen(self.command(), stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.update_model_state(None)
+        self.events = queue.Queue()
+        reader = threading.Thread(target=self.read_events, args=(self.process, self.events), daemon=True)
+        reader.start()
+
+    def read_events(self, process, events):
+        try:
+            while True:
+                message = read_frame(process.stdout)
+                if message is None:
+                    break
+                events.put(message)
+        except (OSError, ValueError, pickle.UnpicklingError) as e:
+            logger.debug(f"Worker event stream closed: {e}")
+        events.put(None)
+
+    def send(self, message):
+        with self.send_lock:
+            write_frame(self.process.stdin, message)
+
+    def separate(self, input_path, settings, log=logger.info, cancel_token=None, output_dir=None):
+        token = cancel_token or CancelToken()
+        token.raise_if_cancelled()
+        self.start()
+        job_id = next(self.job_ids)
+        # What the job's output folder held before, to remove the partial stems of a killed or crashed child
+        job_dir = Path(output_dir) if output_dir is not None else Path(self.output_root) / Path(input_path).stem
+        created_job_dir = not job_dir.exists()
+        existing = existing_names(job_dir)
+        try:
+            self.send(("job", job_id, str(input_path), settings, str(output_dir) if output_dir is not None else None))
+        except OSError as e:
+            raise WorkerCrashedError(f"Could not send job to the worker process: {e}") from e
+
+        cancel_sent = False
+        while True:
+            if token.cancelled:
+                if token.force:
+                    log("Stopping the worker process...")
+                    self.kill()
+                    self.discard_partial_outputs(job_dir, existing, created_job_dir, log)
+                    raise JobCancelledError(token.reason)
+                if not cancel_sent:
+                    cancel_sent = True
+                    try:
+                        self.send(("cancel", job_id, token.reason))
+                    except OSError:
+                        pass
+
+            try:
+                message = self.events.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if self.is_alive():
+                    continue
+                message = None
+
+            if message is None:
+                error = WorkerCrashedError(self.describe_exit())
+                self.discard_partial_outputs(job_dir, existing, created_job_dir, log)
+                raise error
+
+            kind = message[0]
+            if kind == "ready" or message[1] != job_id:
+                continue
+            if kind == "log":
+                log(message[2])
+            elif kind == "progress":
+                if self.progress_callback is not None:
+                    self.progress_callback(message[2])
+            elif kind == "done":
+                self.update_model_state(message[3])
+                return message[2]
+            elif kind == "error":
+                self.update_model_state(message[3])
+                raise RuntimeError(message[2])
+            elif kind == "cancelled":
+                self.update_model_state(message[3])
+                raise JobCancelledError(message[2])
+
+    def discard_partial_outputs(self, job_dir, existing, remove_dir, log):
+        # The dead child's folder lock is gone with it; take it here so no other job publishes meanwhile
+        with OutputDirLock(job_dir.parent, job_dir.name):
+            discard_new_files(job_dir, existing, remove_dir, log=log)
+
+    def kill(self):
+        if self.is_alive():
+            self.process.kill()
+            self.process.wait()
+        self.update_model_state(None)
+
+    def describe_exit(self):
+        try:
+            code = self.process.wait(timeout=SHUTDOWN_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            code = self.process.wait()
+        self.update_model_state(None)
+        if code is not None and code < 0:
+            return f"Worker process was killed by signal {-code} (possibly out of memory); it will be restarted for the next job."
+        return f"Worker process exited unexpectedly with code {code}; it will be restarted for the next job."
+
+    def stop(self):
+        if not self.is_alive():
+            return
+        try:
+            self.send(("shutdown",))
+            self.process.stdin.close()
+            self.process.wait(timeout=SHUTDOWN_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+
+
+# Child side: everything below runs inside `python -m natustem.worker`
+class WorkerChannel:
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.job_id = None
+
+    def send(self, message):
+        with self.lock:
+            write_frame(self.stream, message)
+
+    def log(self, message):
+        self.send(("log", self.job_id, message))
+
+    def progress(self, progress):
+        self.send(("progress", self.job_id, progress))
+
+
+def read_commands(commands, jobs, tokens):
+    # Runs on its own thread so cancel requests arrive while a job is separating
+    while True:
+        message = read_frame(commands)
+        if message is None or message[0] == "shutdown":
+            jobs.put(None)
+            return
+        if message[0] == "cancel":
+            token = tokens.get(message[1])
+            if token is not None:
+                token.cancel(message[2])
+        else:
+            tokens[message[1]] = CancelToken()
+            jobs.put(message)
+
+
+def serve(engine, commands, channel):
+    jobs = queue.Queue()
+    tokens = {}
+    threading.Thread(target=read_commands, args=(commands, jobs, tokens), daemon=True).start()
+    channel.send(("ready", os.getpid()))
+    while True:
+        message = jobs.get()
+        if message is None:
+            return
+        _, job_id, input_path, settings, output_dir = message
+        channel.job_id = job_id
+        try:
+            result = engine.separate(input_path, settings, log=channel.log, cancel_token=tokens[job_id], output_dir=output_dir)
+            channel.send(("done", job_id, result, engine.model_state()))
+        except JobCancelledError as e:
+            channel.send(("cancelled", job_id, e.reason, engine.model_state()))
+        except Exception as e:
+            logger.error(f"Separation failed: {e}", exc_info=True)
+            channel.send(("error", job_id, str(e), engine.model_state()))
+        finally:
+            channel.job_id = None
+            tokens.pop(job_id, None)
+
+
+def setup_child():
+    # Keep the real stdout for messages and point fd 1 at stderr, so stray prints from
+    # the model stack cannot corrupt the message stream
+    channel = WorkerChannel(os.fdopen(os.dup(sys.stdout.fileno()), "wb"))
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    log_handler = GuiLogHandler(channel.log)
+    log_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%H:%M:%S'))
+    root_logger.addHandler(log_handler)
+    try:
+        # Full tracebacks stay in the log file, as in the GUI process
+        file_handler = logging.FileHandler(LOG_FILE_NAME, encoding='utf-8')
+        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        root_logger.addHandler(file_handler)
+    except OSError as e:
+        print(f"Could not initialize file logging: {e}", file=sys.stderr)
+    sys.stderr = StderrTqdmHandler(channel.progress)
+    return channel
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="natustem.worker", description="Separation worker process (started by WorkerProcess).")
+    parser.add_argument("--output", default="output")
+    parser.add_argument("--cache")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_MAX_BYTES)
+    parser.add_argument("--model-memory", type=int, default=DEFAULT_MODEL_MEMORY_BUDGET)
+    parser.add_argument("--metrics")
+    parser.add_argument("--rtf-history")
+    parser.add_argument("--threads", type=int)
+    parser.add_argument("--interop-threads", type=int)
+    parser.add_argument("--cpus", type=lambda value: [int(cpu) for cpu in value.split(",")])
+    parser.add_argument("--model-dir")
+    parser.add_argument("--offline", action="store_true")
+    args = parser.parse_args(argv)
+
+    execution = None
+    if args.threads or args.interop_threads or args.cpus:
+        execution = ExecutionSettings(args.threads, args.interop_threads, args.cpus)
+        # Before anything imports torch
+        apply_execution_settings(execution)
+
+    channel = setup_child()
+    cache = ResultCache(args.cache, max_bytes=args.cache_size) if args.cache else None
+    engine = SeparationEngine(output_root=args.output, cache=cache, model_memory_bytes=args.model_memory,
+                              metrics_path=args.metrics, rtf_history=RtfHistory(args.rtf_history) if args.rtf_history else None,
+                              execution=execution, model_store=ModelStore(args.model_dir, offline=args.offline) if args.model_dir else None)
+    serve(engine, sys.stdin.buffer, channel)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
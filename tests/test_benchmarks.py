@@ -0,0 +1,61 @@
+import sys
+import os
+import json
+import unittest
+import tempfile
+import shutil
+import subprocess
+import wave
+from pathlib import Path
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks import overhead, startup
+from benchmarks.common import compare_results, save_results, write_synthetic_wav
+
+class TestBenchmarks(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_synthetic_wav(self):
+        path = write_synthetic_wav(self.test_dir / "clip.wav", seconds=0.5, sample_rate=8000)
+        with wave.open(str(path), "rb") as f:
+            self.assertEqual((f.getnchannels(), f.getnframes()), (2, 4000))
+
+    def test_overhead_suite_writes_json(self):
+        output = self.test_dir / "overhead.json"
+        self.assertEqual(overhead.main(["--scale", "0.01", "--repeat", "1", "--output", str(output)]), 0)
+        document = json.loads(output.read_text())
+        names = [case["name"] for case in document["results"]]
+        self.assertEqual(names, ["gui_log_handler", "stderr_tqdm_handler", "append_log", "move_outputs", "move_outputs_collisions",
+                                 "batch_sequential", "batch_pipelined"])
+        self.assertIn("python", document["environment"])
+
+    def test_startup_suite_writes_json(self):
+        output = self.test_dir / "startup.json"
+        self.assertEqual(startup.main(["--repeat", "1", "--output", str(output)]), 0)
+        names = [case["name"] for case in json.loads(output.read_text())["results"]]
+        self.assertEqual(names, ["import_gui", "import_audio_stack", "model_ready"])
+
+    def test_gui_import_leaves_out_audio_stack(self):
+        # A bare stand-in for flet is enough: main only uses it once the window is built
+        (self.test_dir / "flet.py").write_text("class Page:\n    pass\n")
+        env = dict(os.environ, PYTHONPATH=str(self.test_dir))
+        completed = subprocess.run([sys.executable, "-c", startup.IMPORT_GUI], cwd=startup.ROOT, env=env,
+                                   capture_output=True, text=True)
+        self.assertEqual(completed.returncode, 0, completed.stderr)
+        self.assertEqual(json.loads(completed.stdout.splitlines()[-1])["heavy_modules"], [])
+
+    def test_compare_flags_slower_cases(self):
+        baseline = {"results": [{"name": "a", "seconds": 1.0}, {"name": "b", "seconds": 1.0}]}
+        current = {"results": [{"name": "a", "seconds": 1.1}, {"name": "b", "seconds": 1.5}, {"name": "c", "seconds": 9.0}]}
+        self.assertEqual(compare_results(baseline, current, threshold=0.2), [("b", 1.0, 1.5)])
+        path = save_results("unit", current["results"], self.test_dir / "r.json")
+        self.assertEqual(json.loads(path.read_text())["benchmark"], "unit")
+
+if __name__ == '__main__':
+    unittest.main()
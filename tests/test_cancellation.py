@@ -0,0 +1,68 @@
+import sys
+import os
+import unittest
+import tempfile
+import shutil
+from pathlib import Path
+from unittest.mock import MagicMock
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from natustem.cancellation import CancelToken, JobCancelledError
+from natustem.engine import SeparationEngine, SeparationSettings
+from natustem.progress import StderrTqdmHandler
+
+class TestEngineCancellation(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.output_root = self.test_dir / "output"
+        self.separator = MagicMock()
+        self.engine = SeparationEngine(output_root=self.output_root, separator_factory=lambda **kwargs: self.separator)
+        self.original_stderr = sys.stderr
+        sys.stderr = StderrTqdmHandler(lambda progress: None)
+        sys.stderr.original_stderr = MagicMock()
+
+    def tearDown(self):
+        sys.stderr = self.original_stderr
+        shutil.rmtree(self.test_dir)
+
+    def test_cancel_during_inference_cleans_up_and_keeps_separator(self):
+        token = CancelToken()
+        song = self.test_dir / "song.mp3"
+        song.touch()
+
+        def interrupted_separate(path):
+            (Path(self.separator.output_dir) / "song_(Vocals)_htdemucs.wav").write_text("partial")
+            token.cancel()
+            for i in range(10):
+                sys.stderr.write(f"\r{i * 10}%|#| {i}/10 [00:01<00:09, 1.00it/s]")
+            self.fail("separate() should have been interrupted at the first progress write")
+        self.separator.separate.side_effect = interrupted_separate
+
+        with self.assertRaises(JobCancelledError):
+            self.engine.separate(song, SeparationSettings("htdemucs.yaml"), cancel_token=token)
+
+        # The partial stem is gone, and with it the output folder the job created
+        self.assertFalse((self.output_root / "song").exists())
+
+        # The persistent Separator and its model are reused for the next job
+        self.separator.separate.side_effect = None
+        self.separator.separate.return_value = []
+        self.engine.separate(song, SeparationSettings("htdemucs.yaml"))
+        self.separator.load_model.assert_called_once()
+
+    def test_cancelled_token_stops_before_loading(self):
+        token = CancelToken()
+        token.cancel()
+        with self.assertRaises(JobCancelledError):
+            self.engine.separate(self.test_dir / "song.mp3", SeparationSettings(), cancel_token=token)
+        self.assertIsNone(self.engine.separator)
+
+    def test_progress_outside_a_job_never_raises(self):
+        token = CancelToken()
+        token.cancel()
+        sys.stderr.write("\r 50%|#| 5/10 [00:05<00:05, 1.00it/s]")
+
+if __name__ == '__main__':
+    unittest.main()
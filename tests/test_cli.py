@@ -0,0 +1,116 @@
+import sys
+import os
+import io
+import json
+import subprocess
+import unittest
+import tempfile
+import shutil
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+# Add repo root to path
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+
+from natustem.cli import main, run_batch
+from natustem.engine import SeparationEngine, SeparationSettings, find_audio_files
+from natustem.tuning import RtfHistory
+
+class TestHeadlessCli(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_cli_does_not_import_flet(self):
+        code = "import sys, natustem.cli, natustem.engine; sys.exit('flet' in sys.modules or 'audio_separator' in sys.modules)"
+        result = subprocess.run([sys.executable, "-c", code], cwd=ROOT)
+        self.assertEqual(result.returncode, 0, "natustem.cli must not import flet or audio_separator at import time")
+
+    def test_find_audio_files_expands_directories(self):
+        input_dir = self.test_dir / "input"
+        input_dir.mkdir()
+        for name in ["b.wav", "a.mp3", "notes.txt", "c.FLAC"]:
+            (input_dir / name).touch()
+
+        files = find_audio_files([input_dir, self.test_dir / "missing.mp3"])
+
+        self.assertEqual([f.name for f in files], ["a.mp3", "b.wav", "c.FLAC"])
+
+    def test_run_batch_writes_output_and_json_timings(self):
+        separator = MagicMock()
+
+        def make_engine(output_root):
+            return SeparationEngine(output_root=output_root, separator_factory=lambda **kwargs: separator)
+
+        def fake_separate(path):
+            name = f"{Path(path).stem}_(Vocals)_htdemucs.wav"
+            (Path(separator.output_dir) / name).write_text("stem")
+            return [name]
+        separator.separate.side_effect = fake_separate
+
+        song = self.test_dir / "song.mp3"
+        song.touch()
+        output_root = self.test_dir / "output"
+
+        stdout = io.StringIO()
+        with patch("sys.stdout", stdout):
+            records = run_batch([song], SeparationSettings("htdemucs.yaml", 1, 0.5), output_root=str(output_root), engine_factory=make_engine)
+
+        self.assertEqual(records[0]["status"], "ok")
+        self.assertTrue((output_root / "song" / "vocal.wav").exists())
+        printed = json.loads(stdout.getvalue().strip())
+        self.assertEqual(printed["files"], ["vocal.wav"])
+        self.assertIn("separate", printed["timings"])
+        self.assertIn("seconds", printed)
+        separator.load_model.assert_called_once_with(model_filename="htdemucs.yaml")
+
+    def test_run_batch_reports_failures(self):
+        def make_engine(output_root):
+            engine = MagicMock()
+            engine.separate.side_effect = RuntimeError("boom")
+            engine.model_state.return_value = {}
+            return engine
+
+        stdout = io.StringIO()
+        with patch("sys.stdout", stdout):
+            records = run_batch([self.test_dir / "a.mp3", self.test_dir / "b.mp3"], SeparationSettings(), workers=2, engine_factory=make_engine)
+
+        self.assertEqual([r["status"] for r in records], ["error", "error"])
+        self.assertEqual(len(stdout.getvalue().strip().splitlines()), 2)
+
+    def test_separate_command_splits_stages_at_progress_bars(self):
+        separator = MagicMock(demucs_params={})
+
+        def fake_separate(path):
+            # Progress bars reach sys.stderr as they would from demucs
+            for i in range(0, 101, 50):
+                sys.stderr.write(f"\r{i}%|#| {i}/100 [00:01<00:01, 9.5seconds/s]")
+            (Path(separator.output_dir) / "song_(Vocals)_htdemucs.wav").write_text("stem")
+            return ["song_(Vocals)_htdemucs.wav"]
+        separator.separate.side_effect = fake_separate
+
+        class FakeEngine(SeparationEngine):
+            def __init__(self, **kwargs):
+                super().__init__(separator_factory=lambda **options: separator, **kwargs)
+
+        song = self.test_dir / "song.mp3"
+        song.touch()
+        metrics_path = self.test_dir / "metrics.jsonl"
+        original_stderr = sys.stderr
+        with patch("natustem.cli.SeparationEngine", FakeEngine), patch("natustem.cli.setup_logging"), \
+                patch("natustem.cli.RtfHistory", lambda: RtfHistory(self.test_dir / "rtf.json")), patch("sys.stdout", io.StringIO()), patch("sys.stderr", io.StringIO()):
+            code = main(["separate", str(song), "-o", str(self.test_dir / "output"), "--no-cache", "--metrics", str(metrics_path),
+                         "--model-dir", str(self.test_dir / "models")])
+            self.assertIsInstance(sys.stderr, io.StringIO)
+        self.assertIs(sys.stderr, original_stderr)
+
+        self.assertEqual(code, 0)
+        [record] = [json.loads(line) for line in metrics_path.read_text().splitlines()]
+        for stage in ("decode", "inference", "write"):
+            self.assertIn(stage, record["stages"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,7 +25,7 @@ from main import AudioSeparatorApp
 class TestCollisionHandling(unittest.TestCase):
     def setUp(self):
         self.test_dir = tempfile.mkdtemp()
-        self.app = AudioSeparatorApp()
+        self.app = AudioSeparatorApp(metrics_path=None)
         # Mock UI elements
         self.app.model_dropdown = MagicMock()
         self.app.model_dropdown.value = "htdemucs_ft.yaml"
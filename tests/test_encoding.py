@@ -0,0 +1,126 @@
+import sys
+import os
+import unittest
+import tempfile
+import shutil
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from natustem.cache import ResultCache
+from natustem.encoding import EncoderPool, OutputFormat, encode_file
+from natustem.engine import SeparationEngine, SeparationSettings
+
+def fake_encode(source, target, output_format):
+    # Stands in for ffmpeg: "encodes" by prefixing the format name
+    target.write_text(output_format.format + ":" + source.read_text())
+    source.unlink()
+
+class TestOutputFormat(unittest.TestCase):
+    def test_formats(self):
+        self.assertFalse(OutputFormat().needs_encoding)
+        self.assertTrue(OutputFormat("wav", 24).needs_encoding)
+        self.assertEqual(OutputFormat("flac", 24).extension, ".flac")
+        self.assertIn("pcm_s24le", OutputFormat("WAV", 24).ffmpeg_args())
+        self.assertIn("libmp3lame", OutputFormat("MP3").ffmpeg_args())
+        self.assertIsNone(OutputFormat("MP3", 24).bit_depth)
+        with self.assertRaises(ValueError):
+            OutputFormat("FLAC", 32)
+        with self.assertRaises(ValueError):
+            OutputFormat("OGG")
+
+    def test_format_does_not_change_cache_key(self):
+        self.assertEqual(SeparationSettings().to_dict(), SeparationSettings(output_format=OutputFormat("FLAC")).to_dict())
+
+class TestBackgroundEncoding(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.output_root = self.test_dir / "output"
+        self.song = self.test_dir / "song.mp3"
+        self.song.write_text("audio")
+        self.pool = EncoderPool()
+
+    def tearDown(self):
+        self.pool.shutdown()
+        shutil.rmtree(self.test_dir)
+
+    def make_engine(self, cache=None):
+        separator = MagicMock()
+        separator.demucs_params = {}
+
+        def fake_separate(path):
+            for stem in ("Vocals", "Drums"):
+                (Path(separator.output_dir) / f"song_({stem})_htdemucs.wav").write_text(stem)
+            return [f"song_({stem})_htdemucs.wav" for stem in ("Vocals", "Drums")]
+        separator.separate.side_effect = fake_separate
+        return SeparationEngine(output_root=self.output_root, separator_factory=lambda **kwargs: separator, cache=cache)
+
+    def test_stems_are_staged_then_encoded(self):
+        engine = self.make_engine()
+        output_format = OutputFormat("FLAC", 24)
+        result = engine.separate(self.song, SeparationSettings("htdemucs.yaml", output_format=output_format))
+
+        self.assertEqual(sorted(result.files), ["drums.flac", "vocal.flac"])
+        self.assertEqual(sorted(result.encodes), ["drums.flac", "vocal.flac"])
+        # The final names are reserved right away
+        self.assertEqual((result.output_dir / "vocal.flac").stat().st_size, 0)
+
+        finished = []
+        with patch("natustem.encoding.encode_file", side_effect=fake_encode):
+            batch = self.pool.submit(result, output_format, log=lambda message: None)
+            batch.add_done_callback(finished.append)
+            self.assertEqual(batch.wait(), [])
+
+        self.assertEqual(finished, [batch])
+        self.assertEqual((result.output_dir / "vocal.flac").read_text(), "FLAC:Vocals")
+        self.assertEqual(sorted(p.name for p in result.output_dir.iterdir()), ["drums.flac", "vocal.flac"])
+
+    def test_second_job_does_not_take_pending_names(self):
+        engine = self.make_engine()
+        settings = SeparationSettings("htdemucs.yaml", output_format=OutputFormat("MP3"))
+        first = engine.separate(self.song, settings)
+        second = engine.separate(self.song, settings)
+        self.assertEqual(sorted(first.files), ["drums.mp3", "vocal.mp3"])
+        self.assertEqual(sorted(second.files), ["drums_1.mp3", "vocal_1.mp3"])
+
+    def test_cache_keeps_wav_and_restores_into_any_format(self):
+        cache = ResultCache(self.output_root / ".cache")
+        engine = self.make_engine(cache=cache)
+        engine.separate(self.song, SeparationSettings("htdemucs.yaml", output_format=OutputFormat("FLAC")))
+        result = engine.separate(self.song, SeparationSettings("htdemucs.yaml", output_format=OutputFormat("MP3")))
+
+        self.assertTrue(result.cached)
+        self.assertEqual(sorted(result.files), ["drums.mp3", "vocal.mp3"])
+        self.assertEqual(sorted(Path(p).read_text() for p in result.encodes.values()), ["Drums", "Vocals"])
+
+    def test_failed_encode_keeps_wav(self):
+        engine = self.make_engine()
+        output_format = OutputFormat("FLAC")
+        result = engine.separate(self.song, SeparationSettings("htdemucs.yaml", output_format=output_format))
+
+        with patch("natustem.encoding.encode_file", side_effect=RuntimeError("ffmpeg missing")):
+            errors = self.pool.submit(result, output_format, log=lambda message: None).wait()
+
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(sorted(p.name for p in result.output_dir.iterdir()), ["drums.wav", "vocal.wav"])
+
+    def test_encode_file_renames_partial_output(self):
+        source = self.test_dir / "vocal.wav"
+        source.write_text("pcm")
+        target = self.test_dir / "vocal.flac"
+        commands = []
+
+        def fake_run(command, **kwargs):
+            commands.append(command)
+            Path(command[-1]).write_text("flac")
+        with patch("natustem.encoding.shutil.which", return_value="ffmpeg"), patch("natustem.encoding.subprocess.run", side_effect=fake_run):
+            encode_file(source, target, OutputFormat("FLAC"))
+
+        self.assertTrue(commands[0][-1].endswith("vocal.flac.part"))
+        self.assertEqual(target.read_text(), "flac")
+        self.assertFalse(source.exists())
+
+if __name__ == '__main__':
+    unittest.main()
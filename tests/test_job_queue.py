@@ -0,0 +1,207 @@
+import sys
+import os
+from unittest.mock import MagicMock, patch
+import unittest
+import tempfile
+import shutil
+import wave
+from pathlib import Path
+
+# Mock dependencies compatible with other tests
+mock_flet = MagicMock()
+mock_flet.Colors.WHITE = "white"
+mock_flet.Colors.GREY_400 = "grey400"
+sys.modules["flet"] = mock_flet
+
+mock_as = MagicMock()
+sys.modules["audio_separator"] = mock_as
+sys.modules["audio_separator.separator"] = mock_as.separator
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from main import AudioSeparatorApp, SeparationJob
+from natustem.cancellation import PREEMPTED, CancelToken
+from natustem.constants import DEFAULT_MODEL
+from natustem.progress import StderrTqdmHandler
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.test_dir)
+
+        self.app = AudioSeparatorApp(metrics_path=None)
+        self.app.page = MagicMock()
+        self.app.model_dropdown = MagicMock()
+        self.app.shifts_slider = MagicMock()
+        self.app.shifts_slider.value = 1
+        self.app.overlap_slider = MagicMock()
+        self.app.overlap_slider.value = 0.25
+        self.app.append_log = MagicMock()
+        self.app.update_status = MagicMock()
+        self.app.queue_view = MagicMock()
+        self.app.queue_summary_text = MagicMock()
+        self.app.progress_bar = MagicMock()
+        self.app.cancel_btn = MagicMock()
+        self.app.status_text = MagicMock()
+        self.app.log_output = MagicMock()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.test_dir)
+
+    def queue(self, name, model):
+        self.app.model_dropdown.value = model
+        path = Path(self.test_dir) / name
+        path.touch()
+        return self.app.create_job(str(path))
+
+    def test_pick_multiple_files(self):
+        files = [MagicMock(path="/music/a.mp3"), MagicMock(path="/music/b.flac")]
+        self.app.file_path_text = MagicMock()
+        self.app.separate_btn = MagicMock()
+
+        self.app.pick_files_result(files)
+
+        self.assertEqual(self.app.audio_file_paths, ["/music/a.mp3", "/music/b.flac"])
+        self.assertEqual(self.app.file_path_text.value, "2 files selected")
+        self.assertIs(self.app.separate_btn.disabled, False)
+
+    def test_next_job_prefers_loaded_model(self):
+        a = self.queue("a.mp3", "htdemucs.yaml")
+        b = self.queue("b.mp3", "htdemucs_6s.yaml")
+        c = self.queue("c.mp3", "htdemucs.yaml")
+        self.assertTrue(self.app.enqueue_jobs([a, b, c]))
+        self.assertFalse(self.app.enqueue_jobs([]), "A running queue must not start a second worker")
+
+        self.app.engine.loaded_model_name = "htdemucs.yaml"
+        self.assertIs(self.app.next_job(), a)
+        self.assertIs(self.app.next_job(), c)
+        self.assertIs(self.app.next_job(), b)
+        self.assertIsNone(self.app.next_job())
+        self.assertFalse(self.app.is_separating)
+
+    def test_preempt_and_cancel_pending_jobs(self):
+        a = self.queue("a.mp3", "htdemucs.yaml")
+        b = self.queue("b.mp3", "htdemucs.yaml")
+        c = self.queue("c.mp3", "htdemucs.yaml")
+        self.app.enqueue_jobs([a, b, c])
+
+        running = self.app.next_job()
+        running.cancel_token = CancelToken()
+        self.app.current_job = running
+
+        self.app.preempt_job(c)
+        self.assertTrue(running.cancel_token.cancelled)
+        self.assertEqual(running.cancel_token.reason, PREEMPTED)
+
+        self.app.cancel_job(b)
+        self.assertEqual(b.status, SeparationJob.CANCELLED)
+        self.assertIs(self.app.next_job(), c)
+        self.assertIsNone(self.app.next_job())
+
+    @patch('main.Separator')
+    def test_preempted_job_is_requeued_after_urgent_job(self, MockSeparator):
+        separator_instance = MockSeparator.return_value
+        long_job = self.queue("long.mp3", "htdemucs.yaml")
+        urgent_job = self.queue("urgent.mp3", "htdemucs.yaml")
+        order = []
+
+        def fake_separate(path):
+            order.append(Path(path).name)
+            if len(order) == 1:
+                self.app.preempt_job(urgent_job)
+                sys.stderr.write("\r 10%|#| 1/10 [00:01<00:09, 1.00it/s]")
+            return []
+        separator_instance.separate.side_effect = fake_separate
+
+        original_stderr = sys.stderr
+        sys.stderr = StderrTqdmHandler(lambda progress: None)
+        try:
+            self.app.enqueue_jobs([long_job, urgent_job])
+            self.app.run_queue()
+        finally:
+            sys.stderr = original_stderr
+
+        self.assertEqual(order, ["long.mp3", "urgent.mp3", "long.mp3"])
+        self.assertEqual(long_job.status, SeparationJob.DONE)
+        self.assertEqual(urgent_job.status, SeparationJob.DONE)
+
+    @patch('main.Separator')
+    def test_run_queue_loads_each_model_once(self, MockSeparator):
+        separator_instance = MockSeparator.return_value
+        separator_instance.separate.return_value = []
+
+        jobs = [
+            self.queue("a.mp3", "htdemucs.yaml"),
+            self.queue("b.mp3", "htdemucs_6s.yaml"),
+            self.queue("c.mp3", "htdemucs.yaml"),
+            self.queue("d.mp3", "htdemucs_6s.yaml"),
+        ]
+        self.app.enqueue_jobs(jobs)
+        self.app.run_queue()
+
+        # One Separator per model; both stay resident in the model cache
+        self.assertEqual(MockSeparator.call_count, 2)
+        loaded = [call.kwargs["model_filename"] for call in separator_instance.load_model.call_args_list]
+        self.assertEqual(loaded, ["htdemucs.yaml", "htdemucs_6s.yaml"])
+        self.assertEqual([job.status for job in jobs], [SeparationJob.DONE] * 4)
+        self.assertFalse(self.app.is_separating)
+
+    @patch('main.Separator')
+    def test_warmup_preloads_default_model_for_first_job(self, MockSeparator):
+        separator_instance = MockSeparator.return_value
+        separator_instance.separate.return_value = []
+        self.app.model_status_text = MagicMock()
+
+        self.app.start_warmup()
+        job = self.queue("a.mp3", DEFAULT_MODEL)
+        self.app.enqueue_jobs([job])
+        self.app.run_queue()
+
+        self.assertTrue(self.app.warmup_done.is_set())
+        self.assertIn("model_ready", self.app.startup_times)
+        # The job runs on the preloaded Separator
+        self.assertEqual(MockSeparator.call_count, 1)
+        separator_instance.load_model.assert_called_once_with(model_filename=DEFAULT_MODEL)
+        self.assertEqual(job.status, SeparationJob.DONE)
+        self.assertTrue(self.app.model_status_text.value.startswith("Model ready"))
+
+    @patch('main.Separator')
+    def test_preview_then_full_render(self, MockSeparator):
+        separator_instance = MockSeparator.return_value
+        separator_instance.separate.return_value = []
+        self.app.start_queue_worker = MagicMock()
+        self.app.render_full_btn = MagicMock()
+        self.app.preview_start_field = MagicMock(value="0:05")
+        self.app.preview_length_dropdown = MagicMock(value="20")
+        self.app.model_dropdown.value = "htdemucs.yaml"
+        song = Path(self.test_dir) / "song.wav"
+        with wave.open(str(song), "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(1000)
+            f.writeframes(b"\0\0" * 40000)
+        self.app.audio_file_path = str(song)
+
+        self.app.preview_click(None)
+        self.app.run_queue()
+
+        preview = self.app.jobs[0]
+        self.assertEqual((preview.preview, preview.settings.shifts, preview.status), ((5.0, 20.0), 0, SeparationJob.DONE))
+        self.assertIs(self.app.last_preview, preview)
+        self.assertIs(self.app.render_full_btn.disabled, False)
+        self.assertTrue(Path(self.test_dir, "preview", "song").is_dir())
+
+        self.app.render_full_click(None)
+        self.app.run_queue()
+        full = self.app.jobs[1]
+        self.assertIsNone(full.preview)
+        self.assertEqual((full.settings.shifts, full.settings.overlap), (1, 0.25))
+        self.assertEqual(full.status, SeparationJob.DONE)
+        # One Separator for both
+        self.assertEqual(MockSeparator.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import sys
+import os
+import io
+import json
+import multiprocessing
+import unittest
+import tempfile
+import shutil
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from natustem.cli import run_store
+from natustem.encoding import OutputFormat
+from natustem.engine import SeparationEngine, SeparationSettings
+from natustem.jobstore import JobStore, process_owner, settings_from_json, settings_to_json
+
+def fake_encode(source, target, output_format):
+    # Stands in for ffmpeg
+    target.write_text(output_format.format + ":" + source.read_text())
+    source.unlink()
+
+def claim_all(path, queue):
+    # Runs in a child process: claims jobs until the store is empty
+    store = JobStore(path)
+    claimed = []
+    while True:
+        job = store.claim()
+        if job is None:
+            break
+        claimed.append(job.id)
+    queue.put(claimed)
+
+class TestJobStore(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.path = self.test_dir / "output" / ".jobs.sqlite3"
+        self.store = JobStore(self.path)
+        self.settings = SeparationSettings("htdemucs.yaml", 1, 0.5, output_format=OutputFormat("FLAC", 24), stems=["vocals"])
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_settings_round_trip(self):
+        restored = settings_from_json(settings_to_json(self.settings))
+        self.assertEqual(repr(restored), repr(self.settings))
+        self.assertEqual(restored.output_format, OutputFormat("FLAC", 24))
+
+    def test_same_input_and_settings_reuse_the_job(self):
+        job, added = self.store.add(self.test_dir / "a.mp3", self.settings)
+        self.assertTrue(added)
+        again, added = self.store.add(self.test_dir / "a.mp3", self.settings)
+        self.assertEqual((again.id, added), (job.id, False))
+        # Other settings are another job; a failed job is retried by adding it again
+        self.assertTrue(self.store.add(self.test_dir / "a.mp3", SeparationSettings("htdemucs.yaml"))[1])
+        self.assertTrue(self.store.start(job.id))
+        self.store.fail(job.id, "boom")
+        retried, added = self.store.add(self.test_dir / "a.mp3", self.settings)
+        self.assertTrue(added)
+        self.assertNotEqual(retried.id, job.id)
+
+    def test_claim_prefers_loaded_model_and_never_twice(self):
+        first, _ = self.store.add(self.test_dir / "a.mp3", SeparationSettings("htdemucs_ft.yaml"))
+        second, _ = self.store.add(self.test_dir / "b.mp3", self.settings)
+        self.assertEqual(self.store.claim(prefer_models=["htdemucs.yaml"]).id, second.id)
+        self.assertEqual(self.store.claim().id, first.id)
+        self.assertIsNone(self.store.claim())
+        self.assertFalse(self.store.start(first.id))
+
+    def test_processes_claim_each_job_once(self):
+        for i in range(40):
+            self.store.add(self.test_dir / f"{i}.mp3", self.settings)
+        queue = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=claim_all, args=(self.path, queue)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        claimed = [job_id for _ in processes for job_id in queue.get(timeout=30)]
+        for process in processes:
+            process.join()
+        self.assertEqual(sorted(claimed), [job.id for job in self.store.jobs()])
+
+    def test_recover_requeues_jobs_of_dead_processes(self):
+        output_dir = self.test_dir / "output" / "a"
+        output_dir.mkdir(parents=True)
+        (output_dir / "vocal.flac").touch()  # Reserved, never encoded
+        job, _ = self.store.add(self.test_dir / "a.mp3", self.settings)
+        alive, _ = self.store.add(self.test_dir / "b.mp3", self.settings)
+        dead = JobStore(self.path, owner=process_owner(pid=2 ** 22 + 12345))
+        self.assertTrue(dead.start(job.id))
+        dead.update(job.id, "encoding", output_dir=output_dir, files=["vocal.flac"])
+        self.assertTrue(self.store.start(alive.id))
+        dead.close()
+
+        self.assertEqual(self.store.recover(), [job.id])
+        self.assertEqual(self.store.get(job.id).state, "pending")
+        self.assertEqual(self.store.get(alive.id).state, "running")
+        self.assertFalse((output_dir / "vocal.flac").exists())
+
+class TestRunStore(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.separator = MagicMock(demucs_params={})
+
+        def fake_separate(path):
+            names = [f"{Path(path).stem}_({stem})_htdemucs.wav" for stem in ("Vocals", "Drums")[:self.stem_count]]
+            for name in names:
+                (Path(self.separator.output_dir) / name).write_text("stem")
+            return names
+        self.separator.separate.side_effect = fake_separate
+        self.stem_count = 1
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def make_engine(self, output_root):
+        return SeparationEngine(output_root=output_root, separator_factory=lambda **kwargs: self.separator)
+
+    def test_rerun_skips_finished_files(self):
+        separator, make_engine = self.separator, self.make_engine
+
+        songs = [self.test_dir / "a.mp3", self.test_dir / "b.mp3"]
+        for song in songs:
+            song.touch()
+        output_root = self.test_dir / "output"
+        store = JobStore(output_root / ".jobs.sqlite3")
+        settings = SeparationSettings("htdemucs.yaml", 1, 0.5)
+
+        with patch("sys.stdout", io.StringIO()):
+            first = run_store(store, songs[:1], settings, output_root=output_root, engine_factory=make_engine)
+            second = run_store(store, songs, settings, output_root=output_root, engine_factory=make_engine, workers=2)
+
+        self.assertEqual([r["input"] for r in first], [str(songs[0].resolve())])
+        self.assertEqual([r["input"] for r in second], [str(songs[1].resolve())])
+        self.assertEqual(separator.separate.call_count, 2)
+        jobs = store.jobs()
+        self.assertEqual([job.state for job in jobs], ["done", "done"])
+        self.assertEqual(jobs[0].files, ["vocal.wav"])
+        store.close()
+
+    def test_crash_while_encoding_leaves_no_duplicates(self):
+        self.stem_count = 2
+        song = self.test_dir / "song.mp3"
+        song.touch()
+        output_root = self.test_dir / "output"
+        settings = SeparationSettings("htdemucs.yaml", output_format=OutputFormat("FLAC"))
+        store = JobStore(output_root / ".jobs.sqlite3")
+        job, _ = store.add(song, settings)
+
+        # A process that died after encoding vocal.flac, with drums.flac still a placeholder
+        dead = JobStore(store.path, owner=process_owner(pid=2 ** 22 + 12345))
+        self.assertTrue(dead.start(job.id))
+        result = self.make_engine(output_root).separate(song, settings)
+        dead.separated(job.id, result)
+        fake_encode(Path(result.encodes["vocal.flac"]), result.output_dir / "vocal.flac", settings.output_format)
+        dead.close()
+        self.assertEqual(store.get(job.id).encodes, result.encodes)
+
+        with patch("natustem.encoding.encode_file", side_effect=fake_encode), patch("sys.stdout", io.StringIO()):
+            records = run_store(store, [song], settings, output_root=output_root, engine_factory=self.make_engine)
+
+        self.assertEqual([r["status"] for r in records], ["ok"])
+        self.assertEqual(self.separator.separate.call_count, 2)
+        self.assertEqual(sorted(p.name for p in result.output_dir.iterdir()), ["drums.flac", "vocal.flac"])
+        self.assertEqual(store.get(job.id).state, "done")
+        store.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import sys
+import os
+import json
+import unittest
+import tempfile
+import shutil
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from natustem.engine import SeparationEngine, SeparationSettings
+from natustem.memory import DEFAULT_SEGMENT, estimate_bytes, is_out_of_memory, parse_segment_size, plan_memory
+from natustem.resources import available_memory, cgroup_available_memory
+
+GB = 1024 ** 3
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+class TestAvailableMemory(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_cgroup_v2_headroom_excludes_reclaimable_cache(self):
+        write(self.test_dir / "memory.max", f"{4 * GB}\n")
+        write(self.test_dir / "memory.current", f"{3 * GB}\n")
+        write(self.test_dir / "memory.stat", f"anon {2 * GB}\ninactive_file {GB}\n")
+        self.assertEqual(cgroup_available_memory(self.test_dir), 2 * GB)
+        write(self.test_dir / "memory.max", "max\n")
+        self.assertIsNone(cgroup_available_memory(self.test_dir))
+
+    def test_cgroup_v1_and_unlimited(self):
+        write(self.test_dir / "memory" / "memory.limit_in_bytes", f"{2 * GB}\n")
+        write(self.test_dir / "memory" / "memory.usage_in_bytes", f"{GB}\n")
+        self.assertEqual(cgroup_available_memory(self.test_dir), GB)
+        write(self.test_dir / "memory" / "memory.limit_in_bytes", "9223372036854771712\n")
+        self.assertIsNone(cgroup_available_memory(self.test_dir))
+
+    def test_smallest_of_host_and_cgroup(self):
+        meminfo = self.test_dir / "meminfo"
+        write(meminfo, f"MemTotal: {16 * 1024 ** 2} kB\nMemAvailable: {8 * 1024 ** 2} kB\n")
+        with patch.dict(sys.modules, {"psutil": None}):
+            self.assertEqual(available_memory(meminfo, self.test_dir), 8 * GB)
+            write(self.test_dir / "memory.max", f"{4 * GB}\n")
+            write(self.test_dir / "memory.current", f"{3 * GB}\n")
+            self.assertEqual(available_memory(meminfo, self.test_dir), GB)
+            self.assertIsNone(available_memory(self.test_dir / "missing", self.test_dir / "missing"))
+
+class TestMemoryPlan(unittest.TestCase):
+    def test_whole_file_with_the_model_segment_when_memory_is_plentiful(self):
+        plan = plan_memory("htdemucs.yaml", 240, 16 * GB)
+        self.assertEqual((plan.segment_size, plan.chunk_seconds), (DEFAULT_SEGMENT, None))
+        self.assertTrue(plan.fits)
+        self.assertIn("model default segment, whole file", plan.describe())
+
+    def test_shorter_segments_before_streaming(self):
+        needed = estimate_bytes("htdemucs.yaml", 240, 4)
+        plan = plan_memory("htdemucs.yaml", 240, int(needed / 0.8))
+        self.assertEqual((plan.segment_size, plan.chunk_seconds), (4, None))
+        # Out of memory anyway: 2 s segments, then streaming windows
+        smaller = plan.fallback()
+        self.assertEqual((smaller.segment_size, smaller.chunk_seconds), (2, None))
+        self.assertEqual((smaller.fallback().segment_size, smaller.fallback().chunk_seconds), (DEFAULT_SEGMENT, 120))
+
+    def test_long_input_streams(self):
+        plan = plan_memory("htdemucs_6s.yaml", 3 * 3600, 3 * GB)
+        self.assertEqual((plan.segment_size, plan.chunk_seconds), (DEFAULT_SEGMENT, 120))
+        self.assertLess(plan.estimated_bytes, estimate_bytes("htdemucs_6s.yaml", 3 * 3600))
+        # Without a way to read the input window by window, only segments can shrink
+        plan = plan_memory("htdemucs_6s.yaml", 3 * 3600, 3 * GB, can_stream=False)
+        self.assertEqual((plan.segment_size, plan.chunk_seconds), (2, None))
+        self.assertFalse(plan.fits)
+        self.assertIsNone(plan.fallback())
+
+    def test_job_settings_are_respected(self):
+        plan = plan_memory("htdemucs.yaml", 3 * 3600, 2 * GB, segment_size=DEFAULT_SEGMENT, chunk_seconds=60)
+        self.assertEqual((plan.segment_size, plan.chunk_seconds), (DEFAULT_SEGMENT, 60))
+        self.assertEqual([(p.segment_size, p.chunk_seconds) for p in plan.fallbacks], [(DEFAULT_SEGMENT, 30)])
+        # Unknown memory: the model's defaults
+        plan = plan_memory("htdemucs.yaml", None, None)
+        self.assertEqual((plan.segment_size, plan.chunk_seconds), (DEFAULT_SEGMENT, None))
+        self.assertIn("unknown available", plan.describe())
+
+    def test_parse_segment_size(self):
+        self.assertEqual([parse_segment_size(v) for v in (None, "auto", "default", "6", 4)], [None, None, DEFAULT_SEGMENT, 6, 4])
+        with self.assertRaises(ValueError):
+            parse_segment_size("0")
+        self.assertNotIn("segment_size", SeparationSettings("htdemucs.yaml").to_dict())
+        self.assertEqual(SeparationSettings("htdemucs.yaml", segment_size="4").to_dict()["segment_size"], 4)
+
+    def test_out_of_memory_errors(self):
+        self.assertTrue(is_out_of_memory(MemoryError()))
+        self.assertTrue(is_out_of_memory(RuntimeError("[enforce fail at alloc_cpu.cpp:114] DefaultCPUAllocator: can't allocate memory")))
+        self.assertFalse(is_out_of_memory(RuntimeError("boom")))
+
+class TestEngineMemoryPlan(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.song = self.test_dir / "song.mp3"
+        self.song.touch()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_falls_back_to_smaller_segments_when_memory_runs_out(self):
+        separator = MagicMock(demucs_params={})
+        segments = []
+
+        def fake_separate(path):
+            segments.append(separator.demucs_params["segment_size"])
+            # Each attempt writes a partial stem before failing
+            (Path(separator.output_dir) / "song_(Vocals)_htdemucs.wav").write_text(str(len(segments)))
+            if len(segments) < 3:
+                raise RuntimeError("DefaultCPUAllocator: can't allocate memory: you tried to allocate 2147483648 bytes.")
+            return ["song_(Vocals)_htdemucs.wav"]
+        separator.separate.side_effect = fake_separate
+        metrics_path = self.test_dir / "metrics.jsonl"
+        engine = SeparationEngine(output_root=self.test_dir / "output", separator_factory=lambda **kwargs: separator,
+                                  metrics_path=metrics_path, memory_probe=lambda: 16 * GB)
+        log = []
+
+        result = engine.separate(self.song, SeparationSettings("htdemucs.yaml"), log=log.append)
+
+        self.assertEqual(segments, [DEFAULT_SEGMENT, 6, 4])
+        self.assertEqual(result.files, ["vocal.wav"])
+        self.assertEqual((result.output_dir / "vocal.wav").read_text(), "3")
+        self.assertEqual(sum("retrying with a smaller plan" in line for line in log), 2)
+        self.assertTrue(any(line.startswith("Memory: estimated") for line in log))
+        [record] = [json.loads(line) for line in metrics_path.read_text().splitlines()]
+        self.assertEqual(record["memory_plan"]["segment_size"], 4)
+
+    def test_other_errors_are_not_retried(self):
+        separator = MagicMock(demucs_params={})
+        separator.separate.side_effect = RuntimeError("boom")
+        engine = SeparationEngine(output_root=self.test_dir / "output", separator_factory=lambda **kwargs: separator)
+        with self.assertRaises(RuntimeError):
+            engine.separate(self.song, SeparationSettings("htdemucs.yaml"))
+        self.assertEqual(separator.separate.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
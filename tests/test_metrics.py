@@ -0,0 +1,71 @@
+import sys
+import os
+import json
+import unittest
+import tempfile
+import shutil
+from pathlib import Path
+from unittest.mock import MagicMock
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from natustem.engine import SeparationEngine, SeparationSettings
+from natustem.metrics import ProgressMarks, describe
+from natustem.progress import StderrTqdmHandler
+
+class TestJobMetrics(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.metrics_path = self.test_dir / "audio_separator.metrics.jsonl"
+        self.separator = MagicMock(demucs_params={})
+        self.engine = SeparationEngine(output_root=self.test_dir / "output", separator_factory=lambda **kwargs: self.separator,
+                                       metrics_path=self.metrics_path)
+        self.song = self.test_dir / "song.mp3"
+        self.song.touch()
+        self.original_stderr = sys.stderr
+        sys.stderr = StderrTqdmHandler(lambda progress: None)
+        sys.stderr.original_stderr = MagicMock()
+
+    def tearDown(self):
+        sys.stderr = self.original_stderr
+        shutil.rmtree(self.test_dir)
+
+    def records(self):
+        return [json.loads(line) for line in self.metrics_path.read_text().splitlines()]
+
+    def test_stages_split_at_progress_bars(self):
+        def separate(path):
+            for i in range(0, 101, 50):
+                sys.stderr.write(f"\r{i}%|#| {i}/100 [00:01<00:01, 9.5seconds/s]")
+            (Path(self.separator.output_dir) / "song_(Vocals)_htdemucs.wav").write_text("stem")
+            return ["song_(Vocals)_htdemucs.wav"]
+        self.separator.separate.side_effect = separate
+
+        result = self.engine.separate(self.song, SeparationSettings("htdemucs.yaml"))
+
+        for stage in ("init", "load_model", "decode", "inference", "write", "separate", "move", "total"):
+            self.assertIn(stage, result.timings)
+        self.assertAlmostEqual(result.timings["decode"] + result.timings["inference"] + result.timings["write"],
+                               result.timings["separate"], places=6)
+        self.assertIn("cpu_percent", result.resources)
+        [record] = self.records()
+        self.assertEqual(record["status"], "ok")
+        self.assertEqual(record["settings"]["model_name"], "htdemucs.yaml")
+        self.assertIn("inference", record["stages"])
+        self.assertIn("Stages: Separator init", describe(result.timings, result.resources))
+
+    def test_failed_job_is_recorded_with_partial_stages(self):
+        self.separator.separate.side_effect = RuntimeError("boom")
+        with self.assertRaises(RuntimeError):
+            self.engine.separate(self.song, SeparationSettings("htdemucs.yaml"))
+        [record] = self.records()
+        self.assertEqual((record["status"], record["error"]), ("error", "boom"))
+        self.assertIn("load_model", record["stages"])
+        self.assertIn("separate", record["stages"])
+
+    def test_marks_without_progress(self):
+        self.assertEqual(ProgressMarks().split(0.0, 1.0), {})
+
+if __name__ == '__main__':
+    unittest.main()
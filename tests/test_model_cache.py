@@ -0,0 +1,89 @@
+import sys
+import os
+import unittest
+import tempfile
+import shutil
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from natustem.engine import SeparationEngine, SeparationSettings
+from natustem.models import ModelCache, describe_stats
+
+MB = 1024 ** 2
+
+class TestModelCache(unittest.TestCase):
+    def setUp(self):
+        self.built = []
+
+    def build(self):
+        separator = MagicMock()
+        self.built.append(separator)
+        return separator
+
+    def test_hits_and_misses(self):
+        cache = ModelCache(self.build, budget_bytes=1000 * MB)
+        with patch("natustem.models.current_rss", return_value=None):
+            first, timings = cache.acquire("htdemucs.yaml")
+            again, again_timings = cache.acquire("htdemucs.yaml")
+
+        self.assertIs(first, again)
+        self.assertIn("load_model", timings)
+        self.assertEqual(again_timings, {})
+        first.load_model.assert_called_once_with(model_filename="htdemucs.yaml")
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["evictions"]), (1, 1, 0))
+        self.assertEqual(len(stats["load_seconds"]["htdemucs.yaml"]), 1)
+        self.assertIn("1 hits, 1 misses", describe_stats(stats))
+
+    def test_evicts_least_recently_used_within_budget(self):
+        cache = ModelCache(self.build, budget_bytes=800 * MB)
+        # Every load grows the process by 300 MB
+        rss = iter(range(0, 10000 * MB, 300 * MB))
+        with patch("natustem.models.current_rss", side_effect=lambda: next(rss)):
+            cache.acquire("htdemucs.yaml")   # rss 0 -> 300
+            cache.acquire("htdemucs_6s.yaml")  # rss 600 -> 900
+            cache.acquire("htdemucs.yaml")   # hit, now most recently used
+            cache.acquire("hdemucs_mmi.yaml")  # over budget: evicts htdemucs_6s
+
+        self.assertEqual(cache.resident_models(), ["htdemucs.yaml", "hdemucs_mmi.yaml"])
+        self.assertEqual(cache.evictions, 1)
+        self.assertLessEqual(cache.resident_bytes(), 800 * MB)
+
+    def test_current_model_is_never_evicted(self):
+        cache = ModelCache(self.build, budget_bytes=100 * MB)
+        with patch("natustem.models.current_rss", return_value=None):
+            cache.acquire("htdemucs.yaml")
+            cache.acquire("htdemucs_ft.yaml")
+        # Each estimate exceeds the budget on its own; only the model in use stays
+        self.assertEqual(cache.resident_models(), ["htdemucs_ft.yaml"])
+
+class TestEngineModelSwitching(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.factory = MagicMock()
+        self.factory.side_effect = lambda **kwargs: MagicMock(demucs_params={})
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_switching_models_reuses_resident_separators(self):
+        engine = SeparationEngine(output_root=self.test_dir / "output", separator_factory=self.factory)
+        song = self.test_dir / "song.mp3"
+        song.touch()
+        for model in ["htdemucs.yaml", "htdemucs_6s.yaml", "htdemucs.yaml", "htdemucs_6s.yaml"]:
+            engine.separator = None
+            result = engine.separate(song, SeparationSettings(model, shifts=3))
+            self.assertEqual(engine.loaded_model_name, model)
+            self.assertEqual(engine.separator.demucs_params["shifts"], 3)
+
+        self.assertEqual(self.factory.call_count, 2)
+        self.assertNotIn("load_model", result.timings)
+        state = engine.model_state()
+        self.assertEqual(state["resident_models"], ["htdemucs.yaml", "htdemucs_6s.yaml"])
+        self.assertEqual((state["model_cache"]["hits"], state["model_cache"]["misses"]), (2, 2))
+
+if __name__ == '__main__':
+    unittest.main()
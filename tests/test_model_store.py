@@ -0,0 +1,151 @@
+import sys
+import os
+import io
+import hashlib
+import types
+import unittest
+import tempfile
+import shutil
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from natustem.engine import SeparationEngine, SeparationSettings
+from natustem.model_store import (INDEX_FILE_NAME, MANIFEST_FILE_NAME, ModelStore, ModelStoreError, model_file_urls,
+                                  skip_verified_checksums)
+
+CHECKPOINT = b"checkpoint weights" * 1000
+CHECKPOINT_NAME = f"0a1b2c3d-{hashlib.sha256(CHECKPOINT).hexdigest()[:8]}.th"
+CONTENT = {
+    INDEX_FILE_NAME: b'{"demucs_download_list": {}}',
+    CHECKPOINT_NAME: CHECKPOINT,
+    "fake.yaml": b"models: ['0a1b2c3d']\n",
+}
+MODEL_FILES = {"fake.yaml": (f"https://example.invalid/{CHECKPOINT_NAME}", "https://example.invalid/fake.yaml")}
+
+class TestModelStore(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        patcher = patch("natustem.model_store.MODEL_FILES", MODEL_FILES)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.downloads = []
+        self.content = dict(CONTENT)
+
+        def opener(url):
+            name = url.rsplit("/", 1)[-1]
+            self.downloads.append(name)
+            return io.BytesIO(self.content[name])
+        self.store = ModelStore(self.test_dir / "models", opener=opener)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_fetch_verifies_and_records_every_file(self):
+        self.assertEqual(self.store.status(), {"fake.yaml": {name: "missing" for name in model_file_urls("fake.yaml")}})
+        self.assertEqual(sorted(self.store.fetch()), sorted(CONTENT))
+        self.assertEqual(set(self.store.status()["fake.yaml"].values()), {"ok"})
+        self.assertTrue((self.store.root / MANIFEST_FILE_NAME).exists())
+        # Nothing to do the second time, also for a fresh store reading the manifest
+        self.assertEqual(ModelStore(self.store.root, opener=None).fetch(), [])
+
+    def test_corrupt_download_is_rejected(self):
+        self.content[CHECKPOINT_NAME] = b"truncated"
+        with self.assertRaises(ModelStoreError):
+            self.store.fetch()
+        self.assertFalse((self.store.root / CHECKPOINT_NAME).exists())
+        self.assertEqual([p.name for p in self.store.root.iterdir() if p.name.endswith(".part")], [])
+
+    def test_ensure_trusts_unchanged_files_and_rechecks_changed_ones(self):
+        self.store.fetch()
+        with patch("natustem.model_store.file_sha256", side_effect=AssertionError("re-hashed")):
+            self.assertEqual(ModelStore(self.store.root).ensure("fake.yaml"), [])
+            self.assertTrue(self.store.is_trusted(self.store.root / CHECKPOINT_NAME, CHECKPOINT_NAME[9:17]))
+
+        (self.store.root / CHECKPOINT_NAME).write_bytes(CHECKPOINT[:100])
+        log = []
+        offline = ModelStore(self.store.root, offline=True)
+        self.assertFalse(offline.is_trusted(self.store.root / CHECKPOINT_NAME))
+        with self.assertRaises(ModelStoreError) as raised:
+            offline.ensure("fake.yaml", log=log.append)
+        self.assertIn("models import", str(raised.exception))
+        self.assertTrue(any("is corrupt" in line for line in log))
+        self.assertFalse((self.store.root / CHECKPOINT_NAME).exists())
+        # Models outside the catalog are left to load_model()
+        self.assertEqual(offline.ensure("other.onnx"), [])
+
+    def test_export_and_import_without_network(self):
+        self.store.fetch()
+        for archive_name in ("models.tar", "models.zip"):
+            archive = self.test_dir / archive_name
+            self.store.export(archive)
+            target = ModelStore(self.test_dir / archive_name.replace(".", "-"), offline=True, opener=None)
+            self.assertEqual(sorted(target.import_from(archive)), sorted(CONTENT))
+            self.assertEqual(target.ensure("fake.yaml"), [])
+            self.assertEqual((target.root / CHECKPOINT_NAME).read_bytes(), CHECKPOINT)
+
+        # A folder works too; its manifest catches a modified config
+        source = self.test_dir / "usb"
+        shutil.copytree(self.store.root, source)
+        (source / "fake.yaml").write_bytes(b"models: ['tampered']\n")
+        target = ModelStore(self.test_dir / "from-folder", offline=True)
+        with self.assertRaises(ModelStoreError):
+            target.import_from(source)
+        with self.assertRaises(ModelStoreError):
+            target.import_from(self.test_dir / "missing")
+
+    def test_verify_rehashes_and_removes_corrupt_files(self):
+        self.store.fetch()
+        path = self.store.root / "fake.yaml"
+        path.write_bytes(b"models: ['changed']\n")
+        os.utime(path, ns=(self.store.entries()["fake.yaml"]["mtime_ns"],) * 2)
+        results = self.store.verify()
+        self.assertIsNone(results[CHECKPOINT_NAME])
+        self.assertIn("is corrupt", results["fake.yaml"])
+        self.assertFalse(path.exists())
+
+    def test_demucs_checksum_pass_skips_verified_files(self):
+        self.store.fetch()
+        checked = []
+        repo = types.ModuleType("audio_separator.separator.uvr_lib_v5.demucs.repo")
+        repo.check_checksum = lambda path, checksum: checked.append(Path(path).name)
+        modules = {name: types.ModuleType(name) for name in ("audio_separator", "audio_separator.separator",
+                                                             "audio_separator.separator.uvr_lib_v5",
+                                                             "audio_separator.separator.uvr_lib_v5.demucs")}
+        modules["audio_separator.separator.uvr_lib_v5.demucs"].repo = repo
+        modules[repo.__name__] = repo
+        with patch.dict(sys.modules, modules):
+            self.assertTrue(skip_verified_checksums(self.store))
+            repo.check_checksum(self.store.root / CHECKPOINT_NAME, CHECKPOINT_NAME[9:17])
+            repo.check_checksum(self.test_dir / "elsewhere-0000.th", "0000")
+        self.assertEqual(checked, ["elsewhere-0000.th"])
+
+class TestEngineModelStore(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.song = self.test_dir / "song.mp3"
+        self.song.touch()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_offline_engine_fails_before_loading_a_missing_model(self):
+        separator = MagicMock(demucs_params={})
+        factory = MagicMock(return_value=separator)
+        store = ModelStore(self.test_dir / "models", offline=True)
+        engine = SeparationEngine(output_root=self.test_dir / "output", separator_factory=factory, model_store=store)
+        with self.assertRaises(ModelStoreError):
+            engine.separate(self.song, SeparationSettings("htdemucs.yaml"))
+        factory.assert_not_called()
+
+        # Online, load_model() downloads into the store's folder
+        engine.model_store = ModelStore(store.root, offline=False)
+        separator.separate.return_value = []
+        engine.separate(self.song, SeparationSettings("htdemucs.yaml"))
+        self.assertEqual(factory.call_args.kwargs["model_file_dir"], str(store.root))
+        separator.load_model.assert_called_once_with(model_filename="htdemucs.yaml")
+
+if __name__ == '__main__':
+    unittest.main()
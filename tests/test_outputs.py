@@ -0,0 +1,94 @@
+import sys
+import os
+import errno
+import threading
+import time
+import unittest
+import tempfile
+import shutil
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from natustem.outputs import OutputDirLock, existing_names, free_name, publish_file, reserve_name
+
+class TestPublishing(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_free_name_without_probing(self):
+        self.assertEqual(free_name("vocal.wav", {"drums.wav"}), "vocal.wav")
+        self.assertEqual(free_name("vocal.wav", {"vocal.wav"}), "vocal_1.wav")
+        self.assertEqual(free_name("vocal.wav", {"vocal.wav", "vocal_1.wav", "vocal_7.wav", "vocal_2.flac"}), "vocal_8.wav")
+
+    def test_publish_never_replaces_a_file(self):
+        (self.test_dir / "vocal.wav").write_text("original")
+        taken = existing_names(self.test_dir)
+        # Another job publishes vocal_1.wav after the scan
+        (self.test_dir / "vocal_1.wav").write_text("other job")
+        source = self.test_dir / "raw.wav"
+        source.write_text("new")
+
+        final_path = publish_file(source, self.test_dir, "vocal.wav", taken)
+
+        self.assertEqual(final_path.name, "vocal_2.wav")
+        self.assertEqual(final_path.read_text(), "new")
+        self.assertEqual((self.test_dir / "vocal_1.wav").read_text(), "other job")
+        self.assertFalse(source.exists())
+
+    def test_publish_keeps_source_when_asked(self):
+        source = self.test_dir / "cached.wav"
+        source.write_text("stem")
+        final_path = publish_file(source, self.test_dir, "vocal.wav", set(), keep_source=True)
+        self.assertTrue(source.exists())
+        self.assertEqual(final_path.read_text(), "stem")
+
+    def test_reserve_name_creates_placeholder(self):
+        taken = set()
+        first = reserve_name(self.test_dir, "vocal.flac", taken)
+        second = reserve_name(self.test_dir, "vocal.flac", taken)
+        self.assertEqual((first.name, second.name), ("vocal.flac", "vocal_1.flac"))
+        self.assertEqual(first.stat().st_size, 0)
+
+    def test_output_dir_lock_serializes_jobs(self):
+        events = []
+
+        def job(name):
+            with OutputDirLock(self.test_dir, "song"):
+                events.append(f"{name} start")
+                time.sleep(0.05)
+                events.append(f"{name} end")
+        threads = [threading.Thread(target=job, args=(name,)) for name in ("a", "b")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([e.split()[1] for e in events], ["start", "end", "start", "end"])
+        self.assertTrue((self.test_dir / ".locks" / "song.lock").exists())
+
+    def test_windows_lock_waits_past_the_locking_timeout(self):
+        msvcrt = MagicMock(LK_LOCK=1, LK_UNLCK=0)
+        # LK_LOCK gives up after ~10 s while another worker holds the folder
+        msvcrt.locking.side_effect = [OSError(errno.EDEADLOCK, "Resource deadlock avoided")] * 2 + [None, None]
+        with patch("natustem.outputs.fcntl", None), patch("natustem.outputs.msvcrt", msvcrt, create=True):
+            with OutputDirLock(self.test_dir, "song"):
+                pass
+            self.assertEqual(msvcrt.locking.call_count, 4)
+
+            # Any other failure releases the lock instead of leaving the folder locked for the process
+            msvcrt.locking.side_effect = OSError(errno.EBADF, "Bad file descriptor")
+            lock = OutputDirLock(self.test_dir, "song")
+            with self.assertRaises(OSError):
+                lock.__enter__()
+            self.assertIsNone(lock.file)
+            self.assertTrue(lock.thread_lock.acquire(timeout=1))
+            lock.thread_lock.release()
+
+if __name__ == '__main__':
+    unittest.main()
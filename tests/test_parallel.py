@@ -0,0 +1,161 @@
+import sys
+import os
+import json
+import unittest
+import tempfile
+import shutil
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from natustem.cli import build_parser, default_worker_counts, execution_settings
+from natustem.cpu import (THREAD_ENV_VARS, ExecutionSettings, apply_thread_limits, cgroup_cpu_limit, format_cpu_list, parse_cpu_list,
+                          physical_cores, split_cores)
+from natustem.engine import SeparationEngine, SeparationSettings
+from natustem.worker import execution_options
+from natustem.parallel import best_worker_count, measure_throughput, schedule_order, worker_factory
+
+class TestCoreSplit(unittest.TestCase):
+    def test_split_cores(self):
+        self.assertEqual(split_cores(list(range(8)), 3), [[0, 1, 2], [3, 4, 5], [6, 7]])
+        self.assertEqual(split_cores([0, 1], 4), [[0], [1]])
+        self.assertEqual(split_cores([0, 1, 2, 3], 1), [[0, 1, 2, 3]])
+
+    def test_default_worker_counts(self):
+        self.assertEqual(default_worker_counts(1), [1])
+        self.assertEqual(default_worker_counts(8), [1, 2, 4, 8])
+        self.assertEqual(default_worker_counts(12), [1, 2, 4, 8, 12])
+
+    def test_apply_thread_limits_sets_runtime_env(self):
+        with patch.dict(os.environ, {}):
+            apply_thread_limits(threads=3)
+            self.assertEqual({os.environ[name] for name in THREAD_ENV_VARS}, {"3"})
+
+    def test_worker_factory_hands_out_core_shares(self):
+        create = worker_factory(2, cores=[0, 1, 2, 3, 4])
+        first = create("output")
+        second = create("output")
+        self.assertEqual((first.torch_threads, first.cpu_affinity), (3, [0, 1, 2]))
+        self.assertEqual((second.torch_threads, second.cpu_affinity), (2, [3, 4]))
+        command = second.command()
+        self.assertEqual(command[command.index("--threads") + 1], "2")
+        self.assertEqual(command[command.index("--cpus") + 1], "3,4")
+
+class TestExecutionSettings(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        # 4 cores with 2 SMT threads each: cpu N and N+4 are siblings
+        self.sysfs = self.test_dir / "cpu"
+        for cpu in range(8):
+            topology = self.sysfs / f"cpu{cpu}" / "topology"
+            topology.mkdir(parents=True)
+            (topology / "thread_siblings_list").write_text(f"{cpu % 4},{cpu % 4 + 4}\n")
+        self.cgroup = self.test_dir / "cgroup"
+        self.cgroup.mkdir()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_cpu_lists(self):
+        self.assertEqual(parse_cpu_list("0-3, 8,10-11"), [0, 1, 2, 3, 8, 10, 11])
+        self.assertEqual(format_cpu_list([11, 0, 1, 2, 3, 8, 10]), "0-3,8,10-11")
+        for text in ("", "3-1", "a"):
+            with self.assertRaises(ValueError):
+                parse_cpu_list(text)
+
+    def test_physical_cores_skip_smt_siblings(self):
+        self.assertEqual(physical_cores(range(8), sysfs=self.sysfs), [0, 1, 2, 3])
+        self.assertEqual(physical_cores([2, 5, 6], sysfs=self.sysfs), [2, 5])
+
+    def test_cgroup_quota(self):
+        self.assertIsNone(cgroup_cpu_limit(self.cgroup))
+        (self.cgroup / "cpu.max").write_text("max 100000\n")
+        self.assertIsNone(cgroup_cpu_limit(self.cgroup))
+        (self.cgroup / "cpu.max").write_text("250000 100000\n")
+        self.assertEqual(cgroup_cpu_limit(self.cgroup), 2.5)
+        (self.cgroup / "cpu.max").unlink()
+        (self.cgroup / "cpu").mkdir()
+        (self.cgroup / "cpu" / "cpu.cfs_quota_us").write_text("200000\n")
+        (self.cgroup / "cpu" / "cpu.cfs_period_us").write_text("100000\n")
+        self.assertEqual(cgroup_cpu_limit(self.cgroup), 2.0)
+
+    def test_auto_mode(self):
+        auto = ExecutionSettings(auto=True)
+        resolved = auto.resolve(cores=list(range(8)), sysfs=self.sysfs, cgroup_root=self.cgroup)
+        self.assertEqual((resolved.intra_op_threads, resolved.inter_op_threads), (4, 1))
+        if hasattr(os, "sched_setaffinity"):
+            self.assertEqual(resolved.cpus, [0, 1, 2, 3])
+        self.assertIn("4 physical cores of 8 CPUs", resolved.describe())
+        # A quota caps the threads and leaves the placement to the scheduler
+        resolved = auto.resolve(cores=list(range(8)), quota=2.5, sysfs=self.sysfs)
+        self.assertEqual((resolved.intra_op_threads, resolved.cpus), (2, None))
+        # Values that are set are kept
+        resolved = ExecutionSettings(intra_op_threads=6, auto=True).resolve(cores=list(range(8)), quota=2.5, sysfs=self.sysfs)
+        self.assertEqual(resolved.intra_op_threads, 6)
+        self.assertEqual(execution_options(ExecutionSettings(3, 2, [1, 2])),
+                         {"torch_threads": 3, "interop_threads": 2, "cpu_affinity": [1, 2]})
+
+    def test_cli_arguments(self):
+        parser = build_parser()
+        args = parser.parse_args(["separate", "--threads", "4", "--interop-threads", "2", "--cpus", "0-3"])
+        execution = execution_settings(parser, args)
+        self.assertEqual(execution.to_dict(), {"auto": False, "intra_op_threads": 4, "inter_op_threads": 2, "cpus": "0-3"})
+        self.assertTrue(execution_settings(parser, parser.parse_args(["separate", "--threads", "auto"])).auto)
+        self.assertIsNone(execution_settings(parser, parser.parse_args(["separate"])))
+        with patch("sys.stderr"), self.assertRaises(SystemExit):
+            execution_settings(parser, parser.parse_args(["separate", "--threads", "0"]))
+
+    def test_settings_are_applied_and_logged_per_job(self):
+        separator = MagicMock()
+        separator.separate.return_value = []
+        song = self.test_dir / "song.mp3"
+        song.touch()
+        metrics_path = self.test_dir / "metrics.jsonl"
+        execution = ExecutionSettings(2, 1, [0])
+        engine = SeparationEngine(output_root=self.test_dir / "output", separator_factory=lambda **kwargs: separator,
+                                  metrics_path=metrics_path, execution=execution)
+        lines = []
+        with patch("natustem.engine.apply_execution_settings") as apply:
+            engine.separate(song, SeparationSettings(), log=lines.append)
+        # Before the Separator is built, and again once torch is imported
+        self.assertGreaterEqual(apply.call_count, 2)
+        self.assertIn("Execution: intra-op threads 2, inter-op threads 1, CPUs 0", lines)
+        record = json.loads(metrics_path.read_text().splitlines()[0])
+        self.assertEqual(record["execution"], execution.to_dict())
+
+class TestThroughputMeasurement(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.files = []
+        for name, size in [("short.wav", 10), ("long.wav", 1000), ("mid.wav", 100)]:
+            path = self.test_dir / name
+            path.write_bytes(b"x" * size)
+            self.files.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_schedule_longest_first(self):
+        self.assertEqual([p.name for p in schedule_order(self.files)], ["long.wav", "mid.wav", "short.wav"])
+
+    def test_measure_throughput_per_worker_count(self):
+        calls = []
+
+        def fake_run_batch(files, settings, output_root, workers, engine_factory):
+            calls.append((workers, [Path(f).name for f in files]))
+            self.assertTrue(Path(output_root).is_dir())
+            return [{"status": "ok"} for _ in files]
+
+        records = measure_throughput(self.files, SeparationSettings(), [1, 2, 8], run_batch=fake_run_batch, cores=[0, 1, 2, 3])
+
+        self.assertEqual([c[0] for c in calls], [1, 2, 4])
+        self.assertEqual(calls[0][1], ["long.wav", "mid.wav", "short.wav"])
+        self.assertEqual([r["threads_per_worker"] for r in records], [4, 2, 1])
+        self.assertNotIn("speedup", records[0])
+        self.assertIn("speedup", records[1])
+        self.assertIn(best_worker_count(records), [1, 2, 4])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,7 +19,7 @@ import unittest
 
 class TestPickFilesResult(unittest.TestCase):
     def setUp(self):
-        self.app = AudioSeparatorApp()
+        self.app = AudioSeparatorApp(metrics_path=None)
         # Mock the UI components that pick_files_result interacts with
         self.app.file_path_text = MagicMock()
         self.app.separate_btn = MagicMock()
@@ -0,0 +1,134 @@
+import sys
+import os
+import io
+import threading
+import unittest
+import tempfile
+import shutil
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from natustem.cache import ResultCache
+from natustem.cli import run_batch
+from natustem.engine import SeparationEngine, SeparationSettings
+from natustem.pipeline import run_pipeline
+
+def make_separator(on_separate=None):
+    separator = MagicMock()
+    separator.demucs_params = {}
+
+    def fake_separate(path):
+        if on_separate is not None:
+            on_separate(Path(path))
+        name = Path(path).stem
+        for stem in ("Vocals", "Drums"):
+            (Path(separator.output_dir) / f"{name}_({stem})_htdemucs.wav").write_text(f"{name} {stem}")
+        return [f"{name}_({stem})_htdemucs.wav" for stem in ("Vocals", "Drums")]
+    separator.separate.side_effect = fake_separate
+    return separator
+
+def tree(root):
+    return {str(p.relative_to(root)): p.read_text() for p in sorted(root.rglob("*.wav"))}
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.songs = []
+        for name in ("a", "b", "c", "d"):
+            song = self.test_dir / f"{name}.mp3"
+            song.write_text(name)
+            self.songs.append(song)
+        self.settings = SeparationSettings("htdemucs.yaml")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_same_files_as_sequential_run(self):
+        sequential = SeparationEngine(output_root=self.test_dir / "sequential", separator_factory=lambda **kwargs: make_separator())
+        for song in self.songs + self.songs[:1]:
+            sequential.separate(song, self.settings)
+
+        separator = make_separator()
+        with patch("sys.stdout", io.StringIO()):
+            records = run_batch(self.songs + self.songs[:1], self.settings, output_root=self.test_dir / "pipelined",
+                                engine_factory=lambda output_root: SeparationEngine(output_root=output_root,
+                                                                                    separator_factory=lambda **kwargs: separator))
+
+        self.assertEqual([r["status"] for r in records], ["ok"] * 5)
+        self.assertEqual(records[4]["files"], ["vocal_1.wav", "drums_1.wav"])
+        self.assertEqual(tree(self.test_dir / "pipelined"), tree(self.test_dir / "sequential"))
+
+    def test_prefetch_and_publish_overlap_the_model(self):
+        prefetched = []
+        overlaps = []
+
+        def on_separate(path):
+            if path.stem == "a":
+                # b is read while a is still in the model
+                for _ in range(200):
+                    if "b" in prefetched:
+                        break
+                    threading.Event().wait(0.01)
+                overlaps.append(("prefetch b during a", "b" in prefetched, len(prefetched)))
+            if path.stem == "b":
+                # a's stems get renamed while b is in the model
+                published = self.test_dir / "output" / "a" / "vocal.wav"
+                for _ in range(200):
+                    if published.exists():
+                        break
+                    threading.Event().wait(0.01)
+                overlaps.append(("publish a during b", published.exists(), None))
+
+        separator = make_separator(on_separate)
+        engine = SeparationEngine(output_root=self.test_dir / "output", separator_factory=lambda **kwargs: separator,
+                                  cache=ResultCache(self.test_dir / "output" / ".cache"))
+        original_prefetch = engine.prefetch
+
+        def prefetch(path, settings):
+            prefetched.append(Path(path).stem)
+            return original_prefetch(path, settings)
+        engine.prefetch = prefetch
+
+        finished = []
+        run_pipeline(engine, ((song.stem, song, self.settings) for song in self.songs),
+                     lambda key, result, error: finished.append((key, error, result.files if result else None)))
+
+        self.assertEqual(overlaps[0][:2], ("prefetch b during a", True))
+        # Bounded: one input queued and one being read while a is in the model
+        self.assertLessEqual(overlaps[0][2], 3)
+        self.assertEqual(overlaps[1][:2], ("publish a during b", True))
+        self.assertEqual([(key, error) for key, error, _ in finished], [(name, None) for name in "abcd"])
+        # The prefetched hash is used as the cache key
+        self.assertEqual(len(engine.cache.load_index()), 4)
+
+    def test_failed_job_does_not_stop_the_pipeline(self):
+        def on_separate(path):
+            if path.stem == "b":
+                raise RuntimeError("boom")
+
+        separator = make_separator(on_separate)
+        engine = SeparationEngine(output_root=self.test_dir / "output", separator_factory=lambda **kwargs: separator)
+        finished = []
+        run_pipeline(engine, ((song.stem, song, self.settings) for song in self.songs),
+                     lambda key, result, error: finished.append((key, str(error) if error else None)))
+
+        self.assertEqual(finished, [("a", None), ("b", "boom"), ("c", None), ("d", None)])
+        self.assertFalse((self.test_dir / "output" / "b").exists())
+
+    def test_failed_job_setup_releases_the_output_folder(self):
+        engine = SeparationEngine(output_root=self.test_dir / "output", separator_factory=lambda **kwargs: make_separator())
+        with patch("natustem.engine.ResourceSampler.start", side_effect=RuntimeError("no sampler")):
+            with self.assertRaises(RuntimeError):
+                engine.begin(self.songs[0], self.settings)
+        # The folder is free again: the next job on it does not wait forever
+        finished = []
+        thread = threading.Thread(target=lambda: finished.append(engine.separate(self.songs[0], self.settings)), daemon=True)
+        thread.start()
+        thread.join(timeout=10)
+        self.assertEqual([result.files for result in finished], [["vocal.wav", "drums.wav"]])
+
+if __name__ == '__main__':
+    unittest.main()
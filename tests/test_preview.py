@@ -0,0 +1,89 @@
+import sys
+import os
+import unittest
+import tempfile
+import shutil
+import wave
+from pathlib import Path
+from unittest.mock import MagicMock
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from natustem.audio import cut_excerpt
+from natustem.engine import SeparationEngine, SeparationSettings
+from natustem.preview import parse_time, preview_settings, preview_window, run_preview
+
+def write_wav(path, seconds, framerate=1000):
+    # Mono 16-bit; frame n holds the value n, so an excerpt's position can be checked
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(framerate)
+        f.writeframes(b"".join((n % 32768).to_bytes(2, "little") for n in range(int(seconds * framerate))))
+    return path
+
+class TestPreview(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.song = write_wav(self.test_dir / "song.wav", seconds=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_cut_wav_excerpt(self):
+        excerpt = cut_excerpt(self.song, 12.5, 20, self.test_dir / "excerpt.wav")
+        with wave.open(str(excerpt), "rb") as f:
+            self.assertEqual(f.getnframes(), 20000)
+            self.assertEqual(int.from_bytes(f.readframes(1), "little"), 12500)
+
+    def test_window_and_time_parsing(self):
+        self.assertEqual(parse_time("1:30"), 90)
+        self.assertEqual(parse_time("45"), 45)
+        self.assertEqual(preview_window(50, 30, duration=60), (30, 30))
+        self.assertEqual(preview_window(10, 30, duration=12), (0, 12))
+        with self.assertRaises(ValueError):
+            preview_window(0, 600)
+
+    def test_preview_settings_are_cheaper(self):
+        settings = SeparationSettings("htdemucs_ft.yaml", 2, 0.25, stems=["vocals"])
+        preview = preview_settings(settings)
+        self.assertEqual((preview.model_name, preview.shifts, preview.overlap, preview.stems), ("htdemucs_ft.yaml", 0, 0.1, settings.stems))
+
+    def test_preview_reuses_the_warm_separator_and_stays_out_of_output(self):
+        separator = MagicMock()
+        separator.demucs_params = {}
+        lengths = []
+
+        def fake_separate(path):
+            with wave.open(path, "rb") as f:
+                lengths.append(f.getnframes() / f.getframerate())
+            name = f"{Path(path).stem}_(Vocals)_htdemucs_ft.wav"
+            (Path(separator.output_dir) / name).write_text(Path(path).name)
+            return [name]
+        separator.separate.side_effect = fake_separate
+        factory = MagicMock(return_value=separator)
+        engine = SeparationEngine(output_root=self.test_dir / "output", separator_factory=factory)
+        engine.prepare(SeparationSettings("htdemucs_ft.yaml"))
+        settings = SeparationSettings("htdemucs_ft.yaml", 2, 0.25)
+        preview_root = self.test_dir / "preview"
+
+        result = run_preview(engine, self.song, settings, 40, 30, preview_root=preview_root, log=lambda message: None)
+        self.assertEqual(result.output_dir, preview_root / "song")
+        self.assertEqual(result.files, ["vocal.wav"])
+        self.assertEqual(lengths, [30.0])  # 0:40-1:10 slides back to 0:30-1:00
+        self.assertEqual((separator.demucs_params["shifts"], separator.demucs_params["overlap"]), (0, 0.1))
+        # Another preview replaces the last one
+        run_preview(engine, self.song, settings, 0, 20, preview_root=preview_root, log=lambda message: None)
+        self.assertEqual(sorted(p.name for p in (preview_root / "song").iterdir()), ["vocal.wav"])
+        self.assertFalse((self.test_dir / "output" / "song").exists())
+
+        # The full render runs on the same Separator with the full settings
+        full = engine.separate(self.song, settings, log=lambda message: None)
+        self.assertEqual(full.output_dir, self.test_dir / "output" / "song")
+        self.assertEqual(lengths[-1], 60.0)
+        self.assertEqual(separator.demucs_params["shifts"], 2)
+        self.assertEqual(factory.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import sys
+import os
+import io
+import unittest
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from natustem.progress import MAX_BUFFER_SIZE, ProgressTracker, StderrTqdmHandler, expected_passes, parse_tqdm_line
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestTqdmParsing(unittest.TestCase):
+    def test_parse_demucs_line(self):
+        progress = parse_tqdm_line(" 45%|████▌     | 105.3/234.0 [00:20<00:24,  5.23seconds/s]")
+        self.assertEqual(progress.percent, 45)
+        self.assertAlmostEqual(progress.fraction, 105.3 / 234.0)
+        self.assertEqual(progress.elapsed, 20)
+        self.assertEqual(progress.remaining, 24)
+        self.assertEqual(progress.rate, 5.23)
+        self.assertEqual(progress.unit, "seconds/s")
+
+    def test_parse_other_forms(self):
+        slow = parse_tqdm_line("10%|█         | 1/10 [01:02:03<?, 2.50s/it]")
+        self.assertEqual(slow.elapsed, 3723)
+        self.assertIsNone(slow.remaining)
+        self.assertEqual(slow.unit, "s/it")
+
+        starting = parse_tqdm_line("0%|          | 0/1.2k [00:00<?, ?it/s]")
+        self.assertEqual(starting.total, 1200)
+        self.assertIsNone(starting.rate)
+
+        self.assertIsNone(parse_tqdm_line("INFO - Loading model htdemucs.yaml"))
+
+class TestStderrTqdmHandler(unittest.TestCase):
+    def setUp(self):
+        self.captured = []
+        self.clock = FakeClock()
+        self.handler = StderrTqdmHandler(self.captured.append, min_interval=0.1, clock=self.clock)
+        self.handler.original_stderr = io.StringIO()
+
+    def test_tqdm_detection(self):
+        self.handler.write("50%|████     | 5/10 [00:05<00:05, 1.00it/s]\r")
+        self.handler.write("\n")
+        self.assertEqual(len(self.captured), 1)
+        self.assertEqual(self.captured[0].percent, 50)
+        self.assertIn("5/10", self.handler.original_stderr.getvalue())
+
+    def test_updates_are_rate_limited_but_completion_is_not(self):
+        for n in range(1, 10):
+            self.handler.write(f"\r{n * 10}%|###| {n}/10 [00:0{n}<00:01, 1.00it/s]")
+        self.assertEqual([p.n for p in self.captured], [1])
+
+        self.clock.now = 0.5
+        self.handler.write("\r90%|###| 9/10 [00:09<00:01, 1.00it/s]")
+        self.handler.write("\r100%|###| 10/10 [00:10<00:00, 1.00it/s]")
+        self.assertEqual([p.n for p in self.captured], [1, 9, 10])
+
+    def test_buffer_is_bounded(self):
+        for _ in range(1000):
+            self.handler.write("x" * 100)
+        self.assertLessEqual(self.handler.buffer_size, MAX_BUFFER_SIZE)
+        self.assertEqual(self.captured, [])
+
+class TestProgressTracker(unittest.TestCase):
+    def test_expected_passes(self):
+        self.assertEqual(expected_passes("htdemucs_ft.yaml", 2), 8)
+        self.assertEqual(expected_passes("htdemucs.yaml", 0), 1)
+
+    def test_overall_fraction_eta_and_rtf(self):
+        clock = FakeClock()
+        tracker = ProgressTracker(passes=2, clock=clock)
+
+        tracker.update(parse_tqdm_line("50%|#| 100.0/200.0 [00:00<00:00, 1seconds/s]"))
+        clock.now = 10.0
+        tracker.update(parse_tqdm_line("100%|#| 200.0/200.0 [00:10<00:00, 1seconds/s]"))
+        self.assertAlmostEqual(tracker.fraction, 0.5)
+
+        # The bar restarting means the second pass began
+        clock.now = 15.0
+        tracker.update(parse_tqdm_line("50%|#| 100.0/200.0 [00:05<00:05, 1seconds/s]"))
+        self.assertAlmostEqual(tracker.fraction, 0.75)
+        self.assertAlmostEqual(tracker.eta, 5.0)
+        # 20 s projected for 200 s of audio (duration taken from the "seconds" unit)
+        self.assertAlmostEqual(tracker.real_time_factor, 0.1)
+        self.assertIn("RTF 0.10", tracker.describe(parse_tqdm_line("50%|#| 100.0/200.0 [00:05<00:05, 1seconds/s]")))
+
+if __name__ == '__main__':
+    unittest.main()
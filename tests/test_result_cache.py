@@ -0,0 +1,109 @@
+import sys
+import os
+import time
+import multiprocessing
+import unittest
+import tempfile
+import shutil
+from pathlib import Path
+from unittest.mock import MagicMock
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from natustem.cache import ResultCache
+from natustem.engine import SeparationEngine, SeparationSettings
+
+def store_many(root, stem_path, prefix, count):
+    # Runs in a child process: stores `count` results under keys starting with prefix
+    cache = ResultCache(root, max_bytes=10 ** 9)
+    for i in range(count):
+        cache.store(f"{prefix}{i:063d}", [stem_path])
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.cache = ResultCache(self.test_dir / "output" / ".cache", max_bytes=100)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def make_file(self, name, content):
+        path = self.test_dir / name
+        path.write_text(content)
+        return path
+
+    def test_key_depends_on_content_and_settings(self):
+        a = self.make_file("a.mp3", "same audio")
+        b = self.make_file("b.mp3", "same audio")
+        c = self.make_file("c.mp3", "other audio")
+        settings = SeparationSettings("htdemucs.yaml", 1, 0.25)
+
+        self.assertEqual(self.cache.key_for(a, settings), self.cache.key_for(b, settings))
+        self.assertNotEqual(self.cache.key_for(a, settings), self.cache.key_for(c, settings))
+        self.assertNotEqual(self.cache.key_for(a, settings), self.cache.key_for(a, SeparationSettings("htdemucs.yaml", 2, 0.25)))
+
+    def test_lru_eviction(self):
+        first = self.make_file("vocal.wav", "x" * 40)
+        self.cache.store("a" * 64, [first])
+        self.cache.store("b" * 64, [first])
+        # Touch "a" so "b" becomes the least recently used entry
+        time.sleep(0.01)
+        self.assertIsNotNone(self.cache.lookup("a" * 64))
+
+        self.cache.store("c" * 64, [first])
+
+        self.assertIsNotNone(self.cache.lookup("a" * 64))
+        self.assertIsNone(self.cache.lookup("b" * 64))
+        self.assertIsNotNone(self.cache.lookup("c" * 64))
+        self.assertLessEqual(self.cache.total_size(), 100)
+
+    def test_processes_sharing_a_cache_keep_every_entry(self):
+        stem = self.make_file("vocal.wav", "x" * 10)
+        processes = [multiprocessing.Process(target=store_many, args=(self.cache.root, stem, prefix, 30)) for prefix in "ab"]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(timeout=60)
+            self.assertEqual(process.exitcode, 0)
+        self.assertEqual(len(self.cache.load_index()), 60)
+        self.assertEqual(self.cache.total_size(), 600)
+
+    def test_engine_serves_resubmission_from_cache(self):
+        output_root = self.test_dir / "output"
+        separator = MagicMock()
+
+        def fake_separate(path):
+            (Path(separator.output_dir) / "x_(Vocals)_htdemucs.wav").write_text("vocals")
+            return ["x_(Vocals)_htdemucs.wav"]
+        separator.separate.side_effect = fake_separate
+
+        engine = SeparationEngine(output_root=output_root, separator_factory=lambda **kwargs: separator, cache=self.cache)
+        settings = SeparationSettings("htdemucs.yaml", 1, 0.25)
+        first = engine.separate(self.make_file("song.mp3", "audio"), settings)
+        second = engine.separate(self.make_file("song copy.mp3", "audio"), settings)
+
+        self.assertFalse(first.cached)
+        self.assertTrue(second.cached)
+        separator.separate.assert_called_once()
+        self.assertEqual((output_root / "song copy" / "vocal.wav").read_text(), "vocals")
+
+        # Editing published stems in place (first run or restored) leaves the cached result intact
+        for published in (output_root / "song" / "vocal.wav", output_root / "song copy" / "vocal.wav"):
+            with open(published, "r+") as f:
+                f.write("trimmed")
+        third = engine.separate(self.make_file("song again.mp3", "audio"), settings)
+        self.assertTrue(third.cached)
+        self.assertEqual((output_root / "song again" / "vocal.wav").read_text(), "vocals")
+
+    def test_modified_entry_is_not_served(self):
+        stem = self.make_file("vocal.wav", "x" * 10)
+        self.cache.store("a" * 64, [stem])
+        [cached] = self.cache.lookup("a" * 64)
+        self.assertNotEqual(os.stat(cached).st_ino, os.stat(stem).st_ino)
+        cached.write_text("y" * 12)
+        self.assertIsNone(self.cache.lookup("a" * 64))
+        self.assertEqual(self.cache.total_size(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
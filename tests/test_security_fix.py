@@ -25,7 +25,7 @@ from main import AudioSeparatorApp
 
 class TestSecurityFix(unittest.TestCase):
     def setUp(self):
-        self.app = AudioSeparatorApp()
+        self.app = AudioSeparatorApp(metrics_path=None)
         # Set a sensitive input path to simulate the vulnerability
         self.app.audio_file_path = "/sensitive/path/song.mp3"
 
@@ -0,0 +1,183 @@
+import sys
+import os
+import json
+import asyncio
+import threading
+import unittest
+import tempfile
+import shutil
+from pathlib import Path
+from unittest.mock import MagicMock
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from natustem.engine import SeparationEngine, SeparationSettings
+from natustem.service import HttpApi, JobService, ServiceJob, settings_from
+
+def make_engine_factory(loads, release=None):
+    def factory(output_root):
+        separator = MagicMock()
+        separator.demucs_params = {}
+        separator.load_model.side_effect = lambda model_filename: loads.append(model_filename)
+
+        def fake_separate(path):
+            if release is not None:
+                release.wait(5)
+            name = Path(path).stem
+            for stem in ("Vocals", "Drums"):
+                (Path(separator.output_dir) / f"{name}_({stem})_htdemucs.wav").write_text(stem)
+            return [f"{name}_({stem})_htdemucs.wav" for stem in ("Vocals", "Drums")]
+        separator.separate.side_effect = fake_separate
+        return SeparationEngine(output_root=output_root, separator_factory=lambda **kwargs: separator)
+    return factory
+
+async def request(port, method, path, body=b"", content_type="application/json", content_length=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: {content_type}\r\n"
+                 f"Content-Length: {len(body) if content_length is None else content_length}\r\n\r\n".encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    return int(head.split(b" ")[1]), payload
+
+class TestSettings(unittest.TestCase):
+    def test_settings_from_request(self):
+        settings = settings_from({"model": "htdemucs.yaml", "shifts": "1", "stems": "vocals,instrumental", "format": "FLAC"})
+        self.assertEqual(settings.stems, ("Vocals", "Instrumental"))
+        self.assertEqual(settings.output_format.format, "FLAC")
+        for params in ({"model": "nope.yaml"}, {"shifts": 50}, {"format": "OGG"}, {"segment_size": 0}, {"segment_size": 2.5}):
+            with self.assertRaises(ValueError):
+                settings_from(params)
+        self.assertEqual(settings_from({"segment_size": "6"}).segment_size, 6)
+        # Values of the wrong type are client errors too, not crashes
+        for params in ({"shifts": None}, {"model": ["htdemucs.yaml"]}, {"segment_size": [4]}):
+            with self.assertRaises((TypeError, ValueError)):
+                settings_from(params)
+
+class TestJobScheduling(unittest.TestCase):
+    def test_prefers_loaded_model_up_to_batch_size(self):
+        service = JobService(make_engine_factory([]), batch_size=2)
+        engine = MagicMock(loaded_model_name="htdemucs.yaml")
+        engine.resident_models.return_value = ["htdemucs.yaml"]
+        jobs = [ServiceJob("a.wav", SeparationSettings("htdemucs_ft.yaml"))] + \
+               [ServiceJob(f"{i}.wav", SeparationSettings("htdemucs.yaml")) for i in range(3)]
+        service.pending.extend(jobs)
+        state = {"streak": 0}
+
+        order = [service.take_job(engine, state) for _ in range(3)]
+        # Two jobs for the loaded model, then the oldest job gets its turn
+        self.assertEqual(order, [jobs[1], jobs[2], jobs[0]])
+
+    def test_only_the_latest_finished_jobs_are_kept(self):
+        async def scenario():
+            service = JobService(make_engine_factory([]), keep_finished=2)
+            service.wakeup = asyncio.Condition()
+            jobs = [await service.submit(f"{i}.wav", SeparationSettings()) for i in range(4)]
+            for i, job in enumerate(jobs[:3]):
+                service.pending.remove(job)
+                job.status, job.finished = "done", float(i)
+            await service.submit("4.wav", SeparationSettings())
+            return service, jobs
+        service, jobs = asyncio.run(scenario())
+        # The oldest finished job is forgotten; queued ones never are
+        self.assertNotIn(jobs[0].id, service.jobs)
+        self.assertTrue(all(job.id in service.jobs for job in jobs[1:]))
+        self.assertEqual(len(service.jobs), 4)
+
+class TestHttpApi(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.song = self.test_dir / "song.wav"
+        self.song.write_text("audio")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def run_with_api(self, scenario, release=None, **service_options):
+        loads = []
+
+        async def main():
+            service = JobService(make_engine_factory(loads, release), output_root=self.test_dir / "output", **service_options)
+            await service.start(SeparationSettings("htdemucs.yaml"))
+            api = await HttpApi(service, port=0).start()
+            try:
+                return await scenario(api.port, service)
+            finally:
+                if release is not None:
+                    release.set()
+                await api.stop()
+                await service.stop()
+        return asyncio.run(main()), loads
+
+    async def wait_for(self, port, job_id, statuses=("done", "failed", "cancelled")):
+        for _ in range(200):
+            status, payload = await request(port, "GET", f"/jobs/{job_id}")
+            job = json.loads(payload)
+            if job["status"] in statuses:
+                return job
+            await asyncio.sleep(0.02)
+        self.fail(f"job {job_id} did not finish")
+
+    def test_submit_poll_and_download(self):
+        async def scenario(port, service):
+            status, payload = await request(port, "POST", "/jobs", json.dumps({"input": str(self.song), "model": "htdemucs.yaml"}).encode())
+            self.assertEqual(status, 202)
+            job = await self.wait_for(port, json.loads(payload)["id"])
+            status, stem = await request(port, "GET", f"/jobs/{job['id']}/stems/vocal.wav")
+            missing, _ = await request(port, "GET", f"/jobs/{job['id']}/stems/..%2Fsong.wav")
+            status_health, health = await request(port, "GET", "/health")
+            return job, status, stem, missing, json.loads(health)
+
+        (job, status, stem, missing, health), loads = self.run_with_api(scenario)
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(job["progress"], 1.0)
+        self.assertEqual(sorted(job["files"]), ["drums.wav", "vocal.wav"])
+        self.assertEqual((status, stem), (200, b"Vocals"))
+        self.assertEqual(missing, 404)
+        self.assertEqual(health["workers"][0]["loaded_model_name"], "htdemucs.yaml")
+        # Warmed up once before the first request, never reloaded
+        self.assertEqual(loads, ["htdemucs.yaml"])
+
+    def test_upload_is_separated_and_removed(self):
+        async def scenario(port, service):
+            status, payload = await request(port, "POST", "/jobs?filename=take.wav&model=htdemucs.yaml&stems=vocals",
+                                            b"RIFF", content_type="audio/wav")
+            self.assertEqual(status, 202)
+            return await self.wait_for(port, json.loads(payload)["id"])
+
+        (job, _) = self.run_with_api(scenario)
+        self.assertEqual(job["files"], ["vocal.wav"])
+        self.assertTrue((self.test_dir / "output" / "take" / "vocal.wav").exists())
+        self.assertEqual(list((self.test_dir / "output" / ".uploads").iterdir()), [])
+
+    def test_bad_requests_and_full_queue(self):
+        release = threading.Event()
+
+        async def scenario(port, service):
+            body = json.dumps({"input": str(self.song), "model": "htdemucs.yaml"}).encode()
+            missing, _ = await request(port, "POST", "/jobs", json.dumps({"input": "nowhere.wav"}).encode())
+            invalid = [(await request(port, "POST", "/jobs", json.dumps(dict(params, input=str(self.song))).encode()))[0]
+                       for params in ({"shifts": 99}, {"shifts": None}, {"model": ["htdemucs.yaml"]}, {"segment_size": -1})]
+            invalid.append((await request(port, "POST", "/jobs", b"[]"))[0])
+            for content_length in ("abc", "-1"):
+                invalid.append((await request(port, "POST", "/jobs", b"{}", content_length=content_length))[0])
+                invalid.append((await request(port, "POST", "/jobs?filename=take.wav", b"RIFF", content_type="audio/wav",
+                                              content_length=content_length))[0])
+            unknown, _ = await request(port, "GET", "/jobs/nope")
+            # The first job blocks the only worker, the second fills the queue
+            status, payload = await request(port, "POST", "/jobs", body)
+            await self.wait_for(port, json.loads(payload)["id"], statuses=("running",))
+            statuses = [status] + [(await request(port, "POST", "/jobs", body))[0] for _ in range(2)]
+            queued = [job for job in service.jobs.values() if job.status == "queued"][0]
+            cancelled, payload = await request(port, "DELETE", f"/jobs/{queued.id}")
+            return missing, invalid, unknown, statuses, cancelled, json.loads(payload)["status"]
+
+        (missing, invalid, unknown, statuses, cancelled, status), _ = self.run_with_api(scenario, release=release, max_queue=1)
+        self.assertEqual((missing, invalid, unknown), (400, [400] * 9, 404))
+        self.assertEqual(statuses, [202, 202, 503])
+        self.assertEqual((cancelled, status), (202, "cancelled"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import sys
+import os
+import array
+import wave
+import unittest
+import tempfile
+import shutil
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from natustem.engine import SeparationEngine, SeparationSettings
+from natustem.stems import normalize_stems, single_stem
+
+def write_wav(path, samples):
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(44100)
+        f.writeframes(array.array("h", samples).tobytes())
+
+def read_wav(path):
+    with wave.open(str(path), "rb") as f:
+        return list(array.array("h", f.readframes(f.getnframes())))
+
+class TestStemSelection(unittest.TestCase):
+    def test_normalize_and_single_stem(self):
+        self.assertIsNone(normalize_stems(None, "htdemucs.yaml"))
+        self.assertIsNone(normalize_stems(["other", "bass", "drums", "vocals"], "htdemucs.yaml"))
+        self.assertEqual(normalize_stems(["instrumental", "VOCALS"], "htdemucs.yaml"), ("Vocals", "Instrumental"))
+        self.assertEqual(single_stem(("Vocals", "Instrumental")), "Vocals")
+        self.assertEqual(single_stem(("Instrumental",)), "Vocals")
+        self.assertIsNone(single_stem(("Vocals", "Drums")))
+        with self.assertRaises(ValueError):
+            normalize_stems(["piano"], "htdemucs.yaml")
+        self.assertEqual(normalize_stems(["piano"], "htdemucs_6s.yaml"), ("Piano",))
+
+class TestEngineStems(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.song = self.test_dir / "song.wav"
+        write_wav(self.song, [1000, -1000, 500, 500])
+        self.separator = MagicMock()
+        self.separator.demucs_params = {}
+
+        def fake_separate(path):
+            # Honours output_single_stem like audio_separator does
+            stems = ["Vocals", "Drums", "Bass", "Other"]
+            if self.separator.output_single_stem:
+                stems = [self.separator.output_single_stem]
+            names = []
+            for stem in stems:
+                name = f"song_({stem})_htdemucs.wav"
+                write_wav(Path(self.separator.output_dir) / name, [200, -200, 100, 600] if stem == "Vocals" else [0, 0, 0, 0])
+                names.append(name)
+            return names
+        self.separator.separate.side_effect = fake_separate
+        self.engine = SeparationEngine(output_root=self.test_dir / "output", separator_factory=lambda **kwargs: self.separator)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_unwanted_stems_are_not_published(self):
+        result = self.engine.separate(self.song, SeparationSettings("htdemucs.yaml", stems=["vocals", "drums"]))
+        self.assertIsNone(self.separator.output_single_stem)
+        self.assertEqual(sorted(result.files), ["drums.wav", "vocal.wav"])
+        self.assertEqual(sorted(p.name for p in result.output_dir.iterdir()), ["drums.wav", "vocal.wav"])
+
+    def test_instrumental_is_mix_minus_vocals(self):
+        with patch("natustem.stems.shutil.which", return_value=None):
+            result = self.engine.separate(self.song, SeparationSettings("htdemucs.yaml", stems=["instrumental"]))
+
+        self.assertEqual(self.separator.output_single_stem, "Vocals")
+        self.assertEqual(result.files, ["instrumental.wav"])
+        self.assertEqual(read_wav(result.output_dir / "instrumental.wav"), [800, -800, 400, -100])
+        self.assertEqual([p.name for p in result.output_dir.iterdir()], ["instrumental.wav"])
+        self.assertIn("instrumental", result.timings)
+
+    def test_stems_change_the_cache_key(self):
+        self.assertNotIn("stems", SeparationSettings().to_dict())
+        self.assertEqual(SeparationSettings(stems=["vocals"]).to_dict()["stems"], ["Vocals"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import sys
+import os
+import unittest
+import tempfile
+import shutil
+import wave
+import array
+from pathlib import Path
+from unittest.mock import MagicMock
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from natustem.engine import SeparationEngine, SeparationSettings
+from natustem.streaming import StreamingSeparation, chunk_count, plan_windows
+
+RATE = 1000
+
+def write_wav(path, samples, channels=2):
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(RATE)
+        f.writeframes(array.array("h", samples).tobytes())
+
+def read_wav(path):
+    with wave.open(str(path), "rb") as f:
+        return list(array.array("h", f.readframes(f.getnframes())))
+
+class IdentitySeparator:
+    # "Separates" a chunk into a vocal stem equal to the input and a silent drum stem
+    def __init__(self, output_dir, fail_at=None):
+        self.output_dir = output_dir
+        self.fail_at = fail_at
+        self.chunks = []
+
+    def separate(self, path):
+        name = Path(path).stem
+        self.chunks.append(name)
+        if len(self.chunks) == self.fail_at:
+            raise RuntimeError("out of memory")
+        with wave.open(path, "rb") as src:
+            params = src.getparams()
+            frames = src.readframes(src.getnframes())
+        outputs = []
+        for stem, data in (("Vocals", frames), ("Drums", bytes(len(frames)))):
+            out_name = f"{name}_(Vocals)_fake.wav".replace("Vocals", stem)
+            with wave.open(str(Path(self.output_dir) / out_name), "wb") as dst:
+                dst.setparams(params)
+                dst.writeframes(data)
+            outputs.append(out_name)
+        return outputs
+
+class TestStreamingSeparation(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.temp_dir = self.test_dir / "tmp"
+        self.temp_dir.mkdir()
+        self.work_dir = self.test_dir / "work"
+        # 10.5 s of a stereo ramp, so misplaced or duplicated samples are detectable
+        self.samples = [(i // 2) % 20000 - 10000 for i in range(2 * 10500)]
+        self.song = self.test_dir / "song.wav"
+        write_wav(self.song, self.samples)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def run_streaming(self, separator):
+        return StreamingSeparation(separator, self.song, self.work_dir, self.temp_dir, chunk_seconds=3, crossfade_seconds=0.5).run()
+
+    def test_plan_windows_overlap(self):
+        self.assertEqual(plan_windows(10500, RATE, 3, 0.5), [(0, 3500), (3000, 3500), (6000, 3500), (9000, 1500)])
+        self.assertEqual(plan_windows(2000, RATE, 3, 0.5), [(0, 2000)])
+        self.assertEqual(chunk_count(10.5, 3, 0.5), 4)
+        self.assertEqual(chunk_count(2.0, 3, 0.5), 1)
+
+    def test_stitched_stems_match_input(self):
+        separator = IdentitySeparator(self.temp_dir)
+        outputs = self.run_streaming(separator)
+
+        self.assertEqual(sorted(outputs), ["song_(Drums)_fake.wav", "song_(Vocals)_fake.wav"])
+        self.assertEqual(len(separator.chunks), 4)
+        vocals = read_wav(self.temp_dir / "song_(Vocals)_fake.wav")
+        self.assertEqual(len(vocals), len(self.samples))
+        # Crossfading two identical signals reproduces them (up to rounding)
+        self.assertTrue(all(abs(a - b) <= 1 for a, b in zip(vocals, self.samples)))
+        self.assertEqual(set(read_wav(self.temp_dir / "song_(Drums)_fake.wav")), {0})
+        self.assertFalse(self.work_dir.exists())
+        self.assertEqual(sorted(p.name for p in self.temp_dir.iterdir()), sorted(outputs))
+
+    def test_failed_run_resumes_from_last_finished_chunk(self):
+        with self.assertRaises(RuntimeError):
+            self.run_streaming(IdentitySeparator(self.temp_dir, fail_at=3))
+        self.assertTrue((self.work_dir / "manifest.json").exists())
+
+        separator = IdentitySeparator(self.temp_dir)
+        self.run_streaming(separator)
+
+        self.assertEqual(separator.chunks, ["chunk-00002", "chunk-00003"])
+        vocals = read_wav(self.temp_dir / "song_(Vocals)_fake.wav")
+        self.assertEqual(len(vocals), len(self.samples))
+        self.assertTrue(all(abs(a - b) <= 1 for a, b in zip(vocals, self.samples)))
+
+class TestEngineStreaming(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_engine_streams_and_renames(self):
+        song = self.test_dir / "live set.wav"
+        write_wav(song, [0] * (2 * 12 * RATE))
+        separators = []
+
+        def factory(**kwargs):
+            separator = IdentitySeparator(kwargs["output_dir"])
+            separator.load_model = MagicMock()
+            separator.demucs_params = {}
+            separators.append(separator)
+            return separator
+
+        engine = SeparationEngine(output_root=self.test_dir / "output", separator_factory=factory)
+        result = engine.separate(song, SeparationSettings("htdemucs.yaml", chunk_seconds=5))
+
+        self.assertEqual(sorted(result.files), ["drums.wav", "vocal.wav"])
+        # 0-7 s and 5-12 s
+        self.assertEqual(separators[0].chunks, ["chunk-00000", "chunk-00001"])
+        self.assertEqual(len(read_wav(result.output_dir / "vocal.wav")), 2 * 12 * RATE)
+        self.assertEqual(SeparationSettings(chunk_seconds=5).to_dict()["chunk_seconds"], 5)
+        self.assertNotIn("chunk_seconds", SeparationSettings().to_dict())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import sys
+import os
+import json
+import unittest
+import tempfile
+import shutil
+from pathlib import Path
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from natustem.engine import SeparationSettings
+from natustem.tuning import DEFAULT_BASE_RTF, RtfHistory, format_duration, tune
+
+class TestRtfHistory(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.path = self.test_dir / "rtf.json"
+        self.history = RtfHistory(self.path, host="test-host")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_no_history_uses_default_estimate(self):
+        prediction = self.history.predict("htdemucs.yaml", 1, 0.0, duration=100)
+        self.assertEqual(prediction.source, "default")
+        self.assertAlmostEqual(prediction.seconds, DEFAULT_BASE_RTF * 100)
+
+    def test_measured_combination_and_scaling(self):
+        self.history.record(SeparationSettings("htdemucs.yaml", 1, 0.5), processing_seconds=60, audio_seconds=120)
+
+        measured = self.history.predict("htdemucs.yaml", 1, 0.5, duration=200)
+        self.assertEqual(measured.source, "measured")
+        self.assertAlmostEqual(measured.seconds, 100)
+
+        # Twice the shifts, same overlap: twice the work
+        scaled = self.history.predict("htdemucs.yaml", 2, 0.5, duration=200)
+        self.assertEqual(scaled.source, "scaled")
+        self.assertAlmostEqual(scaled.seconds, 200)
+
+        # A bag of 4 models costs four times as much per pass
+        bag = self.history.predict("htdemucs_ft.yaml", 1, 0.5, duration=200)
+        self.assertAlmostEqual(bag.seconds, 400)
+
+        # Persisted per host, and another process sees the measurement
+        self.assertEqual(RtfHistory(self.path, host="test-host").predict("htdemucs.yaml", 1, 0.5).source, "measured")
+        self.assertEqual(RtfHistory(self.path, host="other-host").predict("htdemucs.yaml", 1, 0.5).source, "default")
+
+    def test_repeated_measurements_are_averaged(self):
+        settings = SeparationSettings("htdemucs.yaml", 1, 0.25)
+        self.history.record(settings, 100, 100)
+        self.history.record(settings, 200, 100)
+        self.assertAlmostEqual(self.history.predict("htdemucs.yaml", 1, 0.25).rtf, 1.3)
+
+    def test_tune_picks_best_settings_within_budget(self):
+        self.history.record(SeparationSettings("htdemucs.yaml", 1, 0.0), 30, 60)  # base RTF 0.5
+        shifts, overlap, prediction, fits = tune(self.history, "htdemucs.yaml", duration=60, budget_seconds=60)
+        self.assertTrue(fits)
+        self.assertLessEqual(prediction.seconds, 60)
+        # RTF 0.5 x shifts / (1 - overlap) <= 1  ->  shifts 1 with overlap 0.5
+        self.assertEqual((shifts, overlap), (1, 0.5))
+
+        shifts, overlap, prediction, fits = tune(self.history, "htdemucs.yaml", duration=600, budget_seconds=60)
+        self.assertFalse(fits)
+        self.assertEqual((shifts, overlap), (0, 0.1))
+
+    def test_writers_never_share_a_temp_file(self):
+        # Another process halfway through writing its copy of the history
+        other_tmp = self.test_dir / "rtf.json.tmp"
+        with open(other_tmp, "w") as other:
+            other.write('{"test-host": {"htdemucs_ft.yaml')
+            self.history.record(SeparationSettings("htdemucs.yaml", 1, 0.25), 50, 100)
+        self.assertEqual(other_tmp.read_text(), '{"test-host": {"htdemucs_ft.yaml')
+        self.assertIn("htdemucs.yaml|1|0.25", json.loads(self.path.read_text())["test-host"])
+        self.assertEqual(sorted(p.name for p in self.test_dir.iterdir()), ["rtf.json", "rtf.json.tmp"])
+
+    def test_format_duration(self):
+        self.assertEqual(format_duration(42), "42s")
+        self.assertEqual(format_duration(125), "2m 05s")
+        self.assertEqual(format_duration(3720), "1h 02m")
+
+if __name__ == '__main__':
+    unittest.main()
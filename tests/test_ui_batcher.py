@@ -0,0 +1,88 @@
+import sys
+import os
+import time
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+# Mock dependencies compatible with other tests
+mock_flet = MagicMock()
+mock_flet.Colors.WHITE = "white"
+mock_flet.Colors.GREY_400 = "grey400"
+sys.modules["flet"] = mock_flet
+
+mock_as = MagicMock()
+sys.modules["audio_separator"] = mock_as
+sys.modules["audio_separator.separator"] = mock_as.separator
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from main import AudioSeparatorApp, UiUpdateBatcher, LOG_MAX_LINES
+
+class TestUiUpdateBatcher(unittest.TestCase):
+    def test_flush_batches_lines_and_keeps_latest_status(self):
+        batches = []
+        batcher = UiUpdateBatcher(lambda lines, status, clear: batches.append((lines, status, clear)))
+
+        for i in range(500):
+            batcher.push_log(f"line {i}")
+            batcher.push_status(f"{i}%")
+        batcher.flush()
+        batcher.flush()
+
+        self.assertEqual(len(batches), 1, "Nothing new to show must not trigger a refresh")
+        lines, status, clear = batches[0]
+        self.assertEqual(len(lines), 500)
+        self.assertEqual(status, "499%")
+        self.assertFalse(clear)
+
+    def test_producers_never_wait_on_slow_gui(self):
+        release = threading.Event()
+        batches = []
+
+        def slow_flush(lines, status, clear):
+            batches.append(lines)
+            release.wait(5)
+
+        batcher = UiUpdateBatcher(slow_flush, max_fps=1000)
+        batcher.start()
+        try:
+            batcher.push_log("first")
+            time.sleep(0.05) # The batcher is now stuck inside slow_flush
+
+            start = time.perf_counter()
+            for i in range(10000):
+                batcher.push_log(f"line {i}")
+            elapsed = time.perf_counter() - start
+        finally:
+            release.set()
+            batcher.stop()
+
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual(len(batcher.pending_lines), LOG_MAX_LINES, "Pending lines must stay bounded")
+
+    def test_apply_ui_batch_appends_incrementally_and_trims(self):
+        app = AudioSeparatorApp(metrics_path=None)
+        app.page = MagicMock()
+        app.log_output = MagicMock()
+        app.log_output.controls = []
+        app.status_text = MagicMock()
+
+        app.apply_ui_batch([f"a{i}" for i in range(LOG_MAX_LINES)], None, False)
+        first_controls = list(app.log_output.controls)
+        app.apply_ui_batch(["b0", "b1"], "Working", False)
+
+        self.assertEqual(len(app.log_output.controls), LOG_MAX_LINES)
+        # Existing controls are reused, only the new lines are added
+        self.assertIs(app.log_output.controls[0], first_controls[2])
+        self.assertEqual(list(app.logs)[-1], "b1")
+        self.assertEqual(app.status_text.value, "Working")
+        self.assertEqual(app.page.update.call_count, 2)
+
+        app.apply_ui_batch([], None, True)
+        self.assertEqual(app.log_output.controls, [])
+        self.assertEqual(len(app.logs), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import sys
+import os
+import io
+import json
+import unittest
+import tempfile
+import shutil
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+# Add repo root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from natustem.cli import watch_folder
+from natustem.engine import SeparationEngine, SeparationSettings
+from natustem.watch import FolderWatcher, ProcessedLedger
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestFolderWatcher(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.input_dir = self.test_dir / "input"
+        self.input_dir.mkdir()
+        self.ledger_path = self.test_dir / "output" / ".watch-ledger.json"
+        self.clock = FakeClock()
+        self.watcher = FolderWatcher(self.input_dir, ProcessedLedger(self.ledger_path), settle_seconds=2, clock=self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_waits_until_file_stops_growing(self):
+        song = self.input_dir / "song.mp3"
+        song.write_bytes(b"x" * 10)
+        (self.input_dir / "notes.txt").write_text("ignored")
+        self.assertEqual(self.watcher.poll(), [])
+
+        self.clock.now = 1.5
+        with open(song, "ab") as f:
+            f.write(b"x" * 10)  # Still copying
+        self.assertEqual(self.watcher.poll(), [])
+
+        self.clock.now = 3.0
+        self.assertEqual(self.watcher.poll(), [])
+        self.clock.now = 3.6
+        self.assertEqual(self.watcher.poll(), [song])
+        # Handed over once per run
+        self.clock.now = 10
+        self.assertEqual(self.watcher.poll(), [])
+
+    def test_ledger_skips_processed_files_after_restart(self):
+        done = self.input_dir / "done.wav"
+        done.write_bytes(b"done")
+        changed = self.input_dir / "changed.wav"
+        changed.write_bytes(b"old")
+        ledger = ProcessedLedger(self.ledger_path)
+        ledger.record(done, "done")
+        ledger.record(changed, "done")
+        changed.write_bytes(b"replaced with a new take")
+
+        restarted = FolderWatcher(self.input_dir, ProcessedLedger(self.ledger_path), settle_seconds=2, clock=self.clock)
+        restarted.poll()
+        self.clock.now = 5
+        self.assertEqual(restarted.poll(), [changed])
+
+class TestWatchFolder(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_watch_folder_separates_and_records(self):
+        input_dir = self.test_dir / "input"
+        input_dir.mkdir()
+        (input_dir / "song.mp3").write_bytes(b"audio")
+        output_root = self.test_dir / "output"
+        separator = MagicMock(demucs_params={})
+
+        def fake_separate(path):
+            (Path(separator.output_dir) / "song_(Vocals)_htdemucs.wav").write_text("stem")
+            return ["song_(Vocals)_htdemucs.wav"]
+        separator.separate.side_effect = fake_separate
+        engine = SeparationEngine(output_root=output_root, separator_factory=lambda **kwargs: separator)
+
+        clock = FakeClock()
+        watcher = FolderWatcher(input_dir, ProcessedLedger(output_root / ".watch-ledger.json"), settle_seconds=1, clock=clock)
+        polls = []
+        original_poll = watcher.poll
+
+        def poll():
+            # Advance time on every scan and stop after a few
+            clock.now += 1
+            polls.append(clock.now)
+            if len(polls) == 4:
+                watcher.stop()
+            return original_poll()
+        watcher.poll = poll
+
+        stdout = io.StringIO()
+        with patch("sys.stdout", stdout):
+            watch_folder(input_dir, SeparationSettings("htdemucs.yaml"), engine, output_root=output_root, interval=0, watcher=watcher)
+
+        records = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual([r["status"] for r in records], ["ok"])
+        self.assertTrue((output_root / "song" / "vocal.wav").exists())
+        ledger = json.loads((output_root / ".watch-ledger.json").read_text())
+        self.assertEqual([entry["status"] for entry in ledger.values()], ["done"])
+        separator.load_model.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
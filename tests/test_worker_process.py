@@ -0,0 +1,127 @@
+import sys
+import os
+import threading
+import unittest
+import tempfile
+import shutil
+from pathlib import Path
+
+# Add repo root to path
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+
+from natustem.cancellation import CancelToken, JobCancelledError
+from natustem.engine import SeparationSettings
+from natustem.worker import WorkerCrashedError, WorkerProcess
+
+# Child that runs the real worker loop with a fake separator instead of audio_separator
+FAKE_WORKER = """
+import os
+import sys
+from pathlib import Path
+sys.path.insert(0, {root!r})
+os.chdir({cwd!r})
+from natustem import worker
+from natustem.engine import SeparationEngine
+
+class FakeSeparator:
+    def __init__(self, output_dir, **kwargs):
+        self.output_dir = output_dir
+        self.demucs_params = {{}}
+
+    def load_model(self, model_filename):
+        pass
+
+    def separate(self, path):
+        if "partial" in path:
+            # A stem is already written when the job is killed
+            (Path(self.output_dir) / (Path(path).stem + "_(Drums)_fake.wav")).write_text("partial")
+        if "crash" in path:
+            os._exit(3)
+        if "slow" in path:
+            import time
+            for i in range(200):
+                sys.stderr.write(f"\\r{{i // 2}}%|#| {{i}}/200 [00:01<00:09, 9.5seconds/s]")
+                time.sleep(0.05)
+        sys.stderr.write("\\r100%|#| 10.0/10.0 [00:01<00:00, 9.5seconds/s]")
+        name = Path(path).stem + "_(Vocals)_fake.wav"
+        (Path(self.output_dir) / name).write_text("stem")
+        return [name]
+
+channel = worker.setup_child()
+worker.serve(SeparationEngine(output_root={output!r}, separator_factory=FakeSeparator), sys.stdin.buffer, channel)
+"""
+
+class FakeWorkerProcess(WorkerProcess):
+    def command(self):
+        return [sys.executable, "-c", FAKE_WORKER.format(root=ROOT, cwd=str(self.output_root.parent), output=str(self.output_root))]
+
+class TestWorkerProcess(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.progress = []
+        self.worker = FakeWorkerProcess(output_root=self.test_dir / "output", progress_callback=self.progress.append)
+
+    def tearDown(self):
+        self.worker.stop()
+        shutil.rmtree(self.test_dir)
+
+    def test_jobs_round_trip_and_model_stays_warm(self):
+        logs = []
+        first = self.worker.separate(self.test_dir / "one.mp3", SeparationSettings("htdemucs.yaml"), log=logs.append)
+        pid = self.worker.process.pid
+        second = self.worker.separate(self.test_dir / "two.mp3", SeparationSettings("htdemucs.yaml"), log=logs.append)
+
+        self.assertEqual(first.files, ["vocal.wav"])
+        self.assertTrue((self.test_dir / "output" / "two" / "vocal.wav").exists())
+        self.assertEqual(second.files, ["vocal.wav"])
+        self.assertEqual(self.worker.process.pid, pid, "The worker must be reused between jobs")
+        self.assertEqual(self.worker.loaded_model_name, "htdemucs.yaml")
+        self.assertIn("Model htdemucs.yaml already loaded.", logs)
+        self.assertEqual([p.percent for p in self.progress], [100, 100])
+
+    def test_crash_fails_only_the_current_job(self):
+        with self.assertRaises(WorkerCrashedError):
+            self.worker.separate(self.test_dir / "crash.mp3", SeparationSettings("htdemucs.yaml"))
+        self.assertIsNone(self.worker.loaded_model_name)
+
+        result = self.worker.separate(self.test_dir / "after.mp3", SeparationSettings("htdemucs.yaml"))
+        self.assertEqual(result.files, ["vocal.wav"])
+
+    def test_cancel_keeps_worker_warm(self):
+        self.worker.separate(self.test_dir / "warmup.mp3", SeparationSettings("htdemucs.yaml"))
+        pid = self.worker.process.pid
+
+        token = CancelToken()
+        threading.Timer(0.3, token.cancel).start()
+        with self.assertRaises(JobCancelledError):
+            self.worker.separate(self.test_dir / "slow.mp3", SeparationSettings("htdemucs.yaml"), cancel_token=token)
+
+        self.assertEqual(self.worker.process.pid, pid)
+        self.assertEqual(self.worker.loaded_model_name, "htdemucs.yaml")
+        self.assertFalse((self.test_dir / "output" / "slow").exists())
+
+    def test_forced_cancel_kills_worker(self):
+        token = CancelToken()
+        threading.Timer(0.3, token.cancel, kwargs={"force": True}).start()
+        with self.assertRaises(JobCancelledError):
+            self.worker.separate(self.test_dir / "slow.mp3", SeparationSettings("htdemucs.yaml"), cancel_token=token)
+        self.assertFalse(self.worker.is_alive())
+
+    def test_killed_worker_leaves_no_partial_stems(self):
+        job_dir = self.test_dir / "output" / "slow-partial"
+        job_dir.mkdir(parents=True)
+        (job_dir / "notes.txt").write_text("mine")
+        token = CancelToken()
+        # Cancelled once the child reports progress, i.e. after it wrote its first stem
+        self.worker.progress_callback = lambda progress: token.cancel(force=True)
+        with self.assertRaises(JobCancelledError):
+            self.worker.separate(self.test_dir / "slow-partial.mp3", SeparationSettings("htdemucs.yaml"), cancel_token=token)
+        self.assertEqual(sorted(p.name for p in job_dir.iterdir()), ["notes.txt"])
+
+        with self.assertRaises(WorkerCrashedError):
+            self.worker.separate(self.test_dir / "crash-partial.mp3", SeparationSettings("htdemucs.yaml"))
+        self.assertFalse((self.test_dir / "output" / "crash-partial").exists())
+
+if __name__ == '__main__':
+    unittest.main()